@@ -0,0 +1,1225 @@
+"""Benchmarks for the dashboard's data loading hot paths.
+
+Runs against synthetic data served by a local fake cursor, so no Databricks
+warehouse is needed:
+
+    python benchmark.py --rows 1000000
+
+The suite times every loader, KPI computation and chart builder at several
+scales and writes the results as JSON; two result files can be compared to
+catch regressions between versions:
+
+    python benchmark.py --suite --scales 10k,100k,1m,50m --output after.json
+    python benchmark.py --compare before.json after.json
+
+The SQL aggregate timings and the app interaction latency harness
+additionally need duckdb (pip install duckdb). Behavior checks live in
+tests/ and run with pytest. The streaming memory check
+measures peak RSS in child processes, which needs Linux (/proc and resource).
+"""
+import argparse
+import functools
+import json
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+import main
+
+COUNTRIES = [
+    'United Kingdom', 'Germany', 'France', 'EIRE', 'Spain', 'Netherlands',
+    'Belgium', 'Switzerland', 'Portugal', 'Australia', 'Norway', 'Italy'
+]
+
+def generate_transactions(n_rows, n_customers=None, seed=42):
+    """Generate a synthetic frame matching the retail_transactions_silver query"""
+    rng = np.random.default_rng(seed)
+    n_customers = n_customers or max(n_rows // 25, 1)
+
+    start = np.datetime64('2009-12-01T00:00:00')
+    seconds = np.sort(rng.integers(0, 2 * 365 * 24 * 3600, n_rows))
+    invoice_date = start + seconds.astype('timedelta64[s]')
+
+    # Five lines per invoice, invoice numbers increasing with time; each
+    # invoice belongs to one customer and each customer to one country
+    invoice_index = np.arange(n_rows) // 5
+    invoice_no = (536365 + invoice_index).astype(str)
+    n_invoices = invoice_index[-1] + 1
+    invoice_customer = rng.integers(12346, 12346 + n_customers, n_invoices)
+    # Give every customer at least one invoice when there are enough invoices
+    seeded = min(n_invoices, n_customers)
+    invoice_customer[:seeded] = 12346 + rng.permutation(n_customers)[:seeded]
+    customer_id = invoice_customer[invoice_index]
+    customer_country = rng.choice(COUNTRIES, n_customers, p=[0.6] + [0.4 / 11] * 11)
+    quantity = rng.integers(1, 48, n_rows)
+    unit_price = np.round(rng.gamma(2.0, 2.0, n_rows), 2)
+    lag = rng.integers(0, 3 * 24 * 3600, n_rows).astype('timedelta64[s]')
+    ingestion = invoice_date + lag
+
+    invoice_ts = pd.to_datetime(invoice_date)
+    return pd.DataFrame({
+        'InvoiceNo': invoice_no,
+        'InvoiceDate': invoice_ts,
+        'Year': invoice_ts.year.astype('int32'),
+        'Month': invoice_ts.month.astype('int32'),
+        'CustomerID': customer_id.astype('float64'),
+        'TotalPrice': np.round(quantity * unit_price, 2),
+        'Quantity': quantity.astype('int32'),
+        'Country': customer_country[customer_id - 12346],
+        'IsCancellation': np.zeros(n_rows, dtype=bool),
+        'ingestion_timestamp': pd.to_datetime(ingestion),
+        'processing_date': pd.to_datetime(ingestion).normalize(),
+    })
+
+def generate_segment_summary(transactions):
+    """Rows of the warehouse segment_summary table, scored from synthetic transactions"""
+    return main.summarize_segments(main.compute_customer_rfm(transactions))
+
+class FakeCursor:
+    """Minimal stand-in for a databricks-sql cursor serving a fixed result set"""
+
+    def __init__(self, df, latency=0.0, throughput=None):
+        self._df = df
+        self._throughput = throughput
+        self._table = pa.Table.from_pandas(df, preserve_index=False)
+        self._latency = latency
+        self._offset = 0
+        self.description = [(name, str(field.type), None, None, None, None, None)
+                            for name, field in zip(self._table.column_names, self._table.schema)]
+
+    def execute(self, query, parameters=None):
+        time.sleep(self._latency)
+        self._offset = 0
+        if parameters and 'watermark' in parameters:
+            # Serve only the incremental slice, as the warehouse would
+            recent = self._df[self._df['ingestion_timestamp'] >= parameters['watermark']]
+            self._table = pa.Table.from_pandas(recent, preserve_index=False)
+
+    def fetchall(self):
+        # The connector materialises one Python row object per record
+        remaining = self._table.slice(self._offset)
+        self._offset = self._table.num_rows
+        return list(zip(*(column.to_pylist() for column in remaining.columns)))
+
+    def fetchmany_arrow(self, size):
+        batch = self._table.slice(self._offset, size)
+        self._offset += batch.num_rows
+        if self._throughput:
+            time.sleep(batch.num_rows / self._throughput)
+        return batch
+
+    def close(self):
+        pass
+
+class FakeConnection:
+    """Connection stand-in that hands out FakeCursors over the connector's current data"""
+
+    def __init__(self, connector):
+        self._connector = connector
+        self.open = True
+
+    def cursor(self):
+        return FakeCursor(self._connector.df, latency=self._connector.query_latency,
+                          throughput=self._connector.throughput)
+
+    def close(self):
+        self.open = False
+
+class FakeConnector:
+    """Stand-in for the databricks.sql module with a configurable connect latency"""
+
+    OperationalError = ConnectionError
+
+    def __init__(self, df, connect_latency=0.0, query_latency=0.0, throughput=None):
+        self.df = df
+        self.throughput = throughput  # simulated transfer rate in rows per second
+        self.connect_latency = connect_latency
+        self.query_latency = query_latency
+        self.connects = 0
+
+    def connect(self, **kwargs):
+        time.sleep(self.connect_latency)
+        self.connects += 1
+        return FakeConnection(self)
+
+class GeneratedCursor:
+    """Cursor streaming synthetic transactions generated batch by batch, so the full result never exists"""
+
+    def __init__(self, n_rows):
+        self._n_rows = n_rows
+        columns = generate_transactions(1).columns
+        self.description = [(name, None, None, None, None, None, None) for name in columns]
+
+    def execute(self, query, parameters=None):
+        self._remaining = self._n_rows
+        self._batches = 0
+        self._invoices = 0
+
+    def fetchmany_arrow(self, size):
+        rows = min(size, self._remaining)
+        if rows == 0:
+            return pa.table({})
+        batch = generate_transactions(rows, seed=self._batches)
+        # Keep invoice numbers unique across batches
+        batch['InvoiceNo'] = (batch['InvoiceNo'].astype('int64') + self._invoices).astype(str)
+        self._invoices += rows // 5 + 1
+        self._remaining -= rows
+        self._batches += 1
+        return pa.Table.from_pandas(batch, preserve_index=False)
+
+    def close(self):
+        pass
+
+class GeneratedConnector:
+    """Stand-in for the databricks.sql module whose every query streams n_rows synthetic transactions"""
+
+    OperationalError = ConnectionError
+
+    def __init__(self, n_rows):
+        self.n_rows = n_rows
+
+    def connect(self, **kwargs):
+        return self
+
+    def cursor(self):
+        return GeneratedCursor(self.n_rows)
+
+    @property
+    def open(self):
+        return True
+
+    def close(self):
+        pass
+
+class DuckDBCursor(main.LocalCursor):
+    """Local engine cursor adding simulated warehouse time to queries that touch a slow table"""
+
+    def __init__(self, connection, latency=None):
+        super().__init__(connection)
+        self._latency = latency or {}
+
+    def execute(self, query, parameters=None):
+        time.sleep(max((seconds for table, seconds in self._latency.items() if table in query), default=0))
+        super().execute(query, parameters)
+
+class DuckDBConnection(main.LocalConnection):
+    """Local engine connection handing out DuckDBCursors with the connector's latency"""
+
+    def __init__(self, database, latency=None):
+        super().__init__(database)
+        self._latency = latency
+
+    def cursor(self):
+        return DuckDBCursor(self._database, self._latency)
+
+class DuckDBConnector:
+    """Stand-in for the databricks.sql module running the app's real queries in DuckDB
+
+    latency maps a table name to extra seconds added to every query that reads it.
+    """
+
+    OperationalError = ConnectionError
+
+    def __init__(self, tables, latency=None):
+        import duckdb
+
+        self.latency = latency or {}
+        self.database = duckdb.connect()
+        for name, frame in tables.items():
+            self.database.register('source_frame', frame)
+            self.database.execute(f"CREATE TABLE {name} AS SELECT * FROM source_frame")
+            self.database.unregister('source_frame')
+
+    def connect(self, **kwargs):
+        return DuckDBConnection(self.database, self.latency)
+
+def measure(fn):
+    """Return (seconds, peak traced Python bytes, result) for a freshly built callable
+
+    Timing and allocation tracing run separately because tracemalloc slows the
+    Python-object-heavy paths far more than the columnar ones.
+    """
+    start = time.perf_counter()
+    result = fn()()
+    elapsed = time.perf_counter() - start
+
+    call = fn()
+    tracemalloc.start()
+    call()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak, result
+
+def bench_fetch_modes(df):
+    """Compare the row-tuple and Arrow fetch paths on the same result set"""
+    def fetch_with(mode):
+        cursor = FakeCursor(df)
+        cursor.execute('SELECT 1')
+        return lambda: main.fetch_dataframe(cursor, mode=mode)
+
+    results = {}
+    for mode in ('rows', 'arrow'):
+        elapsed, peak, frame = measure(lambda: fetch_with(mode))
+        results[mode] = (elapsed, peak, frame)
+        print(f"  fetch[{mode:>5}]  {elapsed:8.3f}s  peak python alloc {peak / 1e6:9.1f} MB  "
+              f"frame {frame.memory_usage(deep=True).sum() / 1e6:9.1f} MB")
+
+    speedup = results['rows'][0] / results['arrow'][0]
+    print(f"  arrow speedup: {speedup:.1f}x")
+    return results
+
+def bench_connection_pool(df, sessions=8, queries_per_session=5, connect_latency=0.2):
+    """Compare a connection per query with the shared pool across concurrent sessions"""
+    from concurrent.futures import ThreadPoolExecutor
+
+    small = df.head(1000)
+
+    def unpooled():
+        connector = FakeConnector(small, connect_latency=connect_latency)
+
+        def session():
+            for _ in range(queries_per_session):
+                connection = connector.connect()
+                cursor = connection.cursor()
+                cursor.execute('SELECT 1')
+                main.fetch_dataframe(cursor)
+                connection.close()
+        return connector, session
+
+    def pooled():
+        connector = FakeConnector(small, connect_latency=connect_latency)
+        pool = main.ConnectionPool(connector, max_size=4)
+
+        def session():
+            for _ in range(queries_per_session):
+                with pool.connection() as connection:
+                    cursor = connection.cursor()
+                    cursor.execute('SELECT 1')
+                    main.fetch_dataframe(cursor)
+        return connector, session, pool
+
+    for label, setup in (('per-query', unpooled), ('pooled', pooled)):
+        connector, session, *pool = setup()
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=sessions) as executor:
+            for future in [executor.submit(session) for _ in range(sessions)]:
+                future.result()
+        elapsed = time.perf_counter() - start
+        line = f"  connections[{label:>9}]  {elapsed:8.3f}s  {connector.connects:>3} connects"
+        if pool:
+            metrics = pool[0].metrics()
+            line += (f"  hit rate {metrics['hit_rate']:.0%}"
+                     f"  avg wait {metrics['avg_checkout_wait_seconds'] * 1000:.0f} ms")
+        print(line)
+
+def transaction_cache(snapshots=None):
+    """Transaction DatasetCache wired like the app's, refreshing on every get()"""
+    return main.DatasetCache(
+        'retail_transactions_silver', main.query_transactions,
+        fetch_since=lambda watermark, on_batch=None: main.query_transactions(since=watermark, on_batch=on_batch),
+        merge=main.merge_transactions, watermark_column='ingestion_timestamp',
+        refresh_seconds=0, snapshots=snapshots
+    )
+
+def bench_cache_keys(df, reruns=20):
+    """Compare a cache hit keyed on the DataFrame argument with one keyed on a DatasetHandle"""
+    import streamlit as st
+
+    @st.cache_data
+    def freshness_by_frame(frame):
+        return main.get_data_freshness_metrics(frame)
+
+    freshness_by_frame(df)
+    start = time.perf_counter()
+    for _ in range(reruns):
+        freshness_by_frame(df)
+    by_frame = (time.perf_counter() - start) / reruns
+
+    main.sql = FakeConnector(df)
+    main.get_connection_pool.clear()
+    cache = transaction_cache()
+    cache.refresh_seconds = 3600
+    cache.handle().derived('freshness', main.get_data_freshness_metrics)
+    start = time.perf_counter()
+    for _ in range(reruns):
+        cache.handle().derived('freshness', main.get_data_freshness_metrics)
+    by_handle = (time.perf_counter() - start) / reruns
+    calls, hits, key_seconds, _ = cache.memo_stats['freshness']
+    print(f"  hit[st.cache_data(df)]  {by_frame * 1000:8.2f} ms per rerun")
+    print(f"  hit[ DatasetHandle   ]  {by_handle * 1000:8.2f} ms per rerun  "
+          f"({key_seconds / calls * 1e6:.1f} µs key, {hits}/{calls} hits, "
+          f"fingerprint {cache.fingerprint_seconds * 1000:.2f} ms once per load)")
+
+def bench_snapshot_cold_start(df):
+    """Compare a cold start from the warehouse with one served from a disk snapshot"""
+    import tempfile
+
+    connector = FakeConnector(df, throughput=1_000_000)
+    main.sql = connector
+    main.get_connection_pool.clear()
+
+    with tempfile.TemporaryDirectory() as directory:
+        store = main.SnapshotStore(directory)
+        start = time.perf_counter()
+        transaction_cache(snapshots=store).get()
+        print(f"  cold start[warehouse]  {time.perf_counter() - start:8.3f}s")
+
+        # Let the background snapshot write finish before the next "process" starts
+        while not store.usage():
+            time.sleep(0.01)
+
+        cache = transaction_cache(snapshots=store)
+        start = time.perf_counter()
+        cache.get()
+        print(f"  cold start[ snapshot]  {time.perf_counter() - start:8.3f}s  "
+              f"{sum(store.usage().values()) / 1e6:,.1f} MB on disk")
+        while cache.status()['refreshing']:
+            time.sleep(0.01)
+
+def bench_incremental_refresh(df, new_fraction=0.02):
+    """Compare a full reload with a watermark refresh after a small batch of new rows
+
+    The fake connector transfers at a simulated 1M rows/s so the fetch size shows up.
+    """
+    ingested = df.sort_values('ingestion_timestamp', ignore_index=True)
+    cutoff = int(len(ingested) * (1 - new_fraction))
+    connector = FakeConnector(ingested.iloc[:cutoff], throughput=1_000_000)
+    main.sql = connector
+    main.get_connection_pool.clear()
+
+    cache = transaction_cache()
+    cache.get()
+    connector.df = ingested
+
+    start = time.perf_counter()
+    cache.get()
+    incremental = time.perf_counter() - start
+    print(f"  refresh[incremental]  {incremental:8.3f}s  {cache.last_refresh_rows:>9,} rows fetched")
+
+    start = time.perf_counter()
+    full = cache.get(full_reload=True)
+    elapsed = time.perf_counter() - start
+    print(f"  refresh[       full]  {elapsed:8.3f}s  {len(full):>9,} rows fetched")
+
+def run_aggregate_queries_duckdb(df):
+    """Run AGGREGATE_QUERIES against the frame in an in-process DuckDB stand-in"""
+    import duckdb
+
+    connection = duckdb.connect()
+    connection.register('transactions', df)
+    aggregates = {}
+    for name, query in main.AGGREGATE_QUERIES.items():
+        start = time.perf_counter()
+        aggregates[name] = connection.execute(
+            query.format(table='transactions', filter=main.TRANSACTION_FILTER)
+        ).df()
+        print(f"  sql[{name:>14}]  {time.perf_counter() - start:8.3f}s  {len(aggregates[name]):>8,} rows")
+    connection.close()
+    return main.normalize_insight_aggregates(aggregates)
+
+def bench_aggregate_queries(df):
+    """Time the SQL aggregates against the pandas reference implementations
+
+    Their parity is covered by tests/test_aggregates.py.
+    """
+    start = time.perf_counter()
+    main.compute_insight_aggregates(df)
+    print(f"  pandas reference  {time.perf_counter() - start:8.3f}s")
+    run_aggregate_queries_duckdb(df)
+
+def assert_aggregates_equal(expected, actual):
+    """Compare SQL insight aggregates with the pandas reference ones"""
+    for name, frame in expected.items():
+        result = actual[name]
+        if name == 'country':
+            # Ties in revenue are not ordered deterministically
+            frame, result = frame.sort_values('Country'), result.sort_values('Country')
+        pd.testing.assert_frame_equal(
+            frame.reset_index(drop=True), result.reset_index(drop=True),
+            check_dtype=False, check_exact=False, rtol=1e-9
+        )
+
+def bench_aggregate_cube(df):
+    """Time building and rolling up the cube against the direct pandas aggregates"""
+    start = time.perf_counter()
+    main.compute_insight_aggregates(df)
+    direct = time.perf_counter() - start
+
+    start = time.perf_counter()
+    cube = main.build_aggregate_cube(df)
+    built = time.perf_counter() - start
+
+    start = time.perf_counter()
+    main.aggregates_from_cube(cube)
+    rolled = time.perf_counter() - start
+    print(f"  direct groupbys {direct:8.3f}s  cube build {built:8.3f}s  rollup {rolled:8.3f}s")
+
+def cube_bytes(cube):
+    """Bytes an aggregate cube holds in its frames and sketches"""
+    total = 0
+    for part in cube.values():
+        if isinstance(part, main.DistinctSketches):
+            total += part.registers.nbytes + part.keys.memory_usage(deep=True).sum()
+        elif isinstance(part, pd.Series):
+            total += part.memory_usage(deep=True)
+        else:
+            total += part.memory_usage(deep=True).sum()
+    return int(total)
+
+def bench_approximate_distinct(df):
+    """Compare the sketched cube's build time, memory and distinct count errors with the exact cube"""
+    results = {}
+    for approximate in (False, True):
+        seconds, peak, cube = measure(lambda: functools.partial(main.build_aggregate_cube, df, approximate))
+        start = time.perf_counter()
+        results[approximate] = main.aggregates_from_cube(cube)
+        rolled = time.perf_counter() - start
+        print(f"  cube[{'approx' if approximate else ' exact'}] build {seconds:8.3f}s  rollup {rolled:8.3f}s  "
+              f"peak {peak / 1e6:8.1f} MB  held {cube_bytes(cube) / 1e6:8.1f} MB")
+
+    exact, approx = results[False], results[True]
+    for name, key, columns in (('totals', None, ['Customers', 'Orders']),
+                               ('monthly', 'Month', ['UniqueCustomers', 'Orders']),
+                               ('country', 'Country', ['Customers', 'Orders'])):
+        expected, actual = exact[name], approx[name]
+        if key is not None:
+            expected, actual = expected.set_index(key), actual.set_index(key).reindex(expected[key])
+        for column in columns:
+            error = np.abs(actual[column].to_numpy() / expected[column].to_numpy() - 1).max()
+            print(f"  {name:<8} {column:<16} max error {error:6.2%}")
+    print(f"  standard error {approx['distinct_error']:.2%}")
+
+def bench_cohort_engine(df):
+    """Compare the per-row Period cohort path with the vectorized engine"""
+    start = time.perf_counter()
+    main.retention_from_counts(main.cohort_counts(df))
+    legacy = time.perf_counter() - start
+
+    start = time.perf_counter()
+    main.cohort_retention(df, grain='M', horizon=12, max_cohorts=12)
+    engine = time.perf_counter() - start
+    print(f"  cohort[period apply]  {legacy:8.3f}s")
+    print(f"  cohort[      engine]  {engine:8.3f}s  speedup {legacy / engine:.1f}x")
+
+    for grain in ('W', 'Q'):
+        start = time.perf_counter()
+        matrix = main.cohort_retention(df, grain=grain, horizon=12)
+        print(f"  cohort[   engine {grain}]  {time.perf_counter() - start:8.3f}s  {matrix.shape}")
+
+def legacy_freshness_lag(df):
+    """The copy-and-groupby processing lag the freshness metrics used to compute"""
+    df_temp = df.copy()
+    df_temp['InvoiceDate'] = pd.to_datetime(df_temp['InvoiceDate'])
+    df_temp['ingestion_timestamp'] = pd.to_datetime(df_temp['ingestion_timestamp'])
+    processing_lag = df_temp.groupby('InvoiceDate').agg({
+        'ingestion_timestamp': 'first',
+        'processing_date': 'first'
+    }).reset_index()
+    return (processing_lag['ingestion_timestamp'] - processing_lag['InvoiceDate']).dt.days.mean()
+
+def bench_freshness(df):
+    """Compare the old freshness lag computation with the one-pass histogram metrics"""
+    start = time.perf_counter()
+    legacy_freshness_lag(df)
+    legacy = time.perf_counter() - start
+
+    start = time.perf_counter()
+    main.get_data_freshness_metrics(df)
+    engine = time.perf_counter() - start
+    print(f"  freshness[copy+groupby]  {legacy:8.3f}s")
+    print(f"  freshness[   histogram]  {engine:8.3f}s  speedup {legacy / engine:.1f}x")
+
+def legacy_growth_chart(new_customers):
+    """The customer growth chart as built before resampling: one bar and one line point per first-purchase time"""
+    daily = new_customers.sort_values('Date')
+    fig = main.make_subplots(specs=[[{"secondary_y": True}]])
+    fig.add_trace(main.go.Scatter(x=daily['Date'], y=daily['NewCustomers'].cumsum(), fill='tozeroy'),
+                  secondary_y=False)
+    fig.add_trace(main.go.Bar(x=daily['Date'], y=daily['NewCustomers']), secondary_y=True)
+    return fig
+
+def bench_growth_chart(df):
+    """Figure payload and build + serialize time of the customer growth chart, full range and zoomed"""
+    import plotly.io as pio
+
+    new_customers = main.first_purchase_counts(df)
+    last = new_customers['Date'].max().normalize()
+    cases = [
+        ('per-timestamp', lambda: legacy_growth_chart(new_customers)),
+        ('resampled', lambda: main.create_customer_growth_chart(new_customers)),
+        ('zoom 90 days', lambda: main.create_customer_growth_chart(
+            new_customers, (last - pd.Timedelta(days=89), last))),
+    ]
+    for label, build in cases:
+        start = time.perf_counter()
+        payload = pio.to_json(build())
+        elapsed = time.perf_counter() - start
+        points = sum(len(trace.x) for trace in pio.from_json(payload).data)
+        print(f"  growth[{label:>13}]  {elapsed:8.3f}s  {len(payload) / 1e3:10,.1f} kB  {points:>8,} points")
+
+def chart_inputs(df, segments=None):
+    """Every chart the app draws: chart id -> (builder, the data it is called with)"""
+    aggregates = main.aggregates_from_cube(main.build_aggregate_cube(df))
+    segments = generate_segment_summary(df) if segments is None else segments
+    retention = main.cohort_retention(df)
+    return {
+        'customer_growth': (main.create_customer_growth_chart, aggregates['first_purchase']),
+        'revenue_trend': (main.create_revenue_trend_chart, aggregates['monthly']),
+        'active_customers': (main.create_active_customers_chart, aggregates['monthly']),
+        'country_revenue': (main.create_country_revenue_chart, aggregates['country']),
+        'cohort_retention': (main.create_customer_cohort_chart, retention),
+        'segment_count': (main.create_segment_count_chart, segments),
+        'segment_revenue': (main.create_segment_revenue_chart, segments),
+        'customer_distribution': (main.create_customer_distribution_pie, segments),
+        'revenue_distribution': (main.create_revenue_distribution_pie, segments),
+        'rfm_heatmap': (main.create_rfm_heatmap, segments),
+    }
+
+def bench_figure_cache(df, reruns=5):
+    """Time the insights and RFM charts rebuilt on every rerun against the figure cache"""
+    charts = chart_inputs(df)
+    for builder, data in charts.values():
+        builder(data)  # warm up plotly's templates and validators
+
+    start = time.perf_counter()
+    for _ in range(reruns):
+        for builder, data in charts.values():
+            builder(data)
+    uncached = (time.perf_counter() - start) / reruns
+
+    cache = main.FigureCache()
+    for chart_id, (builder, data) in charts.items():
+        cache.figure(chart_id, 1, None, lambda: builder(data))
+    start = time.perf_counter()
+    for _ in range(reruns):
+        for chart_id, (builder, data) in charts.items():
+            cache.figure(chart_id, 1, None, lambda: builder(data))
+    cached = (time.perf_counter() - start) / reruns
+    entries, used = cache.usage()
+    print(f"  rerun[rebuild]  {uncached * 1000:8.1f} ms  {len(charts)} charts")
+    print(f"  rerun[ cached]  {cached * 1000:8.1f} ms  speedup {uncached / cached:.1f}x  "
+          f"{entries} figures, {used / 1e6:.2f} MB")
+
+def bench_tracing(df, reruns=5):
+    """Time a figure-cache rerun of every chart with stage tracing off and on, then render its exports"""
+    charts = chart_inputs(df)
+    tracer = main.get_tracer()
+    enabled = tracer.enabled
+
+    def rerun():
+        main.get_figure_cache().clear()
+        for chart_id, (builder, data) in charts.items():
+            main.cached_figure(chart_id, 1, None, builder, data)
+            main.cached_figure(chart_id, 1, None, builder, data)
+
+    try:
+        # Interleaved and best-of, since a rerun varies far more than tracing costs
+        timings = {False: float('inf'), True: float('inf')}
+        rerun()  # warm up
+        for _ in range(reruns):
+            for tracer.enabled in (False, True):
+                with tracer.run():
+                    start = time.perf_counter()
+                    rerun()
+                    timings[tracer.enabled] = min(timings[tracer.enabled], time.perf_counter() - start)
+        spans = len(tracer.current_run()['spans'])
+        exports = (f"  exports: {len(tracer.prometheus()):,} bytes Prometheus text, "
+                   f"{len(tracer.json_lines()):,} bytes JSON lines over {len(tracer.runs)} runs")
+        per_span = {}
+        for tracer.enabled in (False, True):
+            start = time.perf_counter()
+            for _ in range(10_000):
+                with main.trace_stage('benchmark'):
+                    pass
+            per_span[tracer.enabled] = (time.perf_counter() - start) / 10_000
+        print(f"  rerun[untraced] {timings[False] * 1000:8.1f} ms  {per_span[False] * 1e6:.1f} µs per stage")
+        print(f"  rerun[  traced] {timings[True] * 1000:8.1f} ms  {per_span[True] * 1e6:.1f} µs per stage, "
+              f"{spans} stages = {spans * per_span[True] * 1000:.2f} ms")
+        print(exports)
+    finally:
+        tracer.enabled = enabled
+        main.get_figure_cache().clear()
+
+def bench_concurrent_loading(df, rfm_latency=0.3, transaction_latency=1.5):
+    """Time to the RFM view's data and to all data, loading one after the other and concurrently"""
+    import streamlit as st
+
+    segments = generate_segment_summary(df)
+    connector = DuckDBConnector(
+        {'transactions': df, 'segment_summary': segments},
+        latency={'segment_summary': rfm_latency, 'transactions': transaction_latency}
+    )
+    saved = {name: getattr(main, name) for name in ('sql', 'TRANSACTIONS_TABLE', 'INSIGHTS_AGGREGATION', 'SNAPSHOT_DIR')}
+    main.sql, main.TRANSACTIONS_TABLE, main.INSIGHTS_AGGREGATION, main.SNAPSHOT_DIR = connector, 'transactions', 'pandas', ''
+    os.environ.update(DATABASE_NAME='main', TABLE_NAME='segment_summary')
+
+    try:
+        for label, concurrent in (('sequential', False), ('concurrent', True)):
+            st.cache_resource.clear()
+            start = time.perf_counter()
+            if concurrent:
+                main.start_dataset_loads()
+            main.load_rfm_data()
+            rfm_ready = time.perf_counter() - start
+            main.load_transaction_data()
+            all_ready = time.perf_counter() - start
+            print(f"  load[{label}]  RFM ready {rfm_ready:6.2f}s  all ready {all_ready:6.2f}s")
+    finally:
+        for name, value in saved.items():
+            setattr(main, name, value)
+    print(f"  (simulated warehouse latency: segments {rfm_latency}s, transactions {transaction_latency}s)")
+
+def bench_filtered_insights(df, transaction_latency=0.5):
+    """Time fetching the server-side insights predicates versus reusing a covering cache"""
+    connector = DuckDBConnector({'transactions': df}, latency={'transactions': transaction_latency})
+    saved = {name: getattr(main, name) for name in ('sql', 'TRANSACTIONS_TABLE')}
+    main.sql, main.TRANSACTIONS_TABLE = connector, 'transactions'
+    main.get_connection_pool.clear()
+
+    first, last = df['InvoiceDate'].min(), df['InvoiceDate'].max()
+    wide = ((first + pd.Timedelta(days=100)).date(), (last - pd.Timedelta(days=100)).date(), None)
+    narrow = ((first + pd.Timedelta(days=200)).date(), (last - pd.Timedelta(days=250)).date(),
+              tuple(sorted(COUNTRIES[:3])))
+    try:
+        store = main.TransactionStore(transaction_cache())
+        for label, predicate in (('fetch wide', wide), ('fetch narrow', narrow)):
+            store.clear()
+            start = time.perf_counter()
+            handle = store.handle(predicate)
+            print(f"  {label:<14}  {time.perf_counter() - start:8.3f}s  {len(handle.frame):>9,} rows")
+        store.clear()
+        store.handle(wide)
+        start = time.perf_counter()
+        handle = store.handle(narrow)
+        print(f"  {'reuse wide':<14}  {time.perf_counter() - start:8.3f}s  {len(handle.frame):>9,} rows")
+    finally:
+        for name, value in saved.items():
+            setattr(main, name, value)
+        main.get_connection_pool.clear()
+    print(f"  (simulated warehouse latency: transactions {transaction_latency}s)")
+
+def streaming_rss_growth(n_rows, budget, materialize=False):
+    """Growth of this process's peak RSS in bytes while loading n_rows streamed synthetic transactions
+
+    Meant to run in a fresh process (see --streaming-rss) so earlier work does not set the peak.
+    """
+    import resource
+
+    main.TRANSACTIONS_TABLE = 'transactions'
+    # Warm up imports and allocator pools before taking the baseline
+    main.sql = GeneratedConnector(20_000)
+    main.fold_transactions(memory_budget=budget)
+    main.get_connection_pool.clear()
+    main.sql = GeneratedConnector(n_rows)
+
+    # Measured from the resident size now, since the peak may still hold the warm-up's.
+    # The peak is VmHWM rather than ru_maxrss, which a child inherits from its parent's
+    # peak across exec and would report the benchmark run's largest allocation.
+    with open('/proc/self/statm') as statm:
+        baseline = int(statm.read().split()[1]) * resource.getpagesize()
+    if materialize:
+        main.query_transactions()
+    else:
+        main.fold_transactions(memory_budget=budget)
+    with open('/proc/self/status') as status:
+        peak = next(int(line.split()[1]) for line in status if line.startswith('VmHWM:'))
+    return peak * 1024 - baseline
+
+def bench_streaming_memory(n_rows=2_000_000, budget=128 * 1024 * 1024):
+    """Peak memory of folding a large transaction stream versus materializing it
+
+    tests/test_streaming.py checks the streamed peak against the budget.
+    """
+    growth = {}
+    for label, flags in (('stream', []), ('materialize', ['--materialize'])):
+        start = time.perf_counter()
+        output = subprocess.run(
+            [sys.executable, __file__, '--streaming-rss', str(n_rows), '--budget', str(budget)] + flags,
+            capture_output=True, text=True, check=True
+        ).stdout
+        growth[label] = int(output.split()[-1])
+        print(f"  {label:<12}  {time.perf_counter() - start:8.2f}s  peak RSS +{growth[label] / 1e6:8.1f} MB")
+    print(f"  stream: +{growth['stream'] / 1e6:.1f} MB of the {budget / 1e6:.0f} MB budget for {n_rows:,} rows")
+
+def bench_streaming_fold(df):
+    """Time folding the transactions into the streamed aggregates and report the state it kept"""
+    saved = {name: getattr(main, name) for name in ('sql', 'TRANSACTIONS_TABLE')}
+    main.sql, main.TRANSACTIONS_TABLE = DuckDBConnector({'transactions': df}), 'transactions'
+    main.get_connection_pool.clear()
+    try:
+        start = time.perf_counter()
+        result = main.fold_transactions(memory_budget=32 * 1024 * 1024)
+        stats = result['stream_stats']
+        print(f"  fold              {time.perf_counter() - start:8.3f}s  {stats['batches']} batches, "
+              f"state peak {stats['peak_state_bytes'] / 1e6:.1f} MB")
+    finally:
+        for name, value in saved.items():
+            setattr(main, name, value)
+        main.get_connection_pool.clear()
+
+def write_local_dataset(directory, df):
+    """Write transactions, Hive-partitioned by Year/Month, and their segment summary for DATA_SOURCE=local"""
+    os.makedirs(directory, exist_ok=True)
+    df.to_parquet(os.path.join(directory, 'retail_analytics.dlt.retail_transactions_silver'),
+                  partition_cols=['Year', 'Month'], index=False)
+    segments = generate_segment_summary(df)
+    segments.to_parquet(os.path.join(directory, 'retail_analytics.dlt.segment_summary.parquet'), index=False)
+
+def bench_local_source(df):
+    """The app's queries end to end on the embedded DuckDB engine over Parquet files"""
+    import tempfile
+    import streamlit as st
+
+    saved = {name: getattr(main, name) for name in ('DATA_SOURCE', 'LOCAL_DATA_DIR', 'TRANSACTIONS_TABLE', 'SNAPSHOT_DIR')}
+    with tempfile.TemporaryDirectory() as directory:
+        start = time.perf_counter()
+        write_local_dataset(directory, df)
+        print(f"  write parquet     {time.perf_counter() - start:8.3f}s")
+
+        main.DATA_SOURCE, main.LOCAL_DATA_DIR, main.SNAPSHOT_DIR = 'local', directory, ''
+        main.TRANSACTIONS_TABLE = 'retail_analytics.dlt.retail_transactions_silver'
+        os.environ.update(DATABASE_NAME='retail_analytics', TABLE_NAME='dlt.segment_summary')
+        st.cache_resource.clear()
+        last = df['InvoiceDate'].max().date()
+        recent = (last - pd.Timedelta(days=90), None, None)
+        try:
+            steps = [
+                ('segment summary', main.query_rfm_segments),
+                ('transactions', main.query_transactions),
+                ('last 90 days', lambda: main.query_transactions(predicate=recent)),
+                ('sql aggregates', main.query_insight_aggregates),
+                ('stream fold', main.fold_transactions),
+            ]
+            results = {}
+            for label, step in steps:
+                start = time.perf_counter()
+                results[label] = step()
+                rows = results[label]['stream_stats']['rows'] if label == 'stream fold' else len(results[label])
+                print(f"  local[{label:>15}]  {time.perf_counter() - start:8.3f}s  {rows:>9,}")
+        finally:
+            for name, value in saved.items():
+                setattr(main, name, value)
+            st.cache_resource.clear()
+
+def run_interactions(app, interactions):
+    """Run the app, then apply each (label, action) and time the rerun it triggers"""
+    start = time.perf_counter()
+    app.run()
+    timings = [('first paint', time.perf_counter() - start)]
+    for label, action in interactions:
+        action(app)
+        start = time.perf_counter()
+        app.run()
+        timings.append((label, time.perf_counter() - start))
+        if app.exception:
+            raise RuntimeError(app.exception[0].value)
+    return timings
+
+def bench_app_latency(df):
+    """Headless per-interaction latency of the RFM filters with full-script reruns in each navigation mode
+
+    Fragment reruns of the same filters are exercised against the real app in
+    tests/test_app.py.
+    """
+    import databricks.sql
+    import streamlit as st
+    from streamlit.testing.v1 import AppTest
+
+    segments = generate_segment_summary(df)
+    connector = DuckDBConnector({'transactions': df, 'segment_summary': segments})
+    original_connect = databricks.sql.connect
+    databricks.sql.connect = connector.connect
+    main.sql = connector
+    os.environ.update(TRANSACTIONS_TABLE='transactions', DATABASE_NAME='main', TABLE_NAME='segment_summary',
+                      SNAPSHOT_DIR='', PREFETCH_VIEWS='false')
+    custom = segments['Segment'].tolist()[:2]
+    interactions = [
+        ('filter: custom', lambda app: app.radio(key='rfm_filter').set_value("Custom Selection")),
+        ('segments: 2', lambda app: app.multiselect(key='rfm_segments').set_value(custom)),
+        ('filter: all', lambda app: app.radio(key='rfm_filter').set_value("All Segments")),
+        ('filter: custom', lambda app: app.radio(key='rfm_filter').set_value("Custom Selection")),
+    ]
+
+    try:
+        results = {}
+        for label, mode in (('tabs, full rerun', 'tabs'), ('lazy, full rerun', 'lazy')):
+            os.environ['NAVIGATION_MODE'] = mode
+            st.cache_data.clear()
+            st.cache_resource.clear()
+            app = AppTest.from_file(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main.py'),
+                                    default_timeout=120)
+            results[label] = run_interactions(app, interactions)
+    finally:
+        databricks.sql.connect = original_connect
+
+    steps = [step for step, _ in next(iter(results.values()))]
+    print("  " + " " * 18 + "".join(f"{step:>16}" for step in steps))
+    for label, timings in results.items():
+        print(f"  {label:<18}" + "".join(f"{seconds * 1000:13.0f} ms" for _, seconds in timings))
+
+def bench_rfm_engine(n_customers=500_000, rows_per_customer=10):
+    """Time the in-app RFM engine at the customer count it must stay interactive for"""
+    df = generate_transactions(n_customers * rows_per_customer, n_customers=n_customers, seed=7)
+
+    start = time.perf_counter()
+    customers = main.compute_customer_rfm(df)
+    summary = main.summarize_segments(customers)
+    elapsed = time.perf_counter() - start
+    print(f"  rfm[engine]  {elapsed:8.3f}s  {len(customers):,} customers, {len(df):,} rows, "
+          f"{len(summary)} segments")
+
+    # A plain grouped aggregation of the raw R/F/M values, for scale
+    start = time.perf_counter()
+    df.groupby('CustomerID').agg(
+        last=('InvoiceDate', 'max'), Frequency=('InvoiceNo', 'nunique'), Monetary=('TotalPrice', 'sum'))
+    print(f"  rfm[groupby]  {time.perf_counter() - start:8.3f}s  (R/F/M values only)")
+    return elapsed
+
+def bench_customer_drilldown(n_customers=500_000, rows_per_customer=10, lookups=200, page_size=50):
+    """Time segment paging and customer lookups through the indexes against rescanning the frame"""
+    raw = generate_transactions(n_customers * rows_per_customer, n_customers=n_customers, seed=11)
+    df = main.compact_transactions(raw)
+    customers = main.compute_customer_rfm(df)
+
+    start = time.perf_counter()
+    index = main.CustomerIndex(customers)
+    invoices = main.InvoiceIndex(df)
+    print(f"  build indexes   {time.perf_counter() - start:8.3f}s  {len(customers):,} customers, {len(df):,} rows, "
+          f"{invoices.order.nbytes / 1e6:.1f} MB row order")
+
+    segment = max(index.ranges, key=index.segment_size)
+    pages = -(-index.segment_size(segment) // page_size)
+    rng = np.random.default_rng(0)
+    page_numbers = rng.integers(0, pages, lookups)
+    customer_ids = customers['CustomerID'].to_numpy()[rng.integers(0, len(customers), lookups)]
+
+    def scan_page(page):
+        members = customers[customers['Segment'] == segment]
+        return members.sort_values('Monetary', ascending=False, kind='stable').iloc[page * page_size:(page + 1) * page_size]
+
+    def scan_invoices(customer_id):
+        return main.invoice_summary(df[df['CustomerID'] == customer_id]).head(main.RECENT_INVOICES)
+
+    for label, indexed, scanned, keys in (
+        ('segment page', lambda page: index.page(segment, page, page_size), scan_page, page_numbers),
+        ('customer find', index.find, lambda customer_id: customers[customers['CustomerID'] == customer_id], customer_ids),
+        ('recent invoices', invoices.recent, scan_invoices, customer_ids)
+    ):
+        start = time.perf_counter()
+        for key in keys:
+            indexed(key)
+        fast = (time.perf_counter() - start) / len(keys)
+        start = time.perf_counter()
+        for key in keys[:10]:
+            scanned(key)
+        slow = (time.perf_counter() - start) / 10
+        print(f"  {label:<16} index {fast * 1000:8.3f} ms  scan {slow * 1000:8.1f} ms  speedup {slow / fast:,.0f}x")
+
+def bench_compaction(df):
+    """Report the memory saved by compact_transactions"""
+    # Loaded frames carry Python string objects unless the connector hands over Arrow strings
+    loaded = df.astype({'InvoiceNo': object, 'Country': object})
+    start = time.perf_counter()
+    compact = main.compact_transactions(loaded)
+    elapsed = time.perf_counter() - start
+    before, after = compact.attrs['memory_before'], compact.attrs['memory_after']
+    print(f"  compact  {elapsed:8.3f}s  {before / 1e6:9.1f} MB -> {after / 1e6:9.1f} MB  "
+          f"({before / after:.1f}x smaller)")
+    print("  dtypes: " + ", ".join(f"{name}={dtype}" for name, dtype in compact.dtypes.items()))
+
+def bench_shared_cache(df, sessions=20):
+    """Time handing the cached frame to many sessions"""
+    main.sql = FakeConnector(df)
+    main.get_connection_pool.clear()
+    cache = transaction_cache()
+    cache.refresh_seconds = 3600
+    cache.get()
+
+    start = time.perf_counter()
+    for _ in range(sessions):
+        cache.get()
+    elapsed = time.perf_counter() - start
+    print(f"  {sessions} sessions  {elapsed:8.4f}s  "
+          f"({cache.frame.memory_usage(deep=True).sum() / 1e6:.1f} MB "
+          f"{'shared, not copied' if main.copy_on_write() else 'copied per session'})")
+
+# Named data scales for the suite; any row count such as 250000 or 2.5m also works
+SCALES = {'10k': 10_000, '100k': 100_000, '1m': 1_000_000, '10m': 10_000_000, '50m': 50_000_000}
+
+def parse_scale(text):
+    """Row count for a scale name or number such as '1m', '250k' or '500000'"""
+    text = text.strip().lower()
+    if text in SCALES:
+        return SCALES[text]
+    multiplier = {'k': 1_000, 'm': 1_000_000}.get(text[-1:], 1)
+    return int(float(text.rstrip('km')) * multiplier)
+
+def on_connector(connector, load):
+    """Wrap load to run against a fake connector through a fresh connection pool"""
+    def run():
+        main.sql = connector
+        main.get_connection_pool.clear()
+        return load()
+    return run
+
+def suite_cases(df):
+    """(group, case, callable) for every loader, KPI computation and chart builder at one data scale"""
+    segments = generate_segment_summary(df)
+    charts = chart_inputs(df, segments)
+    charts['segment_table'] = (main.create_segment_performance_table, segments)
+    cases = [
+        ('loader', 'query_transactions', on_connector(FakeConnector(df), main.query_transactions)),
+        ('loader', 'fold_transactions', on_connector(FakeConnector(df), main.fold_transactions)),
+        ('loader', 'query_rfm_segments', on_connector(FakeConnector(segments), main.query_rfm_segments)),
+        ('kpi', 'compute_insight_aggregates', lambda: main.compute_insight_aggregates(df)),
+        ('kpi', 'build_aggregate_cube', lambda: main.build_aggregate_cube(df)),
+        ('kpi', 'build_aggregate_cube[approx]', lambda: main.build_aggregate_cube(df, approximate=True)),
+        ('kpi', 'get_data_freshness_metrics', lambda: main.get_data_freshness_metrics(df)),
+        ('kpi', 'cohort_retention', lambda: main.cohort_retention(df)),
+        ('kpi', 'compute_customer_rfm', lambda: main.compute_customer_rfm(df)),
+        ('kpi', 'summarize_segments', lambda: generate_segment_summary(df)),
+    ]
+    cube = main.build_aggregate_cube(df)
+    cases.append(('kpi', 'aggregates_from_cube', lambda: main.aggregates_from_cube(cube)))
+    for chart_id, (builder, data) in charts.items():
+        cases.append(('chart', chart_id, functools.partial(builder, data)))
+    return cases
+
+def run_case(call, repeats=3, memory=True):
+    """Best wall time over repeats, the peak traced heap of one more call, and the result"""
+    seconds = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = call()
+        seconds = min(seconds, time.perf_counter() - start)
+    peak = None
+    if memory:
+        tracemalloc.start()
+        call()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return seconds, peak, result
+
+def suite_metadata():
+    """Versions and host details stored with suite results"""
+    import platform
+    import plotly
+
+    try:
+        revision = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                  cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        revision = None
+    return {
+        'revision': revision,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'pyarrow': pa.__version__,
+        'plotly': plotly.__version__,
+        'machine': platform.machine(),
+        'cpus': os.cpu_count()
+    }
+
+def run_suite(scales, repeats=3, memory=True, max_frame_rows=5_000_000, seed=42):
+    """Time and trace every suite case at each scale; returns the JSON-ready results
+
+    Scales above max_frame_rows only run the streamed loader, fed by a
+    generator so the full frame is never built; its time includes generating
+    the batches.
+    """
+    import plotly.io as pio
+
+    saved = main.sql
+    results = []
+    try:
+        for scale in scales:
+            rows = parse_scale(scale)
+            if rows > max_frame_rows:
+                cases = [('loader', 'fold_transactions', on_connector(GeneratedConnector(rows), main.fold_transactions))]
+            else:
+                start = time.perf_counter()
+                df = generate_transactions(rows, seed=seed)
+                print(f"  [{scale}] generated {rows:,} rows in {time.perf_counter() - start:.2f}s")
+                cases = suite_cases(df)
+            for group, case, call in cases:
+                if group == 'chart':
+                    call()  # warm up plotly's templates and validators
+                seconds, peak, result = run_case(call, 1 if rows > max_frame_rows else repeats, memory)
+                entry = {'scale': scale, 'rows': rows, 'group': group, 'case': case,
+                         'seconds': seconds, 'peak_bytes': peak}
+                if group == 'chart' and not isinstance(result, pd.DataFrame):
+                    entry['payload_bytes'] = len(pio.to_json(result))
+                results.append(entry)
+                memory_text = '' if peak is None else f"  {peak / 1e6:9.1f} MB"
+                print(f"  [{scale}] {group:<6} {case:<28} {seconds:9.4f}s{memory_text}")
+    finally:
+        main.sql = saved
+        main.get_connection_pool.clear()
+    return {'meta': suite_metadata(), 'results': results}
+
+def compare_results(baseline, current, threshold=0.2, floor_seconds=0.005):
+    """Print per-case time changes between two suite result files and return the regressions
+
+    A case regresses when it is more than threshold slower and by more than
+    floor_seconds, which keeps timer noise on the fastest cases out.
+    """
+    before = {(entry['scale'], entry['case']): entry for entry in baseline['results']}
+    regressions = []
+    for entry in current['results']:
+        old = before.get((entry['scale'], entry['case']))
+        if old is None:
+            continue
+        ratio = entry['seconds'] / max(old['seconds'], 1e-9)
+        regressed = ratio > 1 + threshold and entry['seconds'] - old['seconds'] > floor_seconds
+        if regressed:
+            regressions.append(entry)
+        print(f"  [{entry['scale']}] {entry['case']:<28} {old['seconds']:9.4f}s -> {entry['seconds']:9.4f}s "
+              f"{ratio:6.2f}x{'  REGRESSION' if regressed else ''}")
+    print(f"  {len(regressions)} regressions beyond {threshold:.0%} "
+          f"(baseline {baseline['meta'].get('revision')}, current {current['meta'].get('revision')})")
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=500_000)
+    parser.add_argument('--stream-rows', type=int, default=2_000_000)
+    parser.add_argument('--budget', type=int, default=128 * 1024 * 1024,
+                        help="memory budget in bytes for the streaming check")
+    parser.add_argument('--write-local', metavar='DIR',
+                        help="write --rows synthetic transactions as a DATA_SOURCE=local dataset and exit")
+    parser.add_argument('--suite', action='store_true',
+                        help="time every loader, KPI and chart at --scales and write --output, then exit")
+    parser.add_argument('--scales', default='10k,100k,1m',
+                        help="comma-separated suite scales, e.g. 10k,100k,1m,10m,50m")
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--no-memory', action='store_true', help="skip the traced-heap run of each suite case")
+    parser.add_argument('--max-frame-rows', type=int, default=5_000_000,
+                        help="larger suite scales only run the streamed loader")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', default='benchmark-results.json')
+    parser.add_argument('--compare', nargs=2, metavar=('BASELINE', 'CURRENT'),
+                        help="compare two suite result files; exits 1 on regressions")
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help="slowdown ratio counted as a regression by --compare")
+    parser.add_argument('--streaming-rss', type=int, metavar='ROWS', help=argparse.SUPPRESS)
+    parser.add_argument('--materialize', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.streaming_rss:
+        # Child process of bench_streaming_memory: report the peak RSS growth only
+        print(streaming_rss_growth(args.streaming_rss, args.budget, args.materialize))
+        sys.exit()
+
+    if args.compare:
+        with open(args.compare[0]) as baseline, open(args.compare[1]) as current:
+            regressions = compare_results(json.load(baseline), json.load(current), args.threshold)
+        sys.exit(1 if regressions else 0)
+
+    if args.suite:
+        print("Benchmark suite")
+        suite = run_suite(args.scales.split(','), args.repeats, not args.no_memory, args.max_frame_rows, args.seed)
+        with open(args.output, 'w') as output:
+            json.dump(suite, output, indent=2)
+        print(f"Wrote {len(suite['results'])} results to {args.output}")
+        sys.exit()
+
+    print(f"Generating {args.rows:,} synthetic transactions")
+    df = generate_transactions(args.rows, seed=args.seed)
+
+    if args.write_local:
+        write_local_dataset(args.write_local, df)
+        print(f"Wrote {args.write_local}; run the app with DATA_SOURCE=local LOCAL_DATA_DIR={args.write_local}")
+        sys.exit()
+
+    print("Result fetch")
+    bench_fetch_modes(df)
+
+    print("Connection pool")
+    bench_connection_pool(df)
+
+    print("Transaction cache")
+    bench_incremental_refresh(df)
+
+    print("Shared cache")
+    bench_shared_cache(df)
+
+    print("Cache keys")
+    bench_cache_keys(df)
+
+    print("Snapshot cache")
+    bench_snapshot_cold_start(df)
+
+    print("Aggregate cube")
+    bench_aggregate_cube(df)
+
+    print("Approximate distinct counts")
+    bench_approximate_distinct(df)
+
+    print("Cohort retention")
+    bench_cohort_engine(df)
+
+    print("Data freshness")
+    bench_freshness(df)
+
+    print("Growth chart")
+    bench_growth_chart(df)
+
+    print("Figure cache")
+    bench_figure_cache(df)
+
+    print("Stage tracing")
+    bench_tracing(df)
+
+    print("RFM engine")
+    bench_rfm_engine()
+
+    print("Customer drill-down")
+    bench_customer_drilldown()
+
+    print("Frame compaction")
+    bench_compaction(df)
+
+    print("Insights aggregates")
+    try:
+        bench_aggregate_queries(df)
+    except ImportError:
+        print("  skipped: duckdb is not installed")
+
+    print("Filtered insights")
+    try:
+        bench_filtered_insights(df)
+    except ImportError:
+        print("  skipped: duckdb is not installed")
+
+    print("Streaming aggregation")
+    try:
+        bench_streaming_fold(df)
+    except ImportError:
+        print("  skipped: duckdb is not installed")
+    bench_streaming_memory(args.stream_rows, args.budget)
+
+    print("Local data source")
+    try:
+        bench_local_source(df)
+    except ImportError:
+        print("  skipped: duckdb is not installed")
+
+    print("Concurrent loading")
+    try:
+        bench_concurrent_loading(df)
+    except ImportError:
+        print("  skipped: duckdb is not installed")
+
+    print("App interaction latency")
+    try:
+        bench_app_latency(df)
+    except ImportError:
+        print("  skipped: duckdb is not installed")
@@ -2,11 +2,25 @@ import streamlit as st
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
+import plotly.io as pio
 from plotly.subplots import make_subplots
 import os
+import re
+import glob
+import threading
+import time
+import functools
+import json
+from collections import OrderedDict, deque
+from concurrent.futures import Future, wait
+from contextlib import contextmanager
 from dotenv import load_dotenv
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 from databricks import sql
 import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.feather as feather
 from datetime import datetime, timedelta
 
 # Load environment variables
@@ -20,6 +34,213 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+# Result fetch configuration: 'arrow' streams columnar batches from the connector,
+# 'rows' falls back to cursor.fetchall() and builds the frame from Python tuples
+FETCH_MODE = os.getenv('FETCH_MODE', 'arrow')
+ARROW_BATCH_ROWS = int(os.getenv('ARROW_BATCH_ROWS', '250000'))
+
+# Warehouse connection pool shared by all loaders and sessions
+POOL_MAX_SIZE = int(os.getenv('POOL_MAX_SIZE', '4'))
+POOL_IDLE_TIMEOUT = float(os.getenv('POOL_IDLE_TIMEOUT', '600'))  # seconds before an idle connection is closed
+POOL_CHECKOUT_TIMEOUT = float(os.getenv('POOL_CHECKOUT_TIMEOUT', '60'))  # seconds to wait for a free connection
+POOL_VALIDATE_AFTER = float(os.getenv('POOL_VALIDATE_AFTER', '30'))  # idle seconds before a reused connection is pinged
+
+# Where queries run: 'databricks' (the SQL warehouse) or 'local', an embedded DuckDB
+# engine over the Parquet files in LOCAL_DATA_DIR (needs the duckdb package)
+DATA_SOURCE = os.getenv('DATA_SOURCE', 'databricks').lower()
+LOCAL_DATA_DIR = os.getenv('LOCAL_DATA_DIR', 'data')
+
+# Show the sidebar diagnostics panel (pool metrics, cache and memory stats)
+SHOW_DIAGNOSTICS = os.getenv('SHOW_DIAGNOSTICS', 'false').lower() in ('1', 'true', 'yes')
+
+# Hot-path tracing: wall time, rows, bytes and cache hits of each stage per rerun, shown
+# in the sidebar tracing panel. TRACE_EXPORT_DIR, when set, also receives every run as
+# JSON lines (trace.jsonl) and the running totals as Prometheus text (metrics.prom).
+SHOW_TRACE_PANEL = os.getenv('SHOW_TRACE_PANEL', 'false').lower() in ('1', 'true', 'yes')
+TRACE_EXPORT_DIR = os.getenv('TRACE_EXPORT_DIR', '')
+TRACE_HISTORY_RUNS = int(os.getenv('TRACE_HISTORY_RUNS', '50'))
+
+# Results memoized per dataset fingerprint (filter combinations included) before the oldest is dropped
+DERIVED_MAX_ENTRIES = int(os.getenv('DERIVED_MAX_ENTRIES', '64'))
+
+# Points drawn per series on the customer growth chart: the bar grain coarsens from
+# day to week to month and the cumulative line is downsampled to stay within it
+GROWTH_POINT_BUDGET = int(os.getenv('GROWTH_POINT_BUDGET', '400'))
+
+# Memory budget for serialized chart figures shared across sessions
+FIGURE_CACHE_MAX_BYTES = int(os.getenv('FIGURE_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+
+# 'lazy' renders and loads only the selected view; 'tabs' renders every view on each run
+NAVIGATION_MODE = os.getenv('NAVIGATION_MODE', 'lazy').lower()
+# Warm the data of views that are not shown in background threads, at most once per interval
+PREFETCH_VIEWS = os.getenv('PREFETCH_VIEWS', 'true').lower() in ('1', 'true', 'yes')
+PREFETCH_INTERVAL_SECONDS = int(os.getenv('PREFETCH_INTERVAL_SECONDS', '60'))
+
+# Partial reruns need st.fragment (Streamlit 1.37+, experimental from 1.33); older
+# versions fall back to rerunning the whole script on every widget change
+fragment = getattr(st, 'fragment', None) or getattr(st, 'experimental_fragment', None) or (lambda func: func)
+
+# Transaction source and the predicate every transaction query shares
+TRANSACTIONS_TABLE = os.getenv('TRANSACTIONS_TABLE', 'retail_analytics.dlt.retail_transactions_silver')
+TRANSACTION_FILTER = "IsCancellation = false AND CustomerID IS NOT NULL"
+
+# Insights date window preselected in the sidebar, in months back from the latest
+# transaction; 0 selects the full history
+INSIGHTS_DEFAULT_MONTHS = int(os.getenv('INSIGHTS_DEFAULT_MONTHS', '0'))
+# Transaction caches kept for date/country filtered insights, least recently used dropped first
+TRANSACTION_PREDICATE_CACHES = int(os.getenv('TRANSACTION_PREDICATE_CACHES', '4'))
+
+# Columns identifying one invoice line when de-duplicating incremental fetches
+TRANSACTION_ROW_KEY = ['InvoiceNo', 'InvoiceDate', 'CustomerID', 'Quantity', 'TotalPrice']
+
+# Compact the cached transaction frame (categorical/integer codes, float32 prices)
+COMPACT_TRANSACTIONS = os.getenv('COMPACT_TRANSACTIONS', 'true').lower() in ('1', 'true', 'yes')
+
+# Seconds between incremental refreshes of the cached transaction frame
+TRANSACTION_REFRESH_SECONDS = int(os.getenv('TRANSACTION_REFRESH_SECONDS', '300'))
+
+# Background refresh: a process-wide worker checks the source tables' versions every
+# REFRESH_CHECK_SECONDS and reloads the cached data when a table changed (or on the
+# refresh schedule when its version cannot be read), so no request waits for a reload
+BACKGROUND_REFRESH = os.getenv('BACKGROUND_REFRESH', 'true').lower() in ('1', 'true', 'yes')
+REFRESH_CHECK_SECONDS = int(os.getenv('REFRESH_CHECK_SECONDS', '30'))
+
+# Cache settings for warehouse results: keyed on the source table version and
+# re-warmed by the background refresher, or expiring after five minutes without it
+RESULT_CACHE = {'ttl': None, 'max_entries': 64} if BACKGROUND_REFRESH else {'ttl': 300, 'max_entries': 64}
+
+# On-disk Arrow snapshots of the loaded datasets, served on cold start while the
+# warehouse is checked in the background. Set SNAPSHOT_DIR empty to disable.
+SNAPSHOT_DIR = os.getenv('SNAPSHOT_DIR', '.snapshots')
+SNAPSHOT_MAX_BYTES = int(os.getenv('SNAPSHOT_MAX_BYTES', str(2 * 1024 ** 3)))
+SNAPSHOT_KEEP_VERSIONS = int(os.getenv('SNAPSHOT_KEEP_VERSIONS', '2'))
+SNAPSHOT_MIN_INTERVAL = float(os.getenv('SNAPSHOT_MIN_INTERVAL', '600'))  # seconds between snapshots of one dataset
+
+# Insights aggregation: 'sql' pushes the chart aggregations down to the warehouse,
+# 'pandas' downloads the raw transactions and aggregates them in the app, 'stream'
+# folds the transactions batch by batch into the aggregates without keeping them
+INSIGHTS_AGGREGATION = os.getenv('INSIGHTS_AGGREGATION', 'sql')
+# Memory budget in bytes for one streamed aggregation: sizes the fetched batches
+# and how much partial state accumulates before it is merged (default 512 MiB)
+STREAM_MEMORY_BUDGET_BYTES = int(os.getenv('STREAM_MEMORY_BUDGET_BYTES', str(512 * 1024 * 1024)))
+# Distinct customer and order counts in 'pandas' mode: 'exact', or 'approx' to estimate
+# them from HyperLogLog sketches per month and country (switchable in the sidebar)
+DISTINCT_COUNTS = os.getenv('DISTINCT_COUNTS', 'exact')
+# Registers per sketch as a power of two; relative standard error is 1.04 / sqrt(2 ** precision)
+HLL_PRECISION = int(os.getenv('HLL_PRECISION', '12'))
+
+# Aggregations behind the insights tab. Kept to portable SQL so the same text
+# runs on Databricks and on a local DuckDB/SQLite stand-in.
+AGGREGATE_QUERIES = {
+    'monthly': """
+        SELECT
+            date_trunc('MONTH', InvoiceDate) AS Month,
+            SUM(TotalPrice) AS Revenue,
+            COUNT(DISTINCT CustomerID) AS UniqueCustomers,
+            COUNT(DISTINCT InvoiceNo) AS Orders
+        FROM {table}
+        WHERE {filter}
+        GROUP BY date_trunc('MONTH', InvoiceDate)
+        ORDER BY Month
+    """,
+    'country': """
+        SELECT
+            Country,
+            SUM(TotalPrice) AS Revenue,
+            COUNT(DISTINCT CustomerID) AS Customers,
+            COUNT(DISTINCT InvoiceNo) AS Orders
+        FROM {table}
+        WHERE {filter}
+        GROUP BY Country
+        ORDER BY Revenue DESC
+        LIMIT 10
+    """,
+    'first_purchase': """
+        SELECT FirstPurchaseDate AS Date, COUNT(*) AS NewCustomers
+        FROM (
+            SELECT CustomerID, MIN(InvoiceDate) AS FirstPurchaseDate
+            FROM {table}
+            WHERE {filter}
+            GROUP BY CustomerID
+        ) first_purchase
+        GROUP BY FirstPurchaseDate
+        ORDER BY FirstPurchaseDate
+    """,
+    'cohort': """
+        WITH activity AS (
+            SELECT DISTINCT CustomerID, date_trunc('MONTH', InvoiceDate) AS InvoiceMonth
+            FROM {table}
+            WHERE {filter}
+        ),
+        cohorts AS (
+            SELECT CustomerID, MIN(InvoiceMonth) AS CohortMonth
+            FROM activity
+            GROUP BY CustomerID
+        )
+        SELECT
+            c.CohortMonth,
+            (year(a.InvoiceMonth) * 12 + month(a.InvoiceMonth))
+                - (year(c.CohortMonth) * 12 + month(c.CohortMonth)) AS CohortPeriod,
+            COUNT(*) AS Customers
+        FROM activity a
+        JOIN cohorts c ON a.CustomerID = c.CustomerID
+        GROUP BY 1, 2
+        ORDER BY 1, 2
+    """,
+    'totals': """
+        SELECT
+            COUNT(DISTINCT CustomerID) AS Customers,
+            SUM(TotalPrice) AS Revenue,
+            COUNT(DISTINCT InvoiceNo) AS Orders
+        FROM {table}
+        WHERE {filter}
+    """,
+    'freshness': """
+        SELECT
+            processing_date,
+            CAST(InvoiceDate AS DATE) AS InvoiceDay,
+            CAST(ingestion_timestamp AS DATE) AS IngestionDay,
+            COUNT(*) AS Records,
+            MIN(InvoiceDate) AS FirstInvoice,
+            MAX(InvoiceDate) AS LastInvoice,
+            MAX(ingestion_timestamp) AS LastIngestion
+        FROM {table}
+        WHERE {filter}
+        GROUP BY 1, 2, 3
+    """
+}
+
+# Date range and countries offered by the insights filters
+TRANSACTION_BOUNDS_QUERY = """
+    SELECT Country, MIN(InvoiceDate) AS FirstInvoice, MAX(InvoiceDate) AS LastInvoice
+    FROM {table}
+    WHERE {filter}
+    GROUP BY Country
+"""
+
+# One customer's latest invoices, for the segment drill-down in 'stream' mode
+CUSTOMER_INVOICES_QUERY = """
+    SELECT
+        InvoiceNo,
+        MAX(InvoiceDate) AS InvoiceDate,
+        MIN(Country) AS Country,
+        SUM(Quantity) AS Items,
+        SUM(TotalPrice) AS Total
+    FROM {table}
+    WHERE {filter} AND CustomerID = :customer_id
+    GROUP BY InvoiceNo
+    ORDER BY InvoiceDate DESC, InvoiceNo
+    LIMIT {limit}
+"""
+
+# Invoices listed for a customer in the segment drill-down
+RECENT_INVOICES = 20
+
+# Freshness histogram grouping keys and the processing-lag quantiles reported
+FRESHNESS_KEYS = ('processing_date', 'InvoiceDay', 'IngestionDay')
+FRESHNESS_QUANTILES = (0.5, 0.95, 0.99)
+FRESHNESS_LABELS = ('P50', 'P95', 'P99')
+
 # Custom CSS for unique styling
 st.markdown("""
 <style>
@@ -97,6 +318,12 @@ st.markdown("""
         line-height: 1;
     }
     
+    .metric-card .metric-note {
+        color: #6b7280;
+        font-size: 0.7rem;
+        margin: 0.4rem 0 0 0;
+    }
+    
     /* Custom section headers */
     .section-header {
         background: white;
@@ -196,146 +423,2676 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-@st.cache_data(ttl=300)  # Cache for 5 minutes
-def load_rfm_data():
-    """Load RFM segmentation data from Databricks"""
-    try:
-        warehouse_id = os.getenv('DATABRICKS_WAREHOUSE_ID')
-        if warehouse_id:
-            http_path = f"/sql/1.0/warehouses/{warehouse_id}"
-        else:
-            http_path = os.getenv('DATABRICKS_HTTP_PATH')
-        
-        connection = sql.connect(
-            server_hostname=os.getenv('DATABRICKS_SERVER_HOSTNAME'),
-            http_path=http_path,
-            access_token=os.getenv('DATABRICKS_ACCESS_TOKEN')
-        )
-        
-        cursor = connection.cursor()
-        query = f"""
-        SELECT * FROM {os.getenv('DATABASE_NAME', 'retail_analytics')}.{os.getenv('TABLE_NAME', 'dlt.segment_summary')}
-        ORDER BY Total_Revenue DESC
-        """
-        
-        cursor.execute(query)
-        columns = [desc[0] for desc in cursor.description]
-        data = cursor.fetchall()
-        
-        df = pd.DataFrame(data, columns=columns)
-        cursor.close()
-        connection.close()
-        
-        return df
-    except Exception as e:
-        st.error(f"Error loading RFM data: {str(e)}")
+class Span:
+    """One traced stage; the traced code sets rows, bytes and cache_hit when it knows them"""
+    
+    __slots__ = ('stage', 'name', 'rows', 'bytes', 'cache_hit')
+    
+    def __init__(self, stage, name=None):
+        self.stage = stage
+        self.name = name
+        self.rows = None
+        self.bytes = None
+        self.cache_hit = None
+
+class Tracer:
+    """Per-run stage timings plus process-wide totals per stage
+
+    A run is one script execution, fragment rerun, background load, prefetch
+    or refresh, and spans go to the run open on the thread recording them.
+    Loader and prefetch threads open their own run through bind(), linked to
+    the run that started them, so attributing their spans needs no script
+    context. Spans recorded outside any run only count toward the totals.
+    """
+    
+    def __init__(self, enabled=False, history_runs=TRACE_HISTORY_RUNS, export_dir=TRACE_EXPORT_DIR):
+        self.enabled = enabled
+        self.export_dir = export_dir
+        self.runs = deque(maxlen=history_runs)    # recent runs, oldest first
+        self.totals = {}            # (stage, name) -> [calls, seconds, max seconds, rows, bytes, hits, misses]
+        self.last_error = None
+        self._latest = {}           # session id -> its latest script or fragment run
+        self._run_ids = 0
+        self._local = threading.local()           # run in progress and stage depth of each thread
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def _session():
+        ctx = get_script_run_ctx(suppress_warning=True)
+        return None if ctx is None else ctx.session_id
+    
+    def start_run(self, kind='script', parent=None):
+        """Open a run of this kind on the calling thread, linked to the parent run that started it, if any"""
+        if not self.enabled:
+            return None
+        session = self._session() if parent is None else parent['session']
+        with self._lock:
+            self._run_ids += 1
+            run = {
+                'run': self._run_ids,
+                'kind': kind,
+                'parent': None if parent is None else parent['run'],
+                'session': session,
+                'started': datetime.now().isoformat(timespec='seconds'),
+                'seconds': None,
+                'rss_bytes': None,
+                'spans': [],
+                '_start': time.perf_counter()
+            }
+            self.runs.append(run)
+            if parent is None:
+                self._latest[session] = run
+                live = {id(kept) for kept in self.runs}
+                self._latest = {key: value for key, value in self._latest.items() if id(value) in live}
+        self._local.run = run
+        return run
+    
+    def finish_run(self, run=None):
+        """Close a run (default: the calling thread's), sample memory and write the exports
+
+        Background runs that traced nothing are dropped.
+        """
+        current = getattr(self._local, 'run', None)
+        run = run or current
+        if run is None:
+            return
+        if run is current:
+            self._local.run = None
+        run['seconds'] = time.perf_counter() - run['_start']
+        if not run['spans'] and run['parent'] is not None:
+            with self._lock:
+                if run in self.runs:
+                    self.runs.remove(run)
+            return
+        run['rss_bytes'] = process_rss_bytes()
+        if self.export_dir:
+            try:
+                self._export(run)
+                self.last_error = None
+            except Exception as e:
+                self.last_error = f"Trace export failed: {e}"
+    
+    @contextmanager
+    def run(self, kind='script', parent=None):
+        """Context manager opening a run on the calling thread, finishing it on exit and reopening the enclosing one"""
+        outer = getattr(self._local, 'run', None)
+        run = self.start_run(kind, parent)
+        try:
+            yield run
+        finally:
+            if run is not None:
+                self.finish_run(run)
+                self._local.run = outer
+    
+    @contextmanager
+    def fragment_run(self):
+        """A 'fragment' run around a fragment's body when a fragment rerun executes it outside a script run"""
+        if not self.enabled or getattr(self._local, 'run', None) is not None:
+            yield
+            return
+        with self.run('fragment'):
+            yield
+    
+    def bind(self, func, kind):
+        """func wrapped to trace as its own run of this kind, linked to the calling thread's run; for worker threads"""
+        if not self.enabled:
+            return func
+        parent = getattr(self._local, 'run', None)
+        
+        @functools.wraps(func)
+        def traced(*args, **kwargs):
+            with self.run(kind, parent):
+                return func(*args, **kwargs)
+        return traced
+    
+    def current_run(self):
+        """The calling session's latest script or fragment run, or None"""
+        with self._lock:
+            return self._latest.get(self._session())
+    
+    def child_runs(self, run):
+        """Kept runs started from a run, such as the loads and prefetches it issued"""
+        with self._lock:
+            return [child for child in self.runs if child['parent'] == run['run']]
+    
+    @contextmanager
+    def stage(self, stage, name=None):
+        span = Span(stage, name)
+        if not self.enabled:
+            yield span
+            return
+        depth = getattr(self._local, 'depth', 0)
+        self._local.depth = depth + 1
+        start = time.perf_counter()
+        try:
+            yield span
+        finally:
+            seconds = time.perf_counter() - start
+            self._local.depth = depth
+            self._record(span, start, seconds, depth)
+    
+    def _record(self, span, start, seconds, depth):
+        run = getattr(self._local, 'run', None)
+        with self._lock:
+            if run is not None:
+                run['spans'].append({
+                    'stage': span.stage,
+                    'name': span.name,
+                    'offset_ms': round((start - run['_start']) * 1000, 3),
+                    'ms': round(seconds * 1000, 3),
+                    'rows': span.rows,
+                    'bytes': span.bytes,
+                    'cache': None if span.cache_hit is None else ('hit' if span.cache_hit else 'miss'),
+                    'depth': depth,
+                    'thread': threading.current_thread().name
+                })
+            totals = self.totals.setdefault((span.stage, span.name), [0, 0.0, 0.0, 0, 0, 0, 0])
+            totals[0] += 1
+            totals[1] += seconds
+            totals[2] = max(totals[2], seconds)
+            totals[3] += span.rows or 0
+            totals[4] += span.bytes or 0
+            if span.cache_hit is not None:
+                totals[5 if span.cache_hit else 6] += 1
+    
+    def json_lines(self, runs=None):
+        """Spans of the given runs (default: every run kept) as JSON lines, one span per line"""
+        with self._lock:
+            runs = list(self.runs if runs is None else runs)
+            lines = [
+                json.dumps({'run': run['run'], 'kind': run['kind'], 'parent': run['parent'], 'session': run['session'],
+                            'started': run['started'], 'run_seconds': run['seconds'], 'rss_bytes': run['rss_bytes'],
+                            **span}, default=str)
+                for run in runs for span in run['spans']
+            ]
+        return ''.join(line + '\n' for line in lines)
+    
+    def prometheus(self):
+        """Running totals per stage in the Prometheus text exposition format"""
+        metrics = (
+            ('calls_total', 'counter', 'Times each stage ran', 0),
+            ('seconds_total', 'counter', 'Wall time spent in each stage', 1),
+            ('max_seconds', 'gauge', 'Longest single run of each stage', 2),
+            ('rows_total', 'counter', 'Rows processed by each stage', 3),
+            ('bytes_total', 'counter', 'Bytes fetched or serialized by each stage', 4),
+            ('cache_hits_total', 'counter', 'Cache hits of each cached stage', 5),
+            ('cache_misses_total', 'counter', 'Cache misses of each cached stage', 6),
+        )
+        with self._lock:
+            totals = sorted(self.totals.items(), key=lambda item: (item[0][0], item[0][1] or ''))
+        lines = []
+        for suffix, kind, description, index in metrics:
+            metric = f"retail_dashboard_stage_{suffix}"
+            lines += [f"# HELP {metric} {description}", f"# TYPE {metric} {kind}"]
+            for (stage, name), values in totals:
+                lines.append(f'{metric}{{stage="{prometheus_label(stage)}",name="{prometheus_label(name or "")}"}} {values[index]}')
+        rss = process_rss_bytes()
+        if rss is not None:
+            lines += ["# HELP retail_dashboard_resident_memory_bytes Resident memory of the app process",
+                      "# TYPE retail_dashboard_resident_memory_bytes gauge",
+                      f"retail_dashboard_resident_memory_bytes {rss}"]
+        return '\n'.join(lines) + '\n'
+    
+    def _export(self, run):
+        # Append the run to trace.jsonl and replace metrics.prom atomically, for a
+        # log shipper and the node exporter textfile collector to pick up
+        os.makedirs(self.export_dir, exist_ok=True)
+        with open(os.path.join(self.export_dir, 'trace.jsonl'), 'a') as f:
+            f.write(self.json_lines([run]))
+        path = os.path.join(self.export_dir, 'metrics.prom')
+        with open(path + '.tmp', 'w') as f:
+            f.write(self.prometheus())
+        os.replace(path + '.tmp', path)
+
+@st.cache_resource
+def get_tracer():
+    """Process-wide stage tracer shared across sessions"""
+    return Tracer(enabled=SHOW_TRACE_PANEL or bool(TRACE_EXPORT_DIR))
+
+def trace_stage(stage, name=None):
+    """Context manager timing a hot-path stage; set rows, bytes or cache_hit on the span it yields"""
+    return get_tracer().stage(stage, name)
+
+def traced_fragment(func):
+    """Decorator tracing a fragment's reruns as their own runs; apply it inside @fragment"""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with get_tracer().fragment_run():
+            return func(*args, **kwargs)
+    return wrapper
+
+def prometheus_label(value):
+    """Escape a Prometheus label value"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def process_rss_bytes():
+    """Resident memory of this process in bytes, or None where /proc is unavailable"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+def fetch_arrow_table(cursor, batch_rows=None, on_batch=None):
+    """Stream the active result set as Arrow batches and combine them into one table
+
+    on_batch(rows) is called with the row count of each batch as it arrives.
+    """
+    batch_rows = batch_rows or ARROW_BATCH_ROWS
+    batches = []
+    while True:
+        batch = cursor.fetchmany_arrow(batch_rows)
+        if batch.num_rows == 0:
+            break
+        batches.append(batch)
+        if on_batch is not None:
+            on_batch(batch.num_rows)
+    
+    if not batches:
+        return None
+    
+    return decimals_to_float(pa.concat_tables(batches))
+
+def decimals_to_float(table):
+    """Cast decimal columns to float64, which would otherwise come back as Python Decimal objects"""
+    for i, field in enumerate(table.schema):
+        if pa.types.is_decimal(field.type):
+            table = table.set_column(i, field.name, table.column(i).cast(pa.float64()))
+    return table
+
+def fetch_dataframe(cursor, mode=None, on_batch=None):
+    """Build a DataFrame from the cursor's active result set"""
+    mode = mode or FETCH_MODE
+    columns = [desc[0] for desc in cursor.description]
+    
+    if mode == 'arrow' and hasattr(cursor, 'fetchmany_arrow'):
+        with trace_stage('fetch', 'arrow') as span:
+            table = fetch_arrow_table(cursor, on_batch=on_batch)
+            span.rows = 0 if table is None else table.num_rows
+            span.bytes = 0 if table is None else table.nbytes
+        if table is None:
+            return pd.DataFrame(columns=columns)
+        with trace_stage('dataframe', 'arrow') as span:
+            # Typed columns straight from Arrow - no per-row Python objects
+            frame = table.to_pandas(date_as_object=False, split_blocks=True, self_destruct=True)
+            span.rows = len(frame)
+        return frame
+    
+    with trace_stage('fetch', 'fetchall') as span:
+        data = cursor.fetchall()
+        span.rows = len(data)
+    with trace_stage('dataframe', 'rows') as span:
+        frame = pd.DataFrame(data, columns=columns)
+        span.rows = len(frame)
+    return frame
+
+def connection_settings():
+    """Read the Databricks connection arguments from the environment"""
+    warehouse_id = os.getenv('DATABRICKS_WAREHOUSE_ID')
+    if warehouse_id:
+        http_path = f"/sql/1.0/warehouses/{warehouse_id}"
+    else:
+        http_path = os.getenv('DATABRICKS_HTTP_PATH')
+    
+    return {
+        'server_hostname': os.getenv('DATABRICKS_SERVER_HOSTNAME'),
+        'http_path': http_path,
+        'access_token': os.getenv('DATABRICKS_ACCESS_TOKEN')
+    }
+
+class ConnectionPool:
+    """Thread-safe pool of warehouse connections shared by every loader and session"""
+    
+    def __init__(self, connector, connect_kwargs=None, max_size=POOL_MAX_SIZE,
+                 idle_timeout=POOL_IDLE_TIMEOUT, checkout_timeout=POOL_CHECKOUT_TIMEOUT,
+                 validate_after=POOL_VALIDATE_AFTER):
+        self.connector = connector
+        self.connect_kwargs = connect_kwargs or {}
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.checkout_timeout = checkout_timeout
+        self.validate_after = validate_after
+        
+        self._idle = []  # (connection, released_at) pairs, most recently used last
+        self._size = 0   # idle + checked out connections
+        self._condition = threading.Condition()
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+            'reconnects': 0,
+            'evictions': 0,
+            'checkouts': 0,
+            'checkout_wait_seconds': 0.0,
+            'max_checkout_wait_seconds': 0.0
+        }
+    
+    def _is_healthy(self, connection, idle_seconds):
+        # databricks-sql connections expose whether their session is still open, but the
+        # warehouse can end a session without the client noticing, so ping long-idle ones
+        if not getattr(connection, 'open', True):
+            return False
+        if idle_seconds < self.validate_after:
+            return True
+        try:
+            cursor = connection.cursor()
+            try:
+                cursor.execute('SELECT 1')
+                cursor.fetchall()
+            finally:
+                cursor.close()
+        except Exception:
+            return False
+        return True
+    
+    def _close_quietly(self, connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+    
+    def _evict_idle(self):
+        # Caller holds the lock; returns connections to close outside of it
+        cutoff = time.monotonic() - self.idle_timeout
+        expired = [conn for conn, released_at in self._idle if released_at < cutoff]
+        if expired:
+            self._idle = [(conn, released_at) for conn, released_at in self._idle if released_at >= cutoff]
+            self._size -= len(expired)
+            self._stats['evictions'] += len(expired)
+        return expired
+    
+    def acquire(self, fresh=False):
+        """Check out a healthy connection, opening one if the pool has room
+
+        fresh=True always opens a new connection, closing an idle one to make room
+        if needed; retries use it after a failure on a pooled connection.
+        """
+        start = time.monotonic()
+        deadline = start + self.checkout_timeout
+        
+        with self._condition:
+            while True:
+                expired = self._evict_idle()
+                if self._idle and fresh and self._size >= self.max_size:
+                    # Take over an idle connection's slot rather than its session
+                    expired.append(self._idle.pop(0)[0])
+                    connection = None
+                    break
+                if self._idle and not fresh:
+                    connection, released_at = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    self._size += 1
+                    connection = None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(f"No warehouse connection available within {self.checkout_timeout:.0f}s")
+                self._condition.wait(remaining)
+        
+        for conn in expired:
+            self._close_quietly(conn)
+        
+        reused = connection is not None
+        if reused and not self._is_healthy(connection, time.monotonic() - released_at):
+            self._close_quietly(connection)
+            connection = None
+            reused = False
+            self.record_reconnect()
+        
+        if connection is None:
+            try:
+                connection = self.connector.connect(**self.connect_kwargs)
+            except Exception:
+                with self._condition:
+                    self._size -= 1
+                    self._condition.notify()
+                raise
+        
+        wait = time.monotonic() - start
+        with self._condition:
+            self._stats['hits' if reused else 'misses'] += 1
+            self._stats['checkouts'] += 1
+            self._stats['checkout_wait_seconds'] += wait
+            self._stats['max_checkout_wait_seconds'] = max(self._stats['max_checkout_wait_seconds'], wait)
+        return connection
+    
+    def release(self, connection, discard=False):
+        """Return a connection to the pool, or close it if it is broken"""
+        if discard:
+            self._close_quietly(connection)
+        with self._condition:
+            if discard:
+                self._size -= 1
+            else:
+                self._idle.append((connection, time.monotonic()))
+            self._condition.notify()
+    
+    @contextmanager
+    def connection(self, fresh=False):
+        """Context manager that checks a connection out and back in"""
+        connection = self.acquire(fresh)
+        try:
+            yield connection
+        except Exception:
+            self.release(connection, discard=True)
+            raise
+        self.release(connection)
+    
+    @property
+    def retryable_errors(self):
+        """Connector exceptions that indicate a dropped session rather than a bad query"""
+        return (ConnectionError, getattr(self.connector, 'OperationalError', ConnectionError))
+    
+    def record_reconnect(self):
+        with self._condition:
+            self._stats['reconnects'] += 1
+    
+    def close(self):
+        """Close every idle connection"""
+        with self._condition:
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+        for connection, _ in idle:
+            self._close_quietly(connection)
+    
+    def metrics(self):
+        """Snapshot of pool usage counters"""
+        with self._condition:
+            stats = dict(self._stats)
+            stats['size'] = self._size
+            stats['idle'] = len(self._idle)
+        stats['in_use'] = stats['size'] - stats['idle']
+        stats['hit_rate'] = stats['hits'] / stats['checkouts'] if stats['checkouts'] else 0.0
+        stats['avg_checkout_wait_seconds'] = (
+            stats['checkout_wait_seconds'] / stats['checkouts'] if stats['checkouts'] else 0.0
+        )
+        return stats
+
+class LocalCursor:
+    """databricks-sql cursor API over a DuckDB connection; :name parameters become $name"""
+    
+    def __init__(self, connection):
+        self._connection = connection
+        self._reader = None
+        self.description = None
+    
+    def execute(self, query, parameters=None):
+        self._connection.execute(re.sub(r'(?<!:):(\w+)', r'$\1', query), parameters or {})
+        self.description = self._connection.description
+        self._reader = None
+    
+    def fetchall(self):
+        return self._connection.fetchall()
+    
+    def fetchmany(self, size):
+        return self._connection.fetchmany(size)
+    
+    def fetchmany_arrow(self, size):
+        # Batches stream out of DuckDB at the size of the first request
+        if self._reader is None:
+            # to_arrow_reader replaced fetch_record_batch in newer duckdb releases
+            self._reader = getattr(self._connection, 'to_arrow_reader', None) or self._connection.fetch_record_batch
+            self._reader = self._reader(size)
+        try:
+            return pa.Table.from_batches([self._reader.read_next_batch()])
+        except StopIteration:
+            return self._reader.schema.empty_table()
+    
+    def close(self):
+        self._reader = None
+
+class LocalConnection:
+    """Connection onto the local engine's database with its own DuckDB handle, so pooled connections run in parallel"""
+    
+    def __init__(self, database):
+        self._database = database.cursor()
+        self.open = True
+    
+    def cursor(self):
+        return LocalCursor(self._database)
+    
+    def close(self):
+        self.open = False
+        self._database.close()
+
+class LocalEngine:
+    """Stand-in for databricks.sql running the same queries on DuckDB over local Parquet files
+
+    Each ``<table>.parquet`` file or ``<table>/`` directory of Parquet files in
+    data_dir becomes a view named after it, using the fully qualified name the
+    app queries, e.g. ``retail_analytics.dlt.segment_summary.parquet``.
+    Directories are read with Hive partitioning, so ``Year=2011/Month=3/``
+    subdirectories are skipped by the Year/Month predicates.
+    """
+    
+    OperationalError = ConnectionError
+    
+    def __init__(self, data_dir):
+        import duckdb  # Only needed for DATA_SOURCE=local
+        
+        self.data_dir = data_dir
+        self.database = duckdb.connect()
+        self.tables = []
+        self.sources = {}           # view name -> Parquet file or glob it reads
+        for path in sorted(glob.glob(os.path.join(data_dir, '*'))):
+            if os.path.isdir(path):
+                name, source = os.path.basename(path), os.path.join(path, '**', '*.parquet')
+            elif path.endswith('.parquet'):
+                name, source = os.path.basename(path)[:-len('.parquet')], path
+            else:
+                continue
+            self._create_view(name, source)
+            self.tables.append(name)
+            self.sources[name] = source
+    
+    def _create_view(self, name, source):
+        parts = name.split('.')
+        if len(parts) == 3:
+            attached = {row[0] for row in self.database.execute("SELECT database_name FROM duckdb_databases()").fetchall()}
+            if parts[0] not in attached:
+                self.database.execute(f"ATTACH ':memory:' AS {parts[0]}")
+        if len(parts) > 1:
+            self.database.execute(f"CREATE SCHEMA IF NOT EXISTS {'.'.join(parts[:-1])}")
+        source = source.replace("'", "''")
+        self.database.execute(
+            f"CREATE VIEW {name} AS SELECT * FROM read_parquet('{source}', hive_partitioning = true, union_by_name = true)"
+        )
+    
+    def connect(self, **kwargs):
+        return LocalConnection(self.database)
+    
+    def table_version(self, table):
+        """File count and latest modification time of a table's Parquet files, or None for an unknown table"""
+        source = self.sources.get(table)
+        if source is None:
+            return None
+        files = glob.glob(source, recursive=True)
+        return len(files), max((os.stat(path).st_mtime_ns for path in files), default=0)
+
+@st.cache_resource
+def get_local_engine():
+    """Process-wide DuckDB engine over the Parquet files in LOCAL_DATA_DIR"""
+    return LocalEngine(LOCAL_DATA_DIR)
+
+def data_source():
+    """The connector every query runs through: databricks.sql, or the local engine for DATA_SOURCE=local"""
+    return get_local_engine() if DATA_SOURCE == 'local' else sql
+
+@st.cache_resource(show_spinner=False)
+def get_connection_pool():
+    """Process-wide connection pool shared across Streamlit sessions
+
+    Often first created on a loader thread, which has no script context to show a spinner in.
+    """
+    return ConnectionPool(data_source(), connection_settings())
+
+def run_queries(queries, parameters=None, on_batch=None):
+    """Execute named queries on one pooled connection and return a DataFrame per query
+
+    A failure on a reused connection is retried once on a fresh connection, since
+    the warehouse may have closed the session while it sat idle in the pool.
+    on_batch(rows) reports fetch progress as Arrow batches arrive.
+    """
+    pool = get_connection_pool()
+    for attempt in range(2):
+        try:
+            with pool.connection(fresh=attempt > 0) as connection:
+                cursor = connection.cursor()
+                try:
+                    results = {}
+                    for name, query in queries.items():
+                        # Spans the round trip; the fetch and dataframe stages nest inside it
+                        with trace_stage('query', name) as span:
+                            if parameters:
+                                cursor.execute(query, parameters)
+                            else:
+                                cursor.execute(query)
+                            results[name] = fetch_dataframe(cursor, on_batch=on_batch)
+                            span.rows = len(results[name])
+                finally:
+                    cursor.close()
+            return results
+        except pool.retryable_errors:
+            if attempt == 1:
+                raise
+            pool.record_reconnect()
+
+def run_query(query, parameters=None, on_batch=None, name='result'):
+    """Execute a single query on a pooled connection and return it as a DataFrame
+
+    name labels the query in the tracing panel.
+    """
+    return run_queries({name: query}, parameters, on_batch)[name]
+
+def stream_query(query, consume, parameters=None, batch_rows=None):
+    """Execute a query on a pooled connection and pass each result batch to consume(frame) as it arrives
+
+    Unlike run_query only one batch is held at a time. batch_rows() returns the
+    size of the next batch. A failure on a reused connection is retried on a
+    fresh one only while no batch has been consumed.
+    """
+    batch_rows = batch_rows or (lambda: ARROW_BATCH_ROWS)
+    pool = get_connection_pool()
+    for attempt in range(2):
+        consumed = False
+        try:
+            with pool.connection(fresh=attempt > 0) as connection:
+                cursor = connection.cursor()
+                try:
+                    # One span for the whole stream: batches can number in the thousands
+                    with trace_stage('stream', 'arrow' if FETCH_MODE == 'arrow' else 'rows') as span:
+                        if parameters:
+                            cursor.execute(query, parameters)
+                        else:
+                            cursor.execute(query)
+                        columns = [desc[0] for desc in cursor.description]
+                        arrow = FETCH_MODE == 'arrow' and hasattr(cursor, 'fetchmany_arrow')
+                        span.rows = span.bytes = 0
+                        while True:
+                            if arrow:
+                                batch = cursor.fetchmany_arrow(batch_rows())
+                                if batch.num_rows == 0:
+                                    break
+                                span.bytes += batch.nbytes
+                                frame = decimals_to_float(batch).to_pandas(date_as_object=False, self_destruct=True)
+                            else:
+                                batch = cursor.fetchmany(batch_rows())
+                                if not batch:
+                                    break
+                                frame = pd.DataFrame(batch, columns=columns)
+                            del batch
+                            span.rows += len(frame)
+                            consume(frame)
+                            consumed = True
+                finally:
+                    cursor.close()
+            return
+        except pool.retryable_errors:
+            if attempt == 1 or consumed:
+                raise
+            pool.record_reconnect()
+
+def transaction_filter(predicate=None):
+    """WHERE condition and parameters for the transactions matching a (start_date, end_date, countries) predicate
+
+    Dates are inclusive and None leaves a bound open. The Year/Month bounds only
+    reference the partition columns so the warehouse can prune partitions;
+    the InvoiceDate bounds then trim the first and last month exactly.
+    """
+    if predicate is None:
+        return TRANSACTION_FILTER, {}
+    start_date, end_date, countries = predicate
+    clauses, parameters = [TRANSACTION_FILTER], {}
+    if start_date is not None:
+        clauses.append("(Year > :start_year OR (Year = :start_year AND Month >= :start_month))")
+        clauses.append("InvoiceDate >= :start_date")
+        parameters.update(start_year=start_date.year, start_month=start_date.month,
+                          start_date=pd.Timestamp(start_date).to_pydatetime())
+    if end_date is not None:
+        clauses.append("(Year < :end_year OR (Year = :end_year AND Month <= :end_month))")
+        clauses.append("InvoiceDate < :end_date")
+        parameters.update(end_year=end_date.year, end_month=end_date.month,
+                          end_date=(pd.Timestamp(end_date) + pd.Timedelta(days=1)).to_pydatetime())
+    if countries:
+        names = [f"country_{i}" for i in range(len(countries))]
+        clauses.append(f"Country IN ({', '.join(':' + name for name in names)})")
+        parameters.update(zip(names, countries))
+    return " AND ".join(clauses), parameters
+
+def predicate_covers(outer, inner):
+    """Whether every transaction matching predicate inner also matches predicate outer"""
+    if outer is None:
+        return True
+    if inner is None:
+        return False
+    (outer_start, outer_end, outer_countries), (inner_start, inner_end, inner_countries) = outer, inner
+    return (
+        (outer_start is None or (inner_start is not None and inner_start >= outer_start))
+        and (outer_end is None or (inner_end is not None and inner_end <= outer_end))
+        and (not outer_countries or (bool(inner_countries) and set(inner_countries) <= set(outer_countries)))
+    )
+
+def predicate_label(predicate):
+    """Short description of a predicate for cache names and the diagnostics panel"""
+    if predicate is None:
+        return "all"
+    start_date, end_date, countries = predicate
+    label = f"{start_date or '…'}..{end_date or '…'}"
+    return label + (f" [{', '.join(countries)}]" if countries else "")
+
+def transactions_query(since=None, predicate=None, ordered=True):
+    """Transactions query and parameters, optionally only rows ingested at or after a watermark or matching a predicate"""
+    # Query for time-series analysis - FIXED: Added InvoiceNo to SELECT
+    query = f"""
+    SELECT 
+        InvoiceNo,
+        InvoiceDate,
+        Year,
+        Month,
+        CustomerID,
+        TotalPrice,
+        Quantity,
+        Country,
+        IsCancellation,
+        ingestion_timestamp,
+        processing_date
+    FROM {TRANSACTIONS_TABLE}
+    WHERE {{filter}}
+    """
+    condition, parameters = transaction_filter(predicate)
+    query = query.format(filter=condition)
+    if since is not None:
+        # Inclusive so rows sharing the watermark timestamp are never missed;
+        # merge_transactions drops the copies already held
+        query += "AND ingestion_timestamp >= :watermark\n"
+        parameters['watermark'] = since.to_pydatetime()
+    if ordered:
+        query += "ORDER BY InvoiceDate"
+    return query, parameters
+
+def query_transactions(since=None, predicate=None, on_batch=None):
+    """Fetch transactions, optionally only those ingested at or after a watermark or matching a predicate"""
+    query, parameters = transactions_query(since, predicate)
+    df = run_query(query, parameters or None, on_batch, name='transactions')
+    
+    # Convert date columns
+    if not df.empty:
+        df['InvoiceDate'] = pd.to_datetime(df['InvoiceDate'])
+        df['processing_date'] = pd.to_datetime(df['processing_date'])
+        df['ingestion_timestamp'] = pd.to_datetime(df['ingestion_timestamp'])
+        if COMPACT_TRANSACTIONS:
+            df = compact_transactions(df)
+    
+    return df
+
+def merge_transactions(frame, delta, watermark):
+    """Append newly ingested rows, dropping any line the delta fetched again
+
+    Rows at the watermark are re-fetched by design, and a reprocessed invoice
+    comes back with a newer ingestion_timestamp; both are matched on the row key
+    within the invoices present in the delta.
+    """
+    if delta.empty:
+        return frame
+    kept = frame[frame['ingestion_timestamp'] < watermark]
+    
+    # Compaction picks each side's key types on its own: integer or categorical
+    # ids, float32 or float64 prices. Where they differ, match and combine the
+    # keys by value, as cent-rounded floats or as strings.
+    for column in TRANSACTION_ROW_KEY:
+        if kept[column].dtype == delta[column].dtype:
+            continue
+        if pd.api.types.is_numeric_dtype(kept[column]) and pd.api.types.is_numeric_dtype(delta[column]):
+            kept = kept.assign(**{column: kept[column].astype('float64').round(2)})
+            delta = delta.assign(**{column: delta[column].astype('float64').round(2)})
+        elif not pd.api.types.is_datetime64_any_dtype(kept[column]):
+            kept = kept.assign(**{column: kept[column].astype(str)})
+            delta = delta.assign(**{column: delta[column].astype(str)})
+    
+    candidates = kept['InvoiceNo'].isin(delta['InvoiceNo'].unique())
+    if candidates.any():
+        existing = pd.MultiIndex.from_frame(kept.loc[candidates, TRANSACTION_ROW_KEY])
+        reingested = existing.isin(pd.MultiIndex.from_frame(delta[TRANSACTION_ROW_KEY]))
+        kept = kept.drop(kept.index[candidates][reingested])
+    
+    merged = pd.concat([kept, delta], ignore_index=True)
+    if COMPACT_TRANSACTIONS:
+        # Categoricals with different categories concatenate to object columns
+        merged.attrs['memory_before'] = int(
+            frame.attrs.get('memory_before', 0) * len(kept) / max(len(frame), 1)
+            + delta.attrs.get('memory_before', 0)
+        )
+        merged = compact_transactions(merged)
+    return merged
+
+def integer_column(values, smallest='int32'):
+    """Cast a column to the narrowest signed integer type (from smallest up) if every value survives, else None
+
+    Numbers must be whole and strings must print back unchanged, so ids such
+    as '007' or '+12' keep their text.
+    """
+    try:
+        if pd.api.types.is_numeric_dtype(values):
+            array = values.to_numpy()
+            ids = array.astype('int64')
+            if not np.array_equal(ids, array):
+                return None
+        else:
+            # Numeric strings such as invoice numbers parse in Arrow without Python objects
+            strings = pa.array(values, from_pandas=True).cast(pa.string())
+            parsed = strings.cast(pa.int64())
+            if parsed.null_count or not pc.all(pc.equal(parsed.cast(pa.string()), strings)).as_py():
+                return None
+            ids = parsed.to_numpy(zero_copy_only=False)
+    except (ValueError, TypeError, pa.ArrowInvalid, pa.ArrowNotImplementedError):
+        return None
+    if len(ids) == 0:
+        return None
+    widths = ['int8', 'int16', 'int32']
+    for dtype in widths[widths.index(smallest):]:
+        info = np.iinfo(dtype)
+        if info.min <= ids.min() and ids.max() <= info.max:
+            return pd.Series(ids.astype(dtype), index=values.index, name=values.name)
+    return pd.Series(ids, index=values.index, name=values.name)
+
+def compact_transactions(df):
+    """Shrink the transaction frame's resident memory without changing its values
+
+    Country becomes categorical. InvoiceNo and CustomerID become integers when
+    every id is a whole number or a string that prints back unchanged as one;
+    otherwise they become categoricals, whose categories are the code -> value
+    lookup table, so ids like '00123' or 'C536365' keep their text. Prices drop
+    to float32 where every value survives the round trip to the cent, and the
+    constant IsCancellation column is dropped.
+    """
+    if df.empty:
+        return df
+    before = int(df.attrs.get('memory_before', df.memory_usage(deep=True).sum()))
+    compact = df.drop(columns=['IsCancellation'], errors='ignore')
+    
+    if not isinstance(compact['Country'].dtype, pd.CategoricalDtype):
+        compact['Country'] = compact['Country'].astype('category')
+    
+    for column in ('InvoiceNo', 'CustomerID'):
+        if isinstance(compact[column].dtype, pd.CategoricalDtype):
+            continue
+        codes = integer_column(compact[column])
+        compact[column] = codes if codes is not None else compact[column].astype('category')
+    
+    # Year and Month stay small enough that period arithmetic (Year * 12) cannot overflow
+    for column, smallest in (('Year', 'int16'), ('Month', 'int8'), ('Quantity', 'int32')):
+        codes = integer_column(compact[column], smallest)
+        if codes is not None:
+            compact[column] = codes
+    
+    price = compact['TotalPrice'].to_numpy(dtype='float64')
+    narrow = price.astype('float32')
+    if np.array_equal(np.round(narrow.astype('float64'), 2), np.round(price, 2)):
+        compact['TotalPrice'] = narrow
+    
+    compact.attrs['memory_before'] = before
+    compact.attrs['memory_after'] = int(compact.memory_usage(deep=True).sum())
+    return compact
+
+class SnapshotStore:
+    """Versioned on-disk Arrow IPC snapshots that survive process restarts
+
+    Snapshots are written uncompressed, so loading one is a plain read into
+    the frame with no decompression step. Each save adds a new version; older
+    versions beyond ``keep_versions`` (the newest always stays) and then the
+    oldest files over ``max_bytes`` are evicted. Datasets save at most once
+    every ``min_interval`` seconds, since each save writes the whole frame.
+    """
+    
+    def __init__(self, directory=SNAPSHOT_DIR, max_bytes=SNAPSHOT_MAX_BYTES, keep_versions=SNAPSHOT_KEEP_VERSIONS,
+                 min_interval=SNAPSHOT_MIN_INTERVAL):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.keep_versions = keep_versions
+        self.min_interval = min_interval
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+    
+    def _versions(self, name=None):
+        pattern = f"{name}-*.arrow" if name else "*-*.arrow"
+        # Version ids are zero-padded timestamps, so name order is age order
+        return sorted(glob.glob(os.path.join(self.directory, pattern)))
+    
+    def save(self, name, df, watermark=None):
+        """Write a new snapshot version of a dataset"""
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        metadata = dict(table.schema.metadata or {})
+        if watermark is not None:
+            metadata[b'watermark'] = pd.Timestamp(watermark).isoformat().encode()
+        table = table.replace_schema_metadata(metadata)
+        
+        path = os.path.join(self.directory, f"{name}-{time.time_ns():020d}.arrow")
+        with self._lock:
+            feather.write_feather(table, path + '.tmp', compression='uncompressed')
+            os.replace(path + '.tmp', path)
+            self._evict(path)
+        return path
+    
+    def load(self, name):
+        """Read the newest snapshot of a dataset; returns (frame, watermark) or None"""
+        with self._lock:
+            versions = self._versions(name)
+            if not versions:
+                return None
+            table = feather.read_table(versions[-1], memory_map=True)
+        
+        watermark = (table.schema.metadata or {}).get(b'watermark')
+        watermark = pd.Timestamp(watermark.decode()) if watermark else None
+        return table.to_pandas(date_as_object=False, split_blocks=True), watermark
+    
+    def _evict(self, saved):
+        # Caller holds the lock; saved is the snapshot just written, which is never evicted
+        name = os.path.basename(saved).rsplit('-', 1)[0]
+        versions = self._versions(name)
+        for path in versions[:max(len(versions) - max(self.keep_versions, 1), 0)]:
+            os.remove(path)
+        
+        paths = [path for path in self._versions() if path != saved]
+        newest = {}
+        for path in paths:
+            newest[os.path.basename(path).rsplit('-', 1)[0]] = path
+        sizes = {path: os.path.getsize(path) for path in paths}
+        total = sum(sizes.values()) + os.path.getsize(saved)
+        # Older versions go first, then other datasets' newest snapshots, oldest first
+        for path in sorted(paths, key=lambda p: (p in newest.values(), os.path.basename(p).rsplit('-', 1)[1])):
+            if total <= self.max_bytes:
+                break
+            os.remove(path)
+            total -= sizes[path]
+    
+    def usage(self):
+        """Snapshot files currently on disk with their sizes in bytes"""
+        with self._lock:
+            return {os.path.basename(path): os.path.getsize(path) for path in self._versions()}
+
+@st.cache_resource
+def get_snapshot_store():
+    """Process-wide snapshot store, or None when snapshots are disabled"""
+    if not SNAPSHOT_DIR:
+        return None
+    return SnapshotStore()
+
+def copy_on_write():
+    """Whether pandas copies shared data on write: always from pandas 3, opt-in before it"""
+    return int(pd.__version__.split('.')[0]) >= 3 or pd.get_option('mode.copy_on_write') is True
+
+def shared_view(frame):
+    """Hand a caller its own view of a shared cached frame
+
+    Under copy-on-write the view is a shallow copy: no data is duplicated, but
+    adding, replacing or writing to its columns copies just that column and
+    leaves the shared frame untouched, and to_numpy() returns read-only arrays.
+    Without it (pandas 2 unless PANDAS_COPY_ON_WRITE=1) an in-place write would
+    reach the shared frame, so callers get a full copy instead.
+    """
+    if frame is None:
+        return None
+    return frame.copy(deep=not copy_on_write())
+
+class DatasetHandle:
+    """A shared view of a cached dataset plus the fingerprint identifying its contents
+
+    Pass handles rather than frames to memoized computations: the fingerprint
+    is the cache key, so a lookup costs the same at any data size instead of
+    hashing every row the way st.cache_data hashes a DataFrame argument.
+    A narrowed handle views a subset of the cached data and memoizes its
+    results under its ``scope`` alongside those of the full data.
+    """
+    
+    def __init__(self, cache, frame, fingerprint, scope=None):
+        self.cache = cache
+        self.frame = frame
+        self.fingerprint = fingerprint
+        self.scope = scope
+    
+    @property
+    def empty(self):
+        return self.frame is None or self.frame.empty
+    
+    def derived(self, key, builder):
+        """Compute builder(frame) once for this handle's data and reuse it"""
+        return self.cache.derived(key, builder, handle=self)
+    
+    def narrow(self, predicate):
+        """Handle over the transactions matching a (start_date, end_date, countries) predicate"""
+        frame = self.derived(('filter_transactions',) + predicate,
+                             lambda frame: filter_transactions(frame, *predicate))
+        return DatasetHandle(self.cache, shared_view(frame), self.fingerprint, scope=predicate)
+
+def cached_on_version(func):
+    """Memoize func(frame, *args) per dataset fingerprint; call the wrapper with a DatasetHandle
+
+    Arguments must be hashable and results are shared between sessions, so
+    callers must treat them as read-only.
+    """
+    @functools.wraps(func)
+    def wrapper(handle, *args):
+        return handle.derived((func.__name__,) + args, lambda frame: func(frame, *args))
+    return wrapper
+
+class DatasetCache:
+    """Process-wide dataset held in memory, mirrored to disk and refreshed in place
+
+    ``fetch_full`` loads the whole dataset. When ``fetch_since`` and ``merge`` are
+    given, refreshes only fetch rows whose ``watermark_column`` is at or after the
+    last watermark and merge them into the current frame. Both take an
+    ``on_batch`` callback through which ``loading_rows`` tracks fetch progress.
+    With ``refresh_on_read`` off a due refresh no longer runs inside get();
+    the background refresher stages one with stage_refresh() instead, and
+    readers keep the current frame until the refresher swaps it in.
+    """
+    
+    def __init__(self, name, fetch_full, fetch_since=None, merge=None, watermark_column=None,
+                 refresh_seconds=300, snapshots=None, refresh_on_read=True):
+        self.name = name
+        self.fetch_full = fetch_full
+        self.fetch_since = fetch_since
+        self.merge = merge
+        self.watermark_column = watermark_column
+        self.refresh_seconds = refresh_seconds
+        self.snapshots = snapshots
+        self.refresh_on_read = refresh_on_read
+        
+        self.frame = None
+        self.watermark = None
+        self.fingerprint = None
+        self.fingerprint_seconds = 0.0
+        self.version = 0
+        self.refreshed_at = None
+        self.attempted_at = None    # monotonic start of the last fetch, successful or not
+        self.last_fetch_seconds = None
+        self.last_refresh_rows = 0
+        self.source = None          # 'warehouse' or 'snapshot'
+        self.last_error = None
+        self.loading_rows = None    # rows fetched so far while a warehouse fetch runs
+        self._refreshing = False
+        self.snapshot_at = None     # monotonic time of the last snapshot saved or restored
+        self._derived = OrderedDict()  # least recently used first
+        self.memo_stats = {}        # result name -> [calls, hits, key seconds, build seconds]
+        self._lock = threading.Lock()
+    
+    def get(self, full_reload=False):
+        """Return the cached frame, refreshing it if it is due"""
+        return shared_view(self._current(full_reload)[0])
+    
+    def handle(self, full_reload=False):
+        """Return the cached data as a DatasetHandle, refreshing it if it is due"""
+        frame, fingerprint = self._current(full_reload)
+        return DatasetHandle(self, shared_view(frame), fingerprint)
+    
+    def _current(self, full_reload):
+        with self._lock:
+            if full_reload:
+                self._apply(self._fetch(self.fetch_full), rows=None)
+            elif self.frame is None:
+                if self._restore_snapshot():
+                    # Serve the snapshot now and catch up with the warehouse off the request path
+                    self._start_background_refresh()
+                else:
+                    self._apply(self._fetch(self.fetch_full), rows=None)
+            elif self.refresh_on_read and self._due():
+                self._apply(*self._fetch_update(self.frame, self.watermark))
+            return self.frame, self.fingerprint
+    
+    def due(self):
+        """Whether the loaded data is older than refresh_seconds"""
+        with self._lock:
+            return self.frame is not None and self._due()
+    
+    def _due(self):
+        # Caller holds the lock; a failed refresh also waits out the interval before retrying
+        return time.monotonic() - max(self.refreshed_at, self.attempted_at or 0) >= self.refresh_seconds
+    
+    def stage_refresh(self):
+        """Fetch updates without swapping them in; returns finish(publish), or None when there is nothing to do
+
+        finish(True) swaps the update in and finish(False) drops it; until
+        either is called readers keep the current frame and no other refresh
+        starts. Returns None without fetching when nothing is loaded yet or a
+        refresh is already running, and raises when the fetch fails.
+        """
+        with self._lock:
+            if self.frame is None or self._refreshing:
+                return None
+            self._refreshing = True
+            frame, watermark = self.frame, self.watermark
+        try:
+            update = self._fetch_update(frame, watermark)
+        except Exception as e:
+            self.last_error = f"Background refresh failed: {e}"
+            self._refreshing = False
+            raise
+        
+        def finish(publish):
+            if publish:
+                with self._lock:
+                    # A synchronous reload may have replaced the frame meanwhile
+                    if self.frame is frame:
+                        self._apply(*update)
+            self._refreshing = False
+        return finish
+    
+    def derived(self, key, builder, handle=None):
+        """Compute builder(frame) once per data fingerprint and reuse it until the data changes
+
+        ``key`` is any hashable naming the result, such as a string or a tuple
+        of a function name and its arguments. With a ``handle`` the result is
+        built from and keyed on that handle's data rather than the latest.
+        """
+        with trace_stage('derived', key if isinstance(key, str) else key[0]) as span:
+            value, span.cache_hit = self._derived_value(key, builder, handle)
+            frame = self.frame if handle is None else handle.frame
+            if not span.cache_hit and frame is not None:
+                span.rows = len(frame)
+        return value
+    
+    def _derived_value(self, key, builder, handle):
+        # Returns (value, whether it came from the memo)
+        start = time.perf_counter()
+        with self._lock:
+            if handle is None:
+                frame, fingerprint = self.frame, self.fingerprint
+            else:
+                frame, fingerprint = handle.frame, handle.fingerprint
+            memo_key = key if handle is None or handle.scope is None else (handle.scope, key)
+            cached = self._derived.get(memo_key)
+        key_seconds = time.perf_counter() - start
+        
+        hit = cached is not None and cached[0] == fingerprint
+        build_seconds = 0.0
+        if hit:
+            value = cached[1]
+        else:
+            start = time.perf_counter()
+            value = builder(shared_view(frame))
+            build_seconds = time.perf_counter() - start
+        
+        with self._lock:
+            if hit and memo_key in self._derived:
+                self._derived.move_to_end(memo_key)
+            elif not hit and self.fingerprint == fingerprint:
+                self._derived[memo_key] = (fingerprint, value)
+                self._derived.move_to_end(memo_key)
+                while len(self._derived) > DERIVED_MAX_ENTRIES:
+                    self._derived.popitem(last=False)
+            stats = self.memo_stats.setdefault(key if isinstance(key, str) else key[0], [0, 0, 0.0, 0.0])
+            stats[0] += 1
+            stats[1] += hit
+            stats[2] += key_seconds
+            stats[3] += build_seconds
+        return value, hit
+    
+    def invalidate(self):
+        """Force the next get() to reload the full dataset from the warehouse"""
+        with self._lock:
+            self.frame = None
+            self.watermark = None
+            self.fingerprint = None
+            self.source = None
+    
+    def _fetch(self, fetcher, *args):
+        # Run a warehouse fetch, counting the rows of each batch as it arrives
+        self.loading_rows = 0
+        self.attempted_at = time.monotonic()
+        
+        def on_batch(rows):
+            self.loading_rows += rows
+        
+        try:
+            with trace_stage('dataset fetch', self.name) as span:
+                frame = fetcher(*args, on_batch=on_batch)
+                span.rows = len(frame)
+            self.last_fetch_seconds = time.monotonic() - self.attempted_at
+            return frame
+        finally:
+            self.loading_rows = None
+    
+    def _fetch_update(self, frame, watermark):
+        # Returns (new frame or None if unchanged, rows fetched)
+        if self.fetch_since is None or watermark is None:
+            full = self._fetch(self.fetch_full)
+            return full, None
+        delta = self._fetch(self.fetch_since, watermark)
+        if delta.empty:
+            return None, 0
+        with trace_stage('merge', self.name) as span:
+            merged = self.merge(frame, delta, watermark)
+            span.rows = len(delta)
+        return merged, len(delta)
+    
+    def _apply(self, frame, rows):
+        # Caller holds the lock
+        self.refreshed_at = time.monotonic()
+        self.last_error = None
+        if frame is None:
+            self.last_refresh_rows = rows
+            return
+        self.frame = frame
+        if self.watermark_column and not frame.empty:
+            self.watermark = frame[self.watermark_column].max()
+        self._set_fingerprint()
+        self.version += 1
+        self.source = 'warehouse'
+        self.last_refresh_rows = len(frame) if rows is None else rows
+        if self._snapshot_due():
+            self.snapshot_at = time.monotonic()
+            threading.Thread(
+                target=self._save_snapshot, args=(frame, self.watermark),
+                name=f"snapshot-{self.name}", daemon=True
+            ).start()
+    
+    def _set_fingerprint(self):
+        # Caller holds the lock. Row count plus the latest watermark identify an
+        # append-only dataset; small datasets without one are hashed once here.
+        # Results derived from an unchanged dataset survive the reload.
+        start = time.perf_counter()
+        if self.watermark_column:
+            fingerprint = (len(self.frame), self.watermark)
+        else:
+            fingerprint = (len(self.frame), int(pd.util.hash_pandas_object(self.frame, index=False).sum()))
+        self.fingerprint_seconds = time.perf_counter() - start
+        if fingerprint != self.fingerprint:
+            self._derived = OrderedDict()
+        self.fingerprint = fingerprint
+    
+    def _snapshot_due(self):
+        # Caller holds the lock. An older snapshot is still a valid cold-start
+        # point, since the restore catches up from its watermark.
+        if self.snapshots is None:
+            return False
+        return self.snapshot_at is None or time.monotonic() - self.snapshot_at >= self.snapshots.min_interval
+    
+    def _save_snapshot(self, frame, watermark):
+        try:
+            self.snapshots.save(self.name, frame, watermark)
+        except Exception as e:
+            self.last_error = f"Snapshot save failed: {e}"
+    
+    def _restore_snapshot(self):
+        # Caller holds the lock
+        if self.snapshots is None:
+            return False
+        try:
+            restored = self.snapshots.load(self.name)
+        except Exception as e:
+            self.last_error = f"Snapshot load failed: {e}"
+            return False
+        if restored is None:
+            return False
+        self.frame, self.watermark = restored
+        self._set_fingerprint()
+        self.version += 1
+        self.source = 'snapshot'
+        self.refreshed_at = self.snapshot_at = time.monotonic()
+        return True
+    
+    def _start_background_refresh(self):
+        # Caller holds the lock
+        if self._refreshing:
+            return
+        self._refreshing = True
+        threading.Thread(target=self._refresh, name=f"refresh-{self.name}", daemon=True).start()
+    
+    def _refresh(self):
+        # Runs with _refreshing set; the fetch happens outside the lock
+        try:
+            frame, watermark = self.frame, self.watermark
+            update = self._fetch_update(frame, watermark)
+            with self._lock:
+                # A synchronous reload may have replaced the frame meanwhile
+                if self.frame is frame:
+                    self._apply(*update)
+        except Exception as e:
+            self.last_error = f"Background refresh failed: {e}"
+        finally:
+            self._refreshing = False
+    
+    def status(self):
+        """Summary of the cached dataset for the diagnostics panel"""
+        return {
+            'rows': 0 if self.frame is None else len(self.frame),
+            'version': self.version,
+            'fingerprint': self.fingerprint,
+            'fingerprint_seconds': self.fingerprint_seconds,
+            'source': self.source,
+            'watermark': self.watermark,
+            'last_refresh_rows': self.last_refresh_rows,
+            'refreshing': self._refreshing,
+            'refreshed_seconds_ago': None if self.refreshed_at is None else time.monotonic() - self.refreshed_at,
+            'last_fetch_seconds': self.last_fetch_seconds,
+            'loading_rows': self.loading_rows,
+            'last_error': self.last_error,
+            'memory_bytes': 0 if self.frame is None else int(self.frame.memory_usage(deep=True).sum()),
+            'memory_before_bytes': None if self.frame is None else self.frame.attrs.get('memory_before')
+        }
+
+class DatasetLoader:
+    """Runs dataset loads in background threads so independent warehouse queries overlap
+
+    Loads are single-flight per name and kind: asking for a dataset that is
+    already loading returns the same future instead of issuing another query,
+    while a full reload waits for no incremental load (nor the reverse). Load
+    threads run without a script context, so load() must not render anything
+    and reports failures by raising.
+    """
+    
+    def __init__(self):
+        self._futures = {}
+        self._lock = threading.Lock()
+    
+    def submit(self, name, load, full_reload=False):
+        """Start load() in a background thread unless the same load of this name is running; returns its future"""
+        key = (name, full_reload)
+        with self._lock:
+            future = self._futures.get(key)
+            if future is not None and not future.done():
+                return future
+            future = Future()
+            self._futures[key] = future
+        load = get_tracer().bind(load, 'load')
+        threading.Thread(target=self._run, args=(future, load), name=f"load-{name}", daemon=True).start()
+        return future
+    
+    @staticmethod
+    def _run(future, load):
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(load())
+        except BaseException as e:
+            future.set_exception(e)
+    
+    def in_flight(self):
+        """Names of the loads still running"""
+        with self._lock:
+            return [name for (name, _), future in self._futures.items() if not future.done()]
+
+@st.cache_resource
+def get_dataset_loader():
+    """Process-wide dataset loader shared across sessions"""
+    return DatasetLoader()
+
+def wait_for_load(future, label, cache=None):
+    """Wait for a dataset load, showing how many rows have arrived while the fetch runs"""
+    wait([future], timeout=0.1)
+    if not future.done():
+        placeholder = st.empty()
+        start = time.monotonic()
+        while not future.done():
+            rows = None if cache is None else cache.loading_rows
+            fetched = f", {rows:,} rows fetched" if rows else ""
+            placeholder.info(f"⏳ Loading {label}{fetched} ({time.monotonic() - start:.0f}s)")
+            wait([future], timeout=0.25)
+        placeholder.empty()
+    return future.result()
+
+def load_dataset(cache, label, full_reload=False):
+    """Load a dataset cache's handle on the background loader and wait for it
+
+    Traced as a cache hit when the cached data was served without a fetch.
+    """
+    with trace_stage('load', cache.name) as span:
+        version = cache.version
+        load = functools.partial(cache.handle, full_reload=full_reload)
+        handle = wait_for_load(get_dataset_loader().submit(cache.name, load, full_reload), label, cache)
+        span.cache_hit = cache.version == version
+        span.rows = 0 if handle.frame is None else len(handle.frame)
+    return handle
+
+def start_dataset_loads():
+    """Issue the queries behind every view at once so their warehouse round-trips overlap"""
+    loader = get_dataset_loader()
+    rfm_cache = get_rfm_cache()
+    loader.submit(rfm_cache.name, rfm_cache.handle)
+    predicate = selected_insights_predicate()
+    if INSIGHTS_AGGREGATION == 'pandas':
+        transaction_cache, _ = get_transaction_store().resolve(predicate)
+        loader.submit(transaction_cache.name, transaction_cache.handle)
+    else:
+        loader.submit(*insights_aggregate_load(predicate))
+
+def segment_summary_table():
+    """Fully qualified name of the warehouse RFM segment summary table"""
+    return f"{os.getenv('DATABASE_NAME', 'retail_analytics')}.{os.getenv('TABLE_NAME', 'dlt.segment_summary')}"
+
+def query_rfm_segments(on_batch=None):
+    """Fetch the pre-aggregated RFM segment summary"""
+    query = f"""
+    SELECT * FROM {segment_summary_table()}
+    ORDER BY Total_Revenue DESC
+    """
+    return run_query(query, on_batch=on_batch, name='segment_summary')
+
+@st.cache_resource
+def get_rfm_cache():
+    """Process-wide RFM segment cache shared across sessions"""
+    return DatasetCache('segment_summary', query_rfm_segments, snapshots=get_snapshot_store(),
+                        refresh_on_read=not BACKGROUND_REFRESH)
+
+def load_rfm_data(full_reload=False):
+    """Load RFM segmentation data from Databricks as a DatasetHandle"""
+    try:
+        cache = get_rfm_cache()
+        return load_dataset(cache, "segment summary", full_reload)
+    except Exception as e:
+        st.error(f"Error loading RFM data: {str(e)}")
+        return None
+
+@st.cache_resource
+def get_transaction_cache():
+    """Process-wide incremental transaction cache shared across sessions"""
+    return DatasetCache(
+        'retail_transactions_silver', query_transactions,
+        fetch_since=lambda watermark, on_batch=None: query_transactions(since=watermark, on_batch=on_batch),
+        merge=merge_transactions, watermark_column='ingestion_timestamp',
+        refresh_seconds=TRANSACTION_REFRESH_SECONDS, snapshots=get_snapshot_store(),
+        refresh_on_read=not BACKGROUND_REFRESH
+    )
+
+def load_transaction_data(full_reload=False):
+    """Load transaction data for time-series analysis as a DatasetHandle"""
+    try:
+        cache = get_transaction_cache()
+        return load_dataset(cache, "transactions", full_reload)
+    except Exception as e:
+        st.error(f"Error loading transaction data: {str(e)}")
+        return None
+
+class TransactionStore:
+    """Transaction caches per server-side (date, countries) predicate
+
+    A predicate is served from any loaded cache whose own predicate covers
+    it, including the full-history cache, by filtering that cache locally;
+    otherwise a cache fetching only the matching rows is created.
+    """
+    
+    def __init__(self, full, max_entries=TRANSACTION_PREDICATE_CACHES):
+        self.full = full
+        self.max_entries = max_entries
+        self.reused = 0
+        self.fetched = 0
+        self._caches = OrderedDict()    # predicate -> DatasetCache
+        self._lock = threading.Lock()
+    
+    def resolve(self, predicate):
+        """Return (cache to load, predicate still to apply locally or None) for a predicate"""
+        if predicate is None:
+            return self.full, None
+        with self._lock:
+            cache = self._caches.get(predicate)
+            if cache is not None:
+                self._caches.move_to_end(predicate)
+                return cache, None
+            covering = [cached for covered, cached in self._caches.items()
+                        if cached.frame is not None and predicate_covers(covered, predicate)]
+            if self.full.frame is not None:
+                covering.append(self.full)
+            if covering:
+                self.reused += 1
+                return min(covering, key=lambda cached: len(cached.frame)), predicate
+            
+            self.fetched += 1
+            cache = DatasetCache(
+                f"retail_transactions_silver {predicate_label(predicate)}",
+                lambda on_batch=None: query_transactions(predicate=predicate, on_batch=on_batch),
+                fetch_since=lambda watermark, on_batch=None: query_transactions(
+                    since=watermark, predicate=predicate, on_batch=on_batch
+                ),
+                merge=merge_transactions, watermark_column='ingestion_timestamp',
+                refresh_seconds=TRANSACTION_REFRESH_SECONDS, refresh_on_read=not BACKGROUND_REFRESH
+            )
+            self._caches[predicate] = cache
+            while len(self._caches) > self.max_entries:
+                self._caches.popitem(last=False)
+            return cache, None
+    
+    def handle(self, predicate):
+        """Load and return a DatasetHandle over the transactions matching a predicate"""
+        cache, narrow = self.resolve(predicate)
+        handle = cache.handle()
+        return handle if narrow is None else handle.narrow(narrow)
+    
+    def caches(self):
+        """The predicate caches, least recently used first"""
+        with self._lock:
+            return list(self._caches.values())
+    
+    def clear(self):
+        """Drop every predicate cache"""
+        with self._lock:
+            self._caches.clear()
+
+@st.cache_resource
+def get_transaction_store():
+    """Process-wide predicate-filtered transaction caches shared across sessions"""
+    return TransactionStore(get_transaction_cache())
+
+def source_table_version(table):
+    """Version of a source table, or None when the source cannot report one
+
+    Delta tables report their latest commit version; the local engine the
+    file count and latest modification of the table's Parquet files.
+    """
+    source = data_source()
+    if hasattr(source, 'table_version'):
+        return source.table_version(table)
+    history = run_query(f"DESCRIBE HISTORY {table} LIMIT 1", name='table_version')
+    return None if history.empty else int(history['version'].iloc[0])
+
+class Refresher:
+    """Process-wide worker refreshing the cached data when its source table changes
+
+    Every ``check_seconds`` it reads each source table's version; a table
+    without a readable version gets a new one on its caches' refresh schedule.
+    When the version moved, updates for the loaded dataset caches reading
+    the table are staged and the cached results registered with track() are
+    warmed under the new version; only when all of them succeeded are the
+    staged frames swapped in together with the version. Requests keep being
+    served the previous data until the swap, and since this worker is the only
+    one refreshing, concurrent requests never start fetches. The worker has no
+    script context, so the warm-ups must only fill process-wide caches.
+    """
+    
+    def __init__(self, sources, check_seconds=REFRESH_CHECK_SECONDS, max_tracked=TRANSACTION_PREDICATE_CACHES + 1):
+        self.sources = sources      # function returning {table: dataset caches reading it}
+        self.check_seconds = check_seconds
+        self.max_tracked = max_tracked
+        self.served = {}            # table -> version the served data was loaded at
+        self.tables = {}            # table -> refresh state reported by status()
+        self.checked_at = None
+        self.last_error = None
+        self.refreshing = None      # table being refreshed
+        self._tracked = {}          # table -> OrderedDict of key -> warm(version)
+        self._thread = None
+        self._ready = threading.Event()
+        self._lock = threading.Lock()
+    
+    def start(self):
+        """Check the sources once, then keep checking from a daemon thread; later calls return at once"""
+        with self._lock:
+            starting = self._thread is None
+            if starting:
+                self._thread = threading.Thread(target=self._run, name="refresher", daemon=True)
+        if starting:
+            try:
+                # Publishes the versions that the first requests' cached results are keyed on
+                self.check()
+            finally:
+                self._ready.set()
+            self._thread.start()
+        self._ready.wait()
+    
+    def _run(self):
+        while True:
+            time.sleep(self.check_seconds)
+            try:
+                self.check()
+                self.last_error = None
+            except Exception as e:
+                self.last_error = f"Refresh check failed: {e}"
+    
+    def version(self, table):
+        """Version of the table the served data was loaded at"""
+        return self.served.get(table)
+    
+    def track(self, table, key, warm):
+        """Register warm(version), which loads a cached result at a new version and raises if that fails"""
+        with self._lock:
+            tracked = self._tracked.setdefault(table, OrderedDict())
+            tracked[key] = warm
+            tracked.move_to_end(key)
+            while len(tracked) > self.max_tracked:
+                tracked.popitem(last=False)
+    
+    def check(self):
+        """Read every source table's version and refresh the data of those that changed"""
+        for table, caches in self.sources().items():
+            state = self.tables.setdefault(table, {
+                'refreshed_at': None, 'duration_seconds': None, 'refreshes': 0, 'failures': 0,
+                'error': None, 'version_error': None, 'versioned': False
+            })
+            try:
+                version = source_table_version(table)
+                state['version_error'] = None
+            except Exception as e:
+                version = None
+                state['version_error'] = str(e)
+            state['versioned'] = version is not None
+            if version is None:
+                interval = max(min(cache.refresh_seconds for cache in caches), 1)
+                version = ('scheduled', int(time.time() // interval))
+            if table not in self.served:
+                self.served[table] = version
+            elif version != self.served[table]:
+                with get_tracer().run('refresh'):
+                    self._refresh(table, version, caches, state)
+        self.checked_at = time.monotonic()
+    
+    def _refresh(self, table, version, caches, state):
+        self.refreshing = table
+        start = time.monotonic()
+        staged = []
+        try:
+            errors = []
+            for cache in caches:
+                try:
+                    finish = cache.stage_refresh()
+                except Exception as e:
+                    errors.append(f"{cache.name}: {e}")
+                    continue
+                if finish is not None:
+                    staged.append(finish)
+            with self._lock:
+                warms = list(self._tracked.get(table, {}).items())
+            for key, warm in warms if not errors else ():
+                try:
+                    warm(version)
+                except Exception as e:
+                    errors.append(f"{key}: {e}")
+            if errors:
+                # Keep serving the previous version; the next check retries
+                state['failures'] += 1
+                state['error'] = '; '.join(errors)
+            else:
+                # The data and the version its results are keyed on switch together
+                published, staged = staged, []
+                with self._lock:
+                    for finish in published:
+                        finish(True)
+                    self.served[table] = version
+                state['refreshes'] += 1
+                state['refreshed_at'] = time.monotonic()
+                state['error'] = None
+        finally:
+            for finish in staged:
+                finish(False)
+            state['duration_seconds'] = time.monotonic() - start
+            self.refreshing = None
+    
+    def status(self):
+        """Per-table refresh state: versions, timings and the last failure"""
+        now = time.monotonic()
+        return {
+            table: {
+                'version': self.served.get(table),
+                'versioned': state['versioned'],
+                'refreshing': self.refreshing == table,
+                'checked_seconds_ago': None if self.checked_at is None else now - self.checked_at,
+                'refreshed_seconds_ago': None if state['refreshed_at'] is None else now - state['refreshed_at'],
+                'duration_seconds': state['duration_seconds'],
+                'refreshes': state['refreshes'],
+                'failures': state['failures'],
+                'error': state['error'],
+                'version_error': state['version_error']
+            }
+            for table, state in list(self.tables.items())
+        }
+
+@st.cache_resource
+def get_refresher():
+    """Process-wide background refresher shared across sessions"""
+    return Refresher(lambda: {
+        TRANSACTIONS_TABLE: [get_transaction_cache(), *get_transaction_store().caches()],
+        segment_summary_table(): [get_rfm_cache()],
+    })
+
+def source_version(table):
+    """Version of a source table the served data was loaded at, used to key cached results; None without background refresh"""
+    return get_refresher().version(table) if BACKGROUND_REFRESH else None
+
+class ResultCache:
+    """Process-wide warehouse results keyed by name, arguments and source table version
+
+    Unlike st.cache_data it needs no script context, so loader, prefetch and
+    refresher threads can fill it, and a hit returns the stored object rather
+    than an unpickled copy; callers treat results as read-only. Loads are
+    single-flight per key, and a load that raises is not stored, so the next
+    request retries it. Entries beyond ``max_entries`` are evicted least
+    recently used first, and entries older than ``ttl`` seconds reload.
+    """
+    
+    def __init__(self, ttl=None, max_entries=64):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()   # key -> (monotonic time stored, value), least recently used first
+        self._loading = {}              # key -> Future of the load in flight
+        self._lock = threading.Lock()
+    
+    def get(self, key, load):
+        """The stored result for key, or load() shared with any request already loading it"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (self.ttl is None or time.monotonic() - entry[0] < self.ttl):
+                self._entries.move_to_end(key)
+                return entry[1]
+            future = self._loading.get(key)
+            owner = future is None
+            if owner:
+                future = self._loading[key] = Future()
+        if not owner:
+            return future.result()
+        
+        try:
+            value = load()
+        except BaseException as e:
+            with self._lock:
+                del self._loading[key]
+            future.set_exception(e)
+            raise
+        with self._lock:
+            del self._loading[key]
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        future.set_result(value)
+        return value
+    
+    def clear(self):
+        """Drop every stored result; loads in flight still complete"""
+        with self._lock:
+            self._entries.clear()
+    
+    def __len__(self):
+        return len(self._entries)
+
+@st.cache_resource
+def get_result_cache():
+    """Process-wide warehouse result cache shared across sessions"""
+    return ResultCache(**RESULT_CACHE)
+
+def result_loader(name, query, *args):
+    """load(version) returning query(*args) through the result cache, keyed on name, args and version
+
+    load raises when the query fails and needs no script context, so the
+    background loader, prefetcher and refresher threads can call it.
+    """
+    results = get_result_cache()
+    return lambda version=None: results.get((name, args, version), lambda: query(*args))
+
+def load_filtered_transactions(predicate):
+    """Load the transactions matching a predicate as a DatasetHandle"""
+    try:
+        cache, narrow = get_transaction_store().resolve(predicate)
+        handle = load_dataset(cache, "transactions")
+        return handle if narrow is None else handle.narrow(narrow)
+    except Exception as e:
+        st.error(f"Error loading transaction data: {str(e)}")
+        return None
+
+def query_transaction_bounds():
+    """First and last invoice dates and the countries present, for the insights filters; None for an empty table"""
+    bounds = run_query(TRANSACTION_BOUNDS_QUERY.format(table=TRANSACTIONS_TABLE, filter=TRANSACTION_FILTER),
+                       name='transaction_bounds')
+    if bounds.empty:
+        return None
+    return (
+        pd.to_datetime(bounds['FirstInvoice']).min().date(),
+        pd.to_datetime(bounds['LastInvoice']).max().date(),
+        sorted(bounds['Country'].dropna().tolist())
+    )
+
+def query_insight_aggregates(predicate=None):
+    """Run the insights aggregations in the warehouse and fetch only their results"""
+    condition, parameters = transaction_filter(predicate)
+    aggregates = run_queries({
+        name: query.format(table=TRANSACTIONS_TABLE, filter=condition)
+        for name, query in AGGREGATE_QUERIES.items()
+    }, parameters or None)
+    return normalize_insight_aggregates(aggregates)
+
+@st.cache_data(**RESULT_CACHE)
+def load_customer_invoices(customer_id, limit=RECENT_INVOICES, source_version=None):
+    """A customer's most recent invoices from the warehouse, newest first; source_version keys the cache"""
+    try:
+        query = CUSTOMER_INVOICES_QUERY.format(table=TRANSACTIONS_TABLE, filter=TRANSACTION_FILTER, limit=int(limit))
+        invoices = run_query(query, {'customer_id': customer_id}, name='customer_invoices')
+        invoices['InvoiceDate'] = pd.to_datetime(invoices['InvoiceDate'])
+        return invoices
+    except Exception as e:
+        st.error(f"Error loading customer invoices: {str(e)}")
+        return None
+
+def insights_aggregate_load(predicate=None):
+    """Loader name and function producing the insights aggregates for a predicate in 'sql' or 'stream' mode
+
+    The function loads through the result cache at the transactions version
+    being served and raises on failure; the background refresher re-warms it
+    under a new version before switching to that version. 'stream' mode folds
+    the rows as they arrive, keeping the aggregates and per-customer state.
+    """
+    if INSIGHTS_AGGREGATION == 'stream':
+        name, load = 'streamed_aggregates', result_loader('streamed_aggregates', fold_transactions, predicate)
+    else:
+        name, load = 'insight_aggregates', result_loader('insight_aggregates', query_insight_aggregates, predicate)
+    name = f"{name} {predicate_label(predicate)}"
+    if BACKGROUND_REFRESH:
+        get_refresher().track(TRANSACTIONS_TABLE, name, load)
+    return name, functools.partial(load, source_version(TRANSACTIONS_TABLE))
+
+def transaction_bounds():
+    """query_transaction_bounds at the transactions version being served, or None when it fails"""
+    load = result_loader('transaction_bounds', query_transaction_bounds)
+    if BACKGROUND_REFRESH:
+        get_refresher().track(TRANSACTIONS_TABLE, 'transaction_bounds', load)
+    try:
+        return load(source_version(TRANSACTIONS_TABLE))
+    except Exception as e:
+        st.error(f"Error loading transaction date range: {str(e)}")
+        return None
+
+def normalize_insight_aggregates(aggregates):
+    """Coerce aggregate query results to the dtypes the chart builders expect"""
+    aggregates['monthly']['Month'] = pd.to_datetime(aggregates['monthly']['Month'])
+    aggregates['first_purchase']['Date'] = pd.to_datetime(aggregates['first_purchase']['Date'])
+    aggregates['cohort']['CohortMonth'] = pd.to_datetime(aggregates['cohort']['CohortMonth'])
+    aggregates['cohort']['CohortPeriod'] = aggregates['cohort']['CohortPeriod'].astype('int64')
+    for column in FRESHNESS_KEYS + ('FirstInvoice', 'LastInvoice', 'LastIngestion'):
+        aggregates['freshness'][column] = naive_datetimes(aggregates['freshness'][column])
+    aggregates['freshness']['Records'] = aggregates['freshness']['Records'].astype('int64')
+    return aggregates
+
+# Pandas reference implementations of AGGREGATE_QUERIES, used when the raw
+# transaction frame is loaded and for parity checks against the SQL versions
+def monthly_activity(df):
+    """Aggregate revenue, active customers and orders per calendar month"""
+    monthly = df.groupby(df['InvoiceDate'].dt.to_period('M')).agg({
+        'TotalPrice': 'sum',
+        'CustomerID': 'nunique',
+        'InvoiceNo': 'nunique'
+    }).reset_index()
+    
+    monthly['InvoiceDate'] = monthly['InvoiceDate'].dt.to_timestamp()
+    monthly.columns = ['Month', 'Revenue', 'UniqueCustomers', 'Orders']
+    return monthly
+
+def top_country_revenue(df, top_n=10):
+    """Aggregate revenue, customers and orders for the top countries by revenue"""
+    country_revenue = df.groupby('Country', observed=True).agg({
+        'TotalPrice': 'sum',
+        'CustomerID': 'nunique',
+        'InvoiceNo': 'nunique'
+    }).reset_index()
+    
+    country_revenue.columns = ['Country', 'Revenue', 'Customers', 'Orders']
+    return country_revenue.sort_values('Revenue', ascending=False).head(top_n).reset_index(drop=True)
+
+def first_purchase_counts(df):
+    """Count customers by the timestamp of their first purchase"""
+    customer_first_purchase = df.groupby('CustomerID')['InvoiceDate'].min().reset_index()
+    customer_first_purchase.columns = ['CustomerID', 'FirstPurchaseDate']
+    
+    new_customers = customer_first_purchase.groupby('FirstPurchaseDate').size().reset_index()
+    new_customers.columns = ['Date', 'NewCustomers']
+    return new_customers.sort_values('Date').reset_index(drop=True)
+
+def cohort_counts(df):
+    """Count active customers per acquisition month and months since first purchase"""
+    # Months since 1970, so cohort periods are integer differences
+    df_cohort = df[['CustomerID']].assign(InvoiceMonth=period_ordinals(df['InvoiceDate'], 'M'))
+    df_cohort = df_cohort.assign(CohortMonth=df_cohort.groupby('CustomerID')['InvoiceMonth'].transform('min'))
+    df_cohort = df_cohort.assign(CohortPeriod=df_cohort['InvoiceMonth'] - df_cohort['CohortMonth'])
+    
+    cohort_data = df_cohort.groupby(['CohortMonth', 'CohortPeriod'])['CustomerID'].nunique().reset_index()
+    cohort_data['CohortMonth'] = pd.to_datetime(
+        cohort_data['CohortMonth'].to_numpy().astype('datetime64[M]').astype('datetime64[ns]')
+    )
+    cohort_data.columns = ['CohortMonth', 'CohortPeriod', 'Customers']
+    return cohort_data
+
+def business_totals(df):
+    """Compute overall customer, revenue and order totals"""
+    return pd.DataFrame([{
+        'Customers': df['CustomerID'].nunique(),
+        'Revenue': df['TotalPrice'].sum(),
+        'Orders': df['InvoiceNo'].nunique()
+    }])
+
+def compute_insight_aggregates(df):
+    """Build the insights aggregates from the raw transaction frame"""
+    return {
+        'monthly': monthly_activity(df),
+        'country': top_country_revenue(df),
+        'first_purchase': first_purchase_counts(df),
+        'cohort': cohort_counts(df),
+        'totals': business_totals(df)
+    }
+
+class DistinctSketches:
+    """HyperLogLog sketches counting distinct values per group, mergeable into coarser groups
+
+    Each value is hashed to 64 bits: the low ``precision`` bits pick one of
+    m registers, which keeps the highest rank (trailing zeros plus one) seen
+    in the remaining bits. Merging sketches is a register-wise maximum, so
+    per-month sketches roll up to countries and totals without the rows, in
+    m bytes per group. Estimates use Ertl's improved estimator, which holds
+    the relative standard error near 1.04 / sqrt(m) from empty to billions.
+    """
+    
+    chunk_rows = 1 << 18                # values hashed at a time
+    
+    def __init__(self, keys, registers):
+        self.keys = keys                # one row of group keys per sketch
+        self.registers = registers      # uint8, one row of m registers per sketch
+    
+    @property
+    def relative_error(self):
+        """Relative standard error of the estimates"""
+        return 1.04 / np.sqrt(self.registers.shape[1])
+    
+    @classmethod
+    def from_values(cls, groups, values, precision=HLL_PRECISION):
+        """Sketch each column of values per row of the groups frame, whose columns are the group keys
+
+        groups may also be a sorted, observed DataFrameGroupBy over the values'
+        rows, sharing a grouping the caller already computed. Returns
+        {column: DistinctSketches}, all over the same groups.
+        """
+        m = 1 << precision
+        grouped = groups if hasattr(groups, 'ngroup') else groups.groupby(list(groups.columns), observed=True, sort=True)
+        codes = grouped.ngroup().to_numpy() * m
+        keys = grouped.size().index.to_frame(index=False)
+        
+        sketches = {}
+        for column in values.columns:
+            registers = np.zeros(len(keys) * m, dtype=np.uint8)
+            # Chunks bound the hashing temporaries, which for strings run to ~100 bytes a row
+            for start in range(0, len(values), cls.chunk_rows):
+                chunk = values[column].iloc[start:start + cls.chunk_rows]
+                hashes = pd.util.hash_pandas_object(chunk, index=False).to_numpy()
+                register = (hashes & np.uint64(m - 1)).astype(np.int64)
+                rest = hashes >> np.uint64(precision)
+                lowest_bit = rest & (~rest + np.uint64(1))
+                lowest_bit[rest == 0] = np.uint64(1) << np.uint64(64 - precision)
+                rank = (np.log2(lowest_bit.astype(np.float64)) + 1).astype(np.uint8)
+                np.maximum.at(registers, codes[start:start + cls.chunk_rows] + register, rank)
+            sketches[column] = cls(keys, registers.reshape(len(keys), m))
+        return sketches
+    
+    def merge(self, by=()):
+        """Sketches per distinct combination of the ``by`` key columns; no columns merges them all into one"""
+        by = list(by)
+        if not by:
+            return DistinctSketches(pd.DataFrame(index=range(1)), self.registers.max(axis=0, initial=0)[np.newaxis])
+        codes = self.keys.groupby(by, observed=True, sort=True).ngroup().to_numpy()
+        order = np.argsort(codes, kind='stable')
+        starts = np.flatnonzero(np.r_[True, np.diff(codes[order]) != 0])
+        keys = self.keys[by].iloc[order[starts]].reset_index(drop=True)
+        return DistinctSketches(keys, np.maximum.reduceat(self.registers[order], starts, axis=0))
+    
+    def estimates(self):
+        """Estimated distinct count per sketch, rounded to whole values"""
+        m = self.registers.shape[1]
+        q = 64 - int(np.log2(m))
+        counts = np.stack([np.bincount(row, minlength=q + 2) for row in self.registers]).astype(np.float64) / m
+        
+        # tau() corrects for registers at the maximum rank, sigma() for empty ones
+        x, y, tau = 1 - counts[:, q + 1], 1.0, counts[:, q + 1]
+        for _ in range(64):
+            x, y = np.sqrt(x), y / 2
+            tau = tau - (1 - x) ** 2 * y
+        z = np.where(counts[:, q + 1] > 0, tau / 3, 0.0)
+        for k in range(q, 0, -1):
+            z = (z + counts[:, k]) / 2
+        x, y, sigma = counts[:, 0], 1.0, counts[:, 0]
+        for _ in range(64):
+            x, y = x * x, y * 2
+            sigma = sigma + x * y / 2
+        with np.errstate(divide='ignore'):
+            estimate = m / (2 * np.log(2) * (z + sigma))
+        return np.where(counts[:, 0] == 1, 0, np.round(estimate)).astype(np.int64)
+    
+    def counts(self, by=()):
+        """Estimated distinct counts per ``by`` group as a Series, or one int when by is empty"""
+        merged = self.merge(by)
+        if not list(by):
+            return int(merged.estimates()[0])
+        return pd.Series(merged.estimates(), index=pd.MultiIndex.from_frame(merged.keys) if len(by) > 1
+                         else pd.Index(merged.keys[by[0]]))
+
+def build_aggregate_cube(df, approximate=False):
+    """Aggregate transactions once into the month x country fact cube behind the insights charts
+
+    Distinct customers and orders do not add up across months or countries,
+    so next to the additive facts the cube keeps the exact de-duplicated
+    (Month, Country, CustomerID) and (Month, Country, InvoiceNo) sets that
+    rollups re-count. With ``approximate`` it keeps DistinctSketches per
+    (Month, Country) in their place, plus customer sketches per
+    (CohortMonth, Month) for the cohort counts. Each customer's first purchase
+    is found once per customer code, and cohort months are taken from it.
+    """
+    customer_codes, customer_ids = pd.factorize(df['CustomerID'])
+    first_purchase = df['InvoiceDate'].groupby(customer_codes).min().reindex(range(len(customer_ids)))
+    
+    facts = pd.DataFrame({
+        'Month': df['InvoiceDate'].dt.to_period('M').dt.to_timestamp(),
+        'Country': df['Country'],
+        'CustomerID': df['CustomerID'],
+        'InvoiceNo': df['InvoiceNo'],
+        'TotalPrice': df['TotalPrice'].astype('float64')
+    })
+    
+    keys = ['Month', 'Country']
+    grouped = facts.groupby(keys, observed=True)
+    revenue = grouped['TotalPrice'].sum().rename('Revenue')
+    cube = {}
+    if approximate:
+        cube['monthly'] = revenue.reset_index()
+        # Sketched on the same grouping, so they line up with the monthly rows
+        sketches = DistinctSketches.from_values(grouped, facts[['CustomerID', 'InvoiceNo']])
+        cube['customer_sketches'], cube['invoice_sketches'] = sketches['CustomerID'], sketches['InvoiceNo']
+        cube['monthly']['Orders'] = cube['invoice_sketches'].estimates()
+        cube['monthly']['Customers'] = cube['customer_sketches'].estimates()
+        first_month = pd.DatetimeIndex(first_purchase.dt.to_period('M').dt.to_timestamp())
+        # Rows without a customer get code -1 and no cohort
+        cohort_month = first_month.take(customer_codes, allow_fill=True, fill_value=pd.NaT)
+        cube['cohort_sketches'] = DistinctSketches.from_values(
+            pd.DataFrame({'CohortMonth': cohort_month, 'Month': facts['Month']}), facts[['CustomerID']]
+        )['CustomerID']
+    else:
+        cube['customer_months'] = facts[['Month', 'Country', 'CustomerID']].drop_duplicates(ignore_index=True)
+        cube['invoice_months'] = facts[['Month', 'Country', 'InvoiceNo']].drop_duplicates(ignore_index=True)
+        orders = cube['invoice_months'].groupby(keys, observed=True).size().rename('Orders')
+        customers = cube['customer_months'].groupby(keys, observed=True).size().rename('Customers')
+        cube['monthly'] = pd.concat([revenue, orders, customers], axis=1).reset_index()
+    cube['first_purchase'] = pd.Series(first_purchase.array, index=pd.Index(customer_ids, name='CustomerID'),
+                                       name='InvoiceDate')
+    return cube
+
+def aggregates_from_cube(cube, top_n=10):
+    """Roll the aggregate cube up into the frames the insights charts and KPI cards read
+
+    An approximate cube merges its sketches instead of re-counting, and adds
+    the estimates' relative standard error as ``distinct_error``.
+    """
+    sketched = 'customer_sketches' in cube
+    if sketched:
+        customers, invoices = cube['customer_sketches'], cube['invoice_sketches']
+        distinct = {
+            'Month': (customers.counts(['Month']), invoices.counts(['Month'])),
+            'Country': (customers.counts(['Country']), invoices.counts(['Country'])),
+            None: (customers.counts(), invoices.counts())
+        }
+    else:
+        customer_months, invoice_months = cube['customer_months'], cube['invoice_months']
+        distinct = {
+            grain: (
+                customer_months.groupby(grain, observed=True)['CustomerID'].nunique(),
+                invoice_months.groupby(grain, observed=True)['InvoiceNo'].nunique()
+            )
+            for grain in ('Month', 'Country')
+        }
+        distinct[None] = (customer_months['CustomerID'].nunique(), invoice_months['InvoiceNo'].nunique())
+    
+    monthly = pd.concat([
+        cube['monthly'].groupby('Month')['Revenue'].sum(),
+        distinct['Month'][0].rename('UniqueCustomers'),
+        distinct['Month'][1].rename('Orders')
+    ], axis=1).reset_index()
+    
+    country = pd.concat([
+        cube['monthly'].groupby('Country', observed=True)['Revenue'].sum(),
+        distinct['Country'][0].rename('Customers'),
+        distinct['Country'][1].rename('Orders')
+    ], axis=1).reset_index()
+    country = country.sort_values('Revenue', ascending=False).head(top_n).reset_index(drop=True)
+    
+    new_customers = cube['first_purchase'].value_counts().sort_index().reset_index()
+    new_customers.columns = ['Date', 'NewCustomers']
+    
+    if sketched:
+        active = cube['cohort_sketches'].counts(['CohortMonth', 'Month']).reset_index(name='Customers')
+        period = ((active['Month'].dt.year - active['CohortMonth'].dt.year) * 12
+                  + (active['Month'].dt.month - active['CohortMonth'].dt.month))
+        cohort = active[['CohortMonth']].assign(CohortPeriod=period, Customers=active['Customers'])
+    else:
+        # Cohorts only need each customer's distinct active months
+        active = customer_months[['Month', 'CustomerID']].drop_duplicates()
+        cohort_month = active.groupby('CustomerID')['Month'].transform('min')
+        period = ((active['Month'].dt.year - cohort_month.dt.year) * 12
+                  + (active['Month'].dt.month - cohort_month.dt.month))
+        cohort = active.groupby([cohort_month.rename('CohortMonth'), period.rename('CohortPeriod')]).size()
+        cohort = cohort.rename('Customers').reset_index()
+    
+    totals = pd.DataFrame([{
+        'Customers': distinct[None][0],
+        'Revenue': cube['monthly']['Revenue'].sum(),
+        'Orders': distinct[None][1]
+    }])
+    
+    aggregates = {
+        'monthly': monthly,
+        'country': country,
+        'first_purchase': new_customers,
+        'cohort': cohort,
+        'totals': totals
+    }
+    if sketched:
+        aggregates['distinct_error'] = customers.relative_error
+    return aggregates
+
+class RunningAggregates:
+    """Insights aggregates and per-customer RFM state folded from transaction batches
+
+    Only grouped state is kept: revenue per (month, country), the distinct
+    (invoice, customer, month, country) tuples that order and active-customer
+    counts need, each customer's first and last purchase and spend, and the
+    freshness histogram. Batch partials are merged into that state once they
+    pass an eighth of the memory budget, and batches are sized so the raw rows
+    and their grouping temporaries take at most a quarter of it. The merged
+    state grows with the distinct invoices and customers, so compaction raises
+    MemoryError once it passes half the budget rather than overrunning it.
+    Invoice numbers are held as 64-bit hashes and customer ids, numeric or
+    text, as codes into a running table of the ids seen.
+    """
+    
+    # How partial state combines: group keys and column reductions, or None to de-duplicate rows
+    MERGES = {
+        'revenue': (['Month', 'Country'], {'Revenue': 'sum'}),
+        'invoices': None,
+        'customers': (['CustomerID'], {'FirstPurchase': 'min', 'LastPurchase': 'max', 'Monetary': 'sum'}),
+        'freshness': (list(FRESHNESS_KEYS), {
+            'Records': 'sum', 'FirstInvoice': 'min', 'LastInvoice': 'max', 'LastIngestion': 'max'
+        }),
+    }
+    
+    def __init__(self, memory_budget=STREAM_MEMORY_BUDGET_BYTES):
+        self.memory_budget = memory_budget
+        self.rows = 0
+        self.batches = 0
+        self.row_bytes = 256            # bytes per raw row, measured on each batch
+        self.state_bytes = 0
+        self.peak_state_bytes = 0
+        self.countries = []
+        self._country_codes = {}
+        self.customer_ids = None
+        self._state = dict.fromkeys(self.MERGES)
+        self._pending = {name: [] for name in self.MERGES}
+        self._pending_bytes = 0
+    
+    def batch_rows(self):
+        """Rows to fetch next; grouping a batch takes about four times its raw size"""
+        return int(max(1_000, min(ARROW_BATCH_ROWS, self.memory_budget // (16 * self.row_bytes))))
+    
+    def add(self, frame):
+        """Fold one batch of transactions into the running state"""
+        if frame.empty:
+            return
+        self.rows += len(frame)
+        self.batches += 1
+        self.row_bytes = max(int(frame.memory_usage(index=False, deep=True).sum()) // len(frame), 1)
+        
+        invoice_dates = naive_datetimes(frame['InvoiceDate'])
+        # Months since 1970 and small country codes keep every state column numeric
+        month = invoice_dates.to_numpy().astype('datetime64[M]').view('int64').astype('int32')
+        country = self._encode_countries(frame['Country'])
+        customer = self._encode_customers(frame['CustomerID'])
+        invoice = pd.util.hash_pandas_object(frame['InvoiceNo'].astype(str), index=False).to_numpy().view('int64')
+        revenue = frame['TotalPrice'].to_numpy(dtype='float64')
+        
+        self._add_partial('revenue', pd.DataFrame({'Month': month, 'Country': country, 'Revenue': revenue}))
+        self._add_partial('invoices', pd.DataFrame({
+            'Invoice': invoice, 'CustomerID': customer, 'Month': month, 'Country': country
+        }))
+        self._add_partial('customers', pd.DataFrame({
+            'CustomerID': customer,
+            'FirstPurchase': invoice_dates.to_numpy(),
+            'LastPurchase': invoice_dates.to_numpy(),
+            'Monetary': revenue
+        }))
+        self._add_partial('freshness', freshness_histogram(frame))
+        if self._pending_bytes > self.memory_budget // 8:
+            self.compact()
+    
+    def _encode_countries(self, values):
+        for country in values.unique():
+            if country not in self._country_codes:
+                self._country_codes[country] = len(self.countries)
+                self.countries.append(country)
+        return values.map(self._country_codes).to_numpy(dtype='int16')
+    
+    def _encode_customers(self, values):
+        if self.customer_ids is None:
+            self.customer_ids = pd.Index(values.unique())
+        codes = self.customer_ids.get_indexer(values)
+        new = codes < 0
+        if new.any():
+            self.customer_ids = self.customer_ids.append(pd.Index(values[new].unique()))
+            codes = self.customer_ids.get_indexer(values)
+        return codes
+    
+    def _add_partial(self, name, frame):
+        partial = self._merge(name, [frame])
+        self._pending[name].append(partial)
+        self._pending_bytes += int(partial.memory_usage(index=False).sum())
+    
+    def _merge(self, name, frames):
+        frame = pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+        if self.MERGES[name] is None:
+            return frame.drop_duplicates(ignore_index=True)
+        keys, reductions = self.MERGES[name]
+        return frame.groupby(keys, sort=False, as_index=False).agg(reductions)
+    
+    def compact(self):
+        """Merge the pending batch partials into the running state"""
+        for name, pending in self._pending.items():
+            if pending:
+                state = self._state[name]
+                self._state[name] = self._merge(name, pending if state is None else [state] + pending)
+                pending.clear()
+        self._pending_bytes = 0
+        self.state_bytes = sum(int(state.memory_usage(index=False).sum())
+                               for state in self._state.values() if state is not None)
+        if self.customer_ids is not None:
+            self.state_bytes += int(self.customer_ids.memory_usage(deep=True))
+        self.peak_state_bytes = max(self.peak_state_bytes, self.state_bytes)
+        if self.state_bytes > self.memory_budget // 2:
+            raise MemoryError(
+                f"Streamed aggregates reached {self.state_bytes / 1e6:.0f} MB after {self.rows:,} rows, over half of "
+                f"the {self.memory_budget / 1e6:.0f} MB budget; narrow the filters or raise STREAM_MEMORY_BUDGET_BYTES"
+            )
+    
+    def result(self):
+        """The insights aggregates, freshness histogram and per-customer RFM state, or None when no rows arrived"""
+        self.compact()
+        if self.rows == 0:
+            return None
+        revenue, invoices, customers, freshness = (self._state[name] for name in self.MERGES)
+        countries = np.array(self.countries, dtype=object)
+        
+        def month_starts(months):
+            return pd.to_datetime(months.to_numpy().astype('int64').astype('datetime64[M]').astype('datetime64[ns]'))
+        
+        monthly = pd.concat([
+            revenue.groupby('Month')['Revenue'].sum(),
+            invoices.groupby('Month')['CustomerID'].nunique().rename('UniqueCustomers'),
+            invoices.groupby('Month')['Invoice'].nunique().rename('Orders')
+        ], axis=1).reset_index()
+        monthly['Month'] = month_starts(monthly['Month'])
+        
+        country = pd.concat([
+            revenue.groupby('Country')['Revenue'].sum(),
+            invoices.groupby('Country')['CustomerID'].nunique().rename('Customers'),
+            invoices.groupby('Country')['Invoice'].nunique().rename('Orders')
+        ], axis=1).reset_index()
+        country['Country'] = countries[country['Country'].to_numpy()]
+        country = country.sort_values('Revenue', ascending=False).head(10).reset_index(drop=True)
+        
+        new_customers = customers['FirstPurchase'].value_counts().sort_index().reset_index()
+        new_customers.columns = ['Date', 'NewCustomers']
+        
+        active = invoices[['Month', 'CustomerID']].drop_duplicates()
+        cohort_month = active.groupby('CustomerID')['Month'].transform('min')
+        cohort = active.groupby([cohort_month.rename('CohortMonth'), (active['Month'] - cohort_month).rename('CohortPeriod')]).size()
+        cohort = cohort.rename('Customers').reset_index()
+        cohort['CohortMonth'] = month_starts(cohort['CohortMonth'])
+        cohort['CohortPeriod'] = cohort['CohortPeriod'].astype('int64')
+        
+        totals = pd.DataFrame([{
+            'Customers': len(customers),
+            'Revenue': revenue['Revenue'].sum(),
+            'Orders': invoices['Invoice'].nunique()
+        }])
+        
+        frequency = invoices[['Invoice', 'CustomerID']].drop_duplicates().groupby('CustomerID').size()
+        customer_state = pd.DataFrame({
+            'CustomerID': self.customer_ids.take(customers['CustomerID'].to_numpy()),
+            'LastPurchase': customers['LastPurchase'],
+            'Frequency': customers['CustomerID'].map(frequency).to_numpy(dtype='int64'),
+            'Monetary': customers['Monetary']
+        })
+        
+        return {
+            'monthly': monthly,
+            'country': country,
+            'first_purchase': new_customers,
+            'cohort': cohort,
+            'totals': totals,
+            'freshness': freshness,
+            'customers': customer_state,
+            'stream_stats': {
+                'rows': self.rows,
+                'batches': self.batches,
+                'batch_rows': self.batch_rows(),
+                'peak_state_bytes': self.peak_state_bytes
+            }
+        }
+
+def fold_transactions(predicate=None, memory_budget=None):
+    """Stream the transactions matching a predicate into RunningAggregates, never holding the raw rows"""
+    query, parameters = transactions_query(predicate=predicate, ordered=False)
+    aggregates = RunningAggregates(memory_budget or STREAM_MEMORY_BUDGET_BYTES)
+    stream_query(query, aggregates.add, parameters or None, aggregates.batch_rows)
+    return aggregates.result()
+
+# Cohort grains: label, period length in the axis title, and label format
+COHORT_GRAINS = {
+    'W': ('Weekly', 'Weeks'),
+    'M': ('Monthly', 'Months'),
+    'Q': ('Quarterly', 'Quarters')
+}
+
+def period_ordinals(dates, grain):
+    """Map timestamps to consecutive integer period numbers (Monday weeks, months or quarters)"""
+    values = dates.to_numpy(dtype='datetime64[ns]')
+    if grain == 'W':
+        # 1970-01-01 was a Thursday; shifting by three days starts weeks on Monday
+        return (values.astype('datetime64[D]').astype('int64') + 3) // 7
+    months = values.astype('datetime64[M]').astype('int64')
+    return months // 3 if grain == 'Q' else months
+
+def period_labels(ordinals, grain):
+    """Format period numbers from period_ordinals() as cohort labels"""
+    ordinals = np.asarray(ordinals, dtype='int64')
+    if grain == 'W':
+        return pd.to_datetime((ordinals * 7 - 3).astype('datetime64[D]')).strftime('%Y-%m-%d').tolist()
+    if grain == 'Q':
+        return [f"{1970 + q // 4}Q{q % 4 + 1}" for q in ordinals.tolist()]
+    return pd.to_datetime(ordinals.astype('datetime64[M]')).strftime('%Y-%m').tolist()
+
+def cohort_retention(df, grain='M', horizon=12, max_cohorts=12):
+    """Compute the cohort retention matrix (% of each cohort active per period since first purchase)
+
+    Works on integer period ordinals and de-duplicated (customer, period) pairs,
+    so there is no frame copy and no per-row Python. Cells past the end of the
+    data are NaN; periods inside the data where nobody returned are 0.
+    """
+    if df.empty:
+        return pd.DataFrame()
+    
+    customers = pd.factorize(df['CustomerID'])[0].astype('int64')
+    periods = period_ordinals(df['InvoiceDate'], grain)
+    first_period = periods.min()
+    span = int(periods.max() - first_period) + 1
+    
+    # Unique (customer, period) pairs come back sorted by customer, then period
+    pairs = np.unique(customers * span + (periods - first_period))
+    pair_customer, pair_period = np.divmod(pairs, span)
+    
+    starts = np.flatnonzero(np.r_[True, pair_customer[1:] != pair_customer[:-1]])
+    cohort = np.repeat(pair_period[starts], np.diff(np.r_[starts, len(pairs)]))
+    offset = pair_period - cohort
+    
+    in_horizon = offset < horizon
+    counts = np.bincount(
+        cohort[in_horizon] * horizon + offset[in_horizon], minlength=span * horizon
+    ).reshape(span, horizon).astype('float64')
+    
+    cohorts = np.flatnonzero(counts[:, 0])[:max_cohorts]
+    counts = counts[cohorts]
+    retention = counts / counts[:, [0]] * 100
+    
+    # Periods the data does not reach yet are unknown rather than zero
+    observable = (span - 1 - cohorts)[:, None]
+    retention[np.arange(horizon)[None, :] > observable] = np.nan
+    
+    return pd.DataFrame(retention, index=period_labels(cohorts + first_period, grain), columns=range(horizon))
+
+def retention_from_counts(cohort_data, horizon=12, max_cohorts=12):
+    """Pivot monthly (CohortMonth, CohortPeriod, Customers) counts into a retention matrix"""
+    cohort_pivot = cohort_data.pivot(index='CohortMonth', columns='CohortPeriod', values='Customers')
+    
+    # Calculate retention rates
+    cohort_size = cohort_pivot.iloc[:, 0]
+    retention = cohort_pivot.divide(cohort_size, axis=0) * 100
+    
+    # Convert month index to string to avoid JSON serialization issues
+    retention_display = retention.iloc[:max_cohorts, :horizon].copy()
+    retention_display.index = retention_display.index.strftime('%Y-%m')
+    return retention_display
+
+def naive_datetimes(values):
+    """Parse values to datetime64, dropping any timezone but keeping wall-clock times"""
+    if not pd.api.types.is_datetime64_any_dtype(values):
+        values = pd.to_datetime(values)
+    return values.dt.tz_localize(None) if values.dt.tz is not None else values
+
+def freshness_histogram(df):
+    """Count transactions per (processing date, invoice day, ingestion day), mirroring the freshness query"""
+    invoice_dates = naive_datetimes(df['InvoiceDate'])
+    ingestion = naive_datetimes(df['ingestion_timestamp'])
+    days = [
+        naive_datetimes(column).to_numpy().astype('datetime64[D]').view('int64')
+        for column in (df['processing_date'], invoice_dates, ingestion)
+    ]
+    
+    # Pack the three day numbers into one integer key; grouping on a single
+    # int64 is several times faster than on three datetime columns
+    key = np.zeros(len(df), dtype='int64')
+    for day in days:
+        key = key * (day.max() - day.min() + 1) + (day - day.min())
+    histogram = pd.DataFrame({'InvoiceDate': invoice_dates, 'ingestion_timestamp': ingestion}).groupby(
+        key, sort=False
+    ).agg(
+        Records=('InvoiceDate', 'size'),
+        FirstInvoice=('InvoiceDate', 'min'),
+        LastInvoice=('InvoiceDate', 'max'),
+        LastIngestion=('ingestion_timestamp', 'max')
+    )
+    
+    packed = histogram.index.to_numpy()
+    for name, day in reversed(list(zip(FRESHNESS_KEYS, days))):
+        packed, offset = np.divmod(packed, day.max() - day.min() + 1)
+        histogram.insert(0, name, (offset + day.min()).astype('datetime64[D]').astype('datetime64[s]'))
+    return histogram.reset_index(drop=True)
+
+def weighted_quantiles(values, weights, quantiles):
+    """Quantiles (inverted CDF) of values each repeated weights times, without expanding them"""
+    order = np.argsort(values, kind='stable')
+    cumulative = np.cumsum(weights[order])
+    positions = np.searchsorted(cumulative, np.asarray(quantiles) * cumulative[-1], side='left')
+    return values[order][np.minimum(positions, len(values) - 1)]
+
+def lag_by_processing_date(histogram, lag_days):
+    """Summarize the processing lag of each load (processing_date) from the freshness histogram"""
+    loads = pd.DataFrame({
+        'processing_date': histogram['processing_date'],
+        'Lag': lag_days,
+        'Records': histogram['Records']
+    }).groupby(['processing_date', 'Lag'])['Records'].sum().reset_index()
+    
+    groups = loads.groupby('processing_date')
+    cumulative = groups['Records'].cumsum()
+    totals = groups['Records'].transform('sum')
+    weighted = loads['Lag'] * loads['Records']
+    summary = pd.DataFrame({
+        'Records': groups['Records'].sum(),
+        'Mean Lag (days)': weighted.groupby(loads['processing_date']).sum() / groups['Records'].sum()
+    })
+    # The first lag whose running share of the load reaches q is its q-quantile
+    for label, quantile in zip(FRESHNESS_LABELS, FRESHNESS_QUANTILES):
+        summary[f'{label} Lag (days)'] = loads[cumulative >= quantile * totals].groupby('processing_date')['Lag'].first()
+    summary['Max Lag (days)'] = groups['Lag'].max()
+    return summary.reset_index()
+
+def freshness_metrics(histogram):
+    """Calculate data freshness and processing-lag statistics from the freshness histogram
+
+    The lag of a transaction is the number of calendar days between its
+    invoice and its ingestion; statistics are weighted by record counts.
+    Returns None when the histogram holds no records.
+    """
+    if histogram.empty:
         return None
+    lag_days = (histogram['IngestionDay'] - histogram['InvoiceDay']).dt.days.to_numpy()
+    records = histogram['Records'].to_numpy()
+    latest_transaction = histogram['LastInvoice'].max()
+    oldest_transaction = histogram['FirstInvoice'].min()
+    quantiles = weighted_quantiles(lag_days, records, FRESHNESS_QUANTILES)
+    
+    metrics = {
+        'latest_ingestion': histogram['LastIngestion'].max(),
+        'latest_transaction': latest_transaction,
+        'oldest_transaction': oldest_transaction,
+        'date_range_days': (latest_transaction - oldest_transaction).days,
+        'avg_processing_lag': float((lag_days * records).sum() / records.sum()),
+        'total_records': int(records.sum()),
+        'lag_by_processing_date': lag_by_processing_date(histogram, lag_days)
+    }
+    for label, value in zip(FRESHNESS_LABELS, quantiles):
+        metrics[f'lag_{label.lower()}'] = int(value)
+    return metrics
 
-@st.cache_data(ttl=300)  # Cache for 5 minutes
-def load_transaction_data():
-    """Load transaction data for time-series analysis"""
+def get_data_freshness_metrics(df):
+    """Calculate data freshness metrics from the raw transaction frame, or None when it is empty"""
+    if df.empty:
+        return None
     try:
-        warehouse_id = os.getenv('DATABRICKS_WAREHOUSE_ID')
-        if warehouse_id:
-            http_path = f"/sql/1.0/warehouses/{warehouse_id}"
-        else:
-            http_path = os.getenv('DATABRICKS_HTTP_PATH')
-        
-        connection = sql.connect(
-            server_hostname=os.getenv('DATABRICKS_SERVER_HOSTNAME'),
-            http_path=http_path,
-            access_token=os.getenv('DATABRICKS_ACCESS_TOKEN')
-        )
-        
-        cursor = connection.cursor()
-        
-        # Query for time-series analysis - FIXED: Added InvoiceNo to SELECT
-        query = """
-        SELECT 
-            InvoiceNo,
-            InvoiceDate,
-            Year,
-            Month,
-            CustomerID,
-            TotalPrice,
-            Quantity,
-            Country,
-            IsCancellation,
-            ingestion_timestamp,
-            processing_date
-        FROM retail_analytics.dlt.retail_transactions_silver
-        WHERE IsCancellation = false 
-        AND CustomerID IS NOT NULL
-        ORDER BY InvoiceDate
-        """
-        
-        cursor.execute(query)
-        columns = [desc[0] for desc in cursor.description]
-        data = cursor.fetchall()
-        
-        df = pd.DataFrame(data, columns=columns)
-        
-        # Convert date columns
-        if not df.empty:
-            df['InvoiceDate'] = pd.to_datetime(df['InvoiceDate'])
-            df['processing_date'] = pd.to_datetime(df['processing_date'])
-            df['ingestion_timestamp'] = pd.to_datetime(df['ingestion_timestamp'])
-        
-        cursor.close()
-        connection.close()
-        
-        return df
+        with trace_stage('freshness', 'transactions') as span:
+            span.rows = len(df)
+            return freshness_metrics(freshness_histogram(df))
     except Exception as e:
-        st.error(f"Error loading transaction data: {str(e)}")
+        st.error(f"Error calculating freshness metrics: {str(e)}")
         return None
 
-@st.cache_data(ttl=300)
-def get_data_freshness_metrics(df):
-    """Calculate data freshness metrics"""
+def freshness_from_summary(summary):
+    """Calculate data freshness metrics from the warehouse freshness histogram"""
     try:
-        # Convert all datetime columns to timezone-naive
-        latest_ingestion = pd.to_datetime(df['ingestion_timestamp'].max()).tz_localize(None)
-        latest_transaction = pd.to_datetime(df['InvoiceDate'].max()).tz_localize(None)
-        oldest_transaction = pd.to_datetime(df['InvoiceDate'].min()).tz_localize(None)
-        
-        # Data coverage
-        date_range = (latest_transaction - oldest_transaction).days
-        
-        # Processing lag
-        df_temp = df.copy()
-        df_temp['InvoiceDate'] = pd.to_datetime(df_temp['InvoiceDate']).dt.tz_localize(None)
-        df_temp['ingestion_timestamp'] = pd.to_datetime(df_temp['ingestion_timestamp']).dt.tz_localize(None)
-        
-        processing_lag = df_temp.groupby('InvoiceDate').agg({
-            'ingestion_timestamp': 'first',
-            'processing_date': 'first'
-        }).reset_index()
-        processing_lag['lag_days'] = (processing_lag['ingestion_timestamp'] - processing_lag['InvoiceDate']).dt.days
-        avg_lag = processing_lag['lag_days'].mean()
-        
-        return {
-            'latest_ingestion': latest_ingestion,
-            'latest_transaction': latest_transaction,
-            'oldest_transaction': oldest_transaction,
-            'date_range_days': date_range,
-            'avg_processing_lag': avg_lag,
-            'total_records': len(df)
-        }
+        with trace_stage('freshness', 'summary') as span:
+            span.rows = len(summary)
+            return freshness_metrics(summary)
     except Exception as e:
         st.error(f"Error calculating freshness metrics: {str(e)}")
         return None
 
-def create_customer_growth_chart(df):
-    """Create cumulative customer growth over time"""
-    # Get unique customers by first purchase date
-    customer_first_purchase = df.groupby('CustomerID')['InvoiceDate'].min().reset_index()
-    customer_first_purchase.columns = ['CustomerID', 'FirstPurchaseDate']
+class FigureCache:
+    """LRU cache of serialized Plotly figures under a memory budget
+
+    Entries are keyed on (chart id, data version, filter selection) and hold
+    the figure JSON, so a hit skips both the pandas work and the figure
+    construction; restoring from JSON is several times cheaper than building.
+    """
+    
+    def __init__(self, max_bytes=FIGURE_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.stats = {}             # chart id -> [calls, hits, build seconds, restore seconds]
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def figure(self, chart_id, version, filters, builder):
+        """Return the cached figure for these inputs, calling builder() and storing it on a miss"""
+        key = (chart_id, version, filters)
+        with self._lock:
+            payload = self._entries.get(key)
+            if payload is not None:
+                self._entries.move_to_end(key)
+        
+        hit = payload is not None
+        start = time.perf_counter()
+        with trace_stage('figure', chart_id) as span:
+            if hit:
+                fig = pio.from_json(payload)
+            else:
+                fig = builder()
+                with trace_stage('serialize', chart_id):
+                    payload = fig.to_json()
+            span.cache_hit = hit
+            span.bytes = len(payload)
+        elapsed = time.perf_counter() - start
+        
+        with self._lock:
+            stats = self.stats.setdefault(chart_id, [0, 0, 0.0, 0.0])
+            stats[0] += 1
+            if hit:
+                stats[1] += 1
+                stats[3] += elapsed
+            else:
+                stats[2] += elapsed
+                if key not in self._entries:
+                    self._store(key, payload)
+        return fig
+    
+    def _store(self, key, payload):
+        # Caller holds the lock
+        if len(payload) > self.max_bytes:
+            return
+        self._entries[key] = payload
+        self.bytes += len(payload)
+        while self.bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.bytes -= len(evicted)
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+    
+    def usage(self):
+        """Entry count and bytes held"""
+        with self._lock:
+            return len(self._entries), self.bytes
+
+@st.cache_resource
+def get_figure_cache():
+    """Process-wide figure cache shared across sessions"""
+    return FigureCache()
+
+def cached_figure(chart_id, version, filters, builder, *args):
+    """Build builder(*args) through the figure cache; a version of None bypasses it"""
+    def build():
+        with trace_stage('build', builder.__name__):
+            return builder(*args)
+    
+    if version is None:
+        return build()
+    return get_figure_cache().figure(chart_id, version, filters, build)
+
+def plot_chart(chart_id, fig):
+    """Send a figure to the browser with st.plotly_chart, traced under the chart id"""
+    with trace_stage('plotly_chart', chart_id):
+        st.plotly_chart(fig, use_container_width=True, config={'displayModeBar': False})
+
+# Customer growth bar grains, finest first: label for the axis title
+GROWTH_GRAINS = {
+    'D': 'Day',
+    'W': 'Week',
+    'M': 'Month'
+}
+
+def daily_growth(new_customers):
+    """New customers per first-purchase day with the running total of customers"""
+    daily = new_customers.groupby(new_customers['Date'].dt.normalize())['NewCustomers'].sum().reset_index()
+    daily['CumulativeCustomers'] = daily['NewCustomers'].cumsum()
+    return daily
+
+def growth_grain(start, end, point_budget):
+    """Finest bar grain that shows the start..end range in at most point_budget bars"""
+    days = (pd.Timestamp(end) - pd.Timestamp(start)).days + 1
+    for grain, grain_days in (('D', 1), ('W', 7)):
+        if days / grain_days <= point_budget:
+            return grain
+    return 'M'
+
+def lttb_indices(x, y, threshold):
+    """Positions of the points Largest-Triangle-Three-Buckets keeps to draw x/y with threshold points
+
+    The first and last points are kept; each bucket of the points in between
+    keeps the one forming the largest triangle with the previously kept point
+    and the average of the next bucket, which preserves the line's shape.
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype='float64')
+    y = np.asarray(y, dtype='float64')
+    edges = np.linspace(1, n - 1, threshold - 1).astype('int64')
+    keep = np.empty(threshold, dtype='int64')
+    keep[0], keep[-1] = 0, n - 1
+    previous = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        next_x, next_y = x[end:next_end].mean(), y[end:next_end].mean()
+        area = np.abs((x[previous] - next_x) * (y[start:end] - y[previous])
+                      - (x[previous] - x[start:end]) * (next_y - y[previous]))
+        previous = start + int(np.argmax(area))
+        keep[i + 1] = previous
+    return keep
+
+def create_customer_growth_chart(new_customers, window=None, point_budget=None):
+    """Create cumulative customer growth over time
+
+    Only the (start, end) window is drawn when given. Bars use the finest
+    grain fitting the point budget and the cumulative line is downsampled to it.
+    """
+    point_budget = point_budget or GROWTH_POINT_BUDGET
+    # Running total of customers by first purchase day, over the full history
+    daily = daily_growth(new_customers)
+    if window is not None:
+        start, end = pd.Timestamp(window[0]), pd.Timestamp(window[1])
+        daily = daily[(daily['Date'] >= start) & (daily['Date'] <= end)]
+    else:
+        start, end = daily['Date'].min(), daily['Date'].max()
     
-    # Create daily customer counts
-    daily_new_customers = customer_first_purchase.groupby('FirstPurchaseDate').size().reset_index()
-    daily_new_customers.columns = ['Date', 'NewCustomers']
-    daily_new_customers = daily_new_customers.sort_values('Date')
-    daily_new_customers['CumulativeCustomers'] = daily_new_customers['NewCustomers'].cumsum()
+    grain = growth_grain(start, end, point_budget)
+    bars = daily.groupby(daily['Date'].dt.to_period(grain).dt.start_time)['NewCustomers'].sum()
+    line = daily.iloc[lttb_indices(daily['Date'].to_numpy().view('int64'), daily['CumulativeCustomers'], point_budget)]
     
     # Create figure with dual y-axis
     fig = make_subplots(specs=[[{"secondary_y": True}]])
@@ -343,8 +3100,8 @@ def create_customer_growth_chart(df):
     # Add cumulative customers line
     fig.add_trace(
         go.Scatter(
-            x=daily_new_customers['Date'],
-            y=daily_new_customers['CumulativeCustomers'],
+            x=line['Date'],
+            y=line['CumulativeCustomers'],
             name='Total Customers',
             line=dict(color='#3b82f6', width=3),
             fill='tozeroy',
@@ -356,8 +3113,8 @@ def create_customer_growth_chart(df):
     # Add new customers bar chart
     fig.add_trace(
         go.Bar(
-            x=daily_new_customers['Date'],
-            y=daily_new_customers['NewCustomers'],
+            x=bars.index,
+            y=bars.to_numpy(),
             name='New Customers',
             marker_color='#10b981',
             opacity=0.6
@@ -377,21 +3134,13 @@ def create_customer_growth_chart(df):
     )
     
     fig.update_yaxes(title_text="Total Customers", secondary_y=False, gridcolor='rgba(128,128,128,0.2)')
-    fig.update_yaxes(title_text="New Customers per Day", secondary_y=True)
+    fig.update_yaxes(title_text=f"New Customers per {GROWTH_GRAINS[grain]}", secondary_y=True)
     
     return fig
 
-def create_revenue_trend_chart(df):
+def create_revenue_trend_chart(monthly):
     """Create revenue trend over time"""
-    # Monthly revenue aggregation
-    monthly_revenue = df.groupby(df['InvoiceDate'].dt.to_period('M')).agg({
-        'TotalPrice': 'sum',
-        'CustomerID': 'nunique',
-        'InvoiceNo': 'nunique'
-    }).reset_index()
-    
-    monthly_revenue['InvoiceDate'] = monthly_revenue['InvoiceDate'].dt.to_timestamp()
-    monthly_revenue.columns = ['Month', 'Revenue', 'UniqueCustomers', 'Orders']
+    monthly_revenue = monthly.copy()
     
     # Calculate growth rates
     monthly_revenue['RevenueGrowth'] = monthly_revenue['Revenue'].pct_change() * 100
@@ -444,33 +3193,15 @@ def create_revenue_trend_chart(df):
     
     return fig
 
-def create_customer_cohort_chart(df):
+def create_customer_cohort_chart(retention, grain='M'):
     """Create customer cohort retention analysis"""
-    # Prepare cohort data - work with a copy to avoid modifying original
-    df_cohort = df.copy()
-    df_cohort['CohortMonth'] = df_cohort.groupby('CustomerID')['InvoiceDate'].transform('min').dt.to_period('M')
-    df_cohort['InvoiceMonth'] = df_cohort['InvoiceDate'].dt.to_period('M')
-    
-    # Calculate cohort periods
-    df_cohort['CohortPeriod'] = (df_cohort['InvoiceMonth'] - df_cohort['CohortMonth']).apply(lambda x: x.n)
-    
-    # Create cohort matrix
-    cohort_data = df_cohort.groupby(['CohortMonth', 'CohortPeriod'])['CustomerID'].nunique().reset_index()
-    cohort_pivot = cohort_data.pivot(index='CohortMonth', columns='CohortPeriod', values='CustomerID')
-    
-    # Calculate retention rates
-    cohort_size = cohort_pivot.iloc[:, 0]
-    retention = cohort_pivot.divide(cohort_size, axis=0) * 100
-    
-    # Convert Period index to string to avoid JSON serialization issues
-    retention_display = retention.iloc[:12, :12].copy()
-    retention_display.index = retention_display.index.astype(str)
+    grain_name, period_name = COHORT_GRAINS[grain]
     
     # Create heatmap
     fig = px.imshow(
-        retention_display,
-        labels=dict(x="Months Since First Purchase", y="Cohort Month", color="Retention %"),
-        title='Customer Retention Cohort Analysis (First 12 Months)',
+        retention,
+        labels=dict(x=f"{period_name} Since First Purchase", y="Cohort", color="Retention %"),
+        title=f'{grain_name} Customer Retention Cohort Analysis (First {retention.shape[1]} {period_name})',
         color_continuous_scale='RdYlGn',
         aspect='auto'
     )
@@ -479,16 +3210,9 @@ def create_customer_cohort_chart(df):
     
     return fig
 
-def create_active_customers_chart(df):
+def create_active_customers_chart(monthly):
     """Create monthly active customers trend"""
-    monthly_active = df.groupby(df['InvoiceDate'].dt.to_period('M')).agg({
-        'CustomerID': 'nunique',
-        'TotalPrice': 'sum',
-        'InvoiceNo': 'nunique'
-    }).reset_index()
-    
-    monthly_active['InvoiceDate'] = monthly_active['InvoiceDate'].dt.to_timestamp()
-    monthly_active.columns = ['Month', 'ActiveCustomers', 'Revenue', 'Orders']
+    monthly_active = monthly.rename(columns={'UniqueCustomers': 'ActiveCustomers'})
     monthly_active['AvgRevenuePerCustomer'] = monthly_active['Revenue'] / monthly_active['ActiveCustomers']
     
     # Create dual-axis chart
@@ -530,17 +3254,8 @@ def create_active_customers_chart(df):
     
     return fig
 
-def create_country_revenue_chart(df):
+def create_country_revenue_chart(country_revenue):
     """Create top countries by revenue"""
-    country_revenue = df.groupby('Country').agg({
-        'TotalPrice': 'sum',
-        'CustomerID': 'nunique',
-        'InvoiceNo': 'nunique'
-    }).reset_index()
-    
-    country_revenue.columns = ['Country', 'Revenue', 'Customers', 'Orders']
-    country_revenue = country_revenue.sort_values('Revenue', ascending=False).head(10)
-    
     fig = px.bar(
         country_revenue,
         x='Revenue',
@@ -564,6 +3279,261 @@ def create_country_revenue_chart(df):
     
     return fig
 
+# In-app RFM scoring: segment for each (R, F) quintile score pair, R along rows
+RFM_SEGMENT_GRID = [
+    # F: 1              2                      3                      4                  5
+    ['Hibernating',    'Hibernating',         'At Risk',             'At Risk',         "Can't Lose Them"],  # R=1
+    ['Hibernating',    'Hibernating',         'At Risk',             'At Risk',         "Can't Lose Them"],  # R=2
+    ['About to Sleep', 'About to Sleep',      'Need Attention',      'Loyal Customers', 'Loyal Customers'],  # R=3
+    ['Promising',      'Potential Loyalists', 'Potential Loyalists', 'Loyal Customers', 'Loyal Customers'],  # R=4
+    ['New Customers',  'Potential Loyalists', 'Potential Loyalists', 'Champions',       'Champions']         # R=5
+]
+
+RFM_RECOMMENDATIONS = {
+    'Champions': 'Reward them, ask for reviews and make them early adopters of new products',
+    'Loyal Customers': 'Upsell higher value products and invite them to the loyalty program',
+    'Potential Loyalists': 'Offer membership or loyalty programs and personalised recommendations',
+    'New Customers': 'Provide onboarding support and build the relationship early',
+    'Promising': 'Create brand awareness and offer free trials',
+    'Need Attention': 'Make limited-time offers based on purchase history',
+    'About to Sleep': 'Share valuable resources and recommend popular products to reconnect',
+    'At Risk': 'Send personalised emails and renewal offers to win them back',
+    "Can't Lose Them": 'Win them back with new products and direct outreach; do not lose them to competitors',
+    'Hibernating': 'Offer relevant products and special discounts to recreate value'
+}
+
+def quintile_scores(values, higher_is_better=True):
+    """Score values 1-5 by quintile of their rank; tied values share the score of their lowest rank"""
+    n = len(values)
+    ranks = pd.Series(values).rank(method='min').to_numpy()
+    scores = np.ceil(ranks * 5 / n).astype('int8')
+    return scores if higher_is_better else (6 - scores).astype('int8')
+
+def dense_codes(values):
+    """Factorize keys to 0..n-1 codes, using a direct lookup table for compact integer ids"""
+    if pd.api.types.is_numeric_dtype(values) and len(values):
+        array = values.to_numpy()
+        ids = array.astype('int64')
+        low, high = ids.min(), ids.max()
+        if (array.dtype.kind in 'iu' or np.array_equal(ids, array)) and high - low < 4 * len(ids) + 1024:
+            present = np.zeros(high - low + 1, dtype=bool)
+            present[ids - low] = True
+            remap = np.cumsum(present) - 1
+            return remap[ids - low], pd.Index(np.flatnonzero(present) + low).astype(values.dtype)
+    codes, uniques = pd.factorize(values)
+    return codes, pd.Index(uniques)
+
+def compute_customer_rfm(df, reference_date=None):
+    """Compute per-customer recency, frequency and monetary values with RFM scores and segments
+
+    A single vectorized pass over CustomerID, InvoiceDate, InvoiceNo and TotalPrice:
+    customers and invoices are factorized to integer codes and reduced with
+    bincount/ufunc.at rather than a grouped apply.
+    """
+    customer_codes, customer_ids = dense_codes(df['CustomerID'])
+    n_customers = len(customer_ids)
+    if n_customers == 0:
+        return pd.DataFrame(columns=['CustomerID', 'Recency', 'Frequency', 'Monetary', 'R', 'F', 'M', 'Segment'])
+    
+    invoice_dates = df['InvoiceDate'].to_numpy(dtype='datetime64[ns]').view('int64')
+    last_purchase = np.full(n_customers, np.iinfo('int64').min)
+    np.maximum.at(last_purchase, customer_codes, invoice_dates)
+    
+    # Distinct (customer, invoice) pairs, so an invoice shared by customers counts for each
+    invoice_codes, invoices = dense_codes(df['InvoiceNo'])
+    pairs = pd.unique(customer_codes.astype('int64') * len(invoices) + invoice_codes)
+    frequency = np.bincount(pairs // len(invoices), minlength=n_customers)
+    
+    monetary = np.bincount(customer_codes, weights=df['TotalPrice'].to_numpy(dtype='float64'), minlength=n_customers)
+    
+    if reference_date is None:
+        reference_date = df['InvoiceDate'].max().normalize() + pd.Timedelta(days=1)
+    return score_customers(customer_ids, last_purchase, frequency, monetary, reference_date)
+
+def customer_rfm_from_state(customers, reference_date=None):
+    """Score the per-customer state folded by RunningAggregates like compute_customer_rfm scores raw rows"""
+    if customers is None or customers.empty:
+        return pd.DataFrame(columns=['CustomerID', 'Recency', 'Frequency', 'Monetary', 'R', 'F', 'M', 'Segment'])
+    customers = customers.sort_values('CustomerID')
+    if reference_date is None:
+        reference_date = customers['LastPurchase'].max().normalize() + pd.Timedelta(days=1)
+    return score_customers(
+        pd.Index(customers['CustomerID']),
+        customers['LastPurchase'].to_numpy(dtype='datetime64[ns]').view('int64'),
+        customers['Frequency'].to_numpy(),
+        customers['Monetary'].to_numpy(),
+        reference_date
+    )
+
+def score_customers(customer_ids, last_purchase, frequency, monetary, reference_date):
+    """Recency in days, quintile R/F/M scores and segments from per-customer values
+
+    last_purchase holds each customer's latest invoice time in int64 nanoseconds.
+    """
+    reference = pd.Timestamp(reference_date).to_datetime64().astype('datetime64[ns]').view('int64')
+    recency = (reference - last_purchase) // (24 * 3600 * 10 ** 9)
+    
+    r_score = quintile_scores(recency, higher_is_better=False)
+    f_score = quintile_scores(frequency)
+    m_score = quintile_scores(monetary)
+    
+    segment_names = sorted({name for row in RFM_SEGMENT_GRID for name in row})
+    grid = np.array([[segment_names.index(name) for name in row] for row in RFM_SEGMENT_GRID])
+    segments = pd.Categorical.from_codes(grid[r_score - 1, f_score - 1], categories=segment_names)
+    
+    return pd.DataFrame({
+        'CustomerID': customer_ids,
+        'Recency': recency,
+        'Frequency': frequency,
+        'Monetary': monetary,
+        'R': r_score,
+        'F': f_score,
+        'M': m_score,
+        'Segment': segments
+    })
+
+def summarize_segments(customers):
+    """Aggregate per-customer RFM values into the segment_summary schema the RFM tab renders"""
+    summary = customers.groupby('Segment', observed=True).agg(
+        Customer_Count=('CustomerID', 'size'),
+        Total_Revenue=('Monetary', 'sum'),
+        Avg_Recency=('Recency', 'mean'),
+        Avg_Frequency=('Frequency', 'mean'),
+        Avg_Monetary=('Monetary', 'mean')
+    ).reset_index()
+    
+    summary['Segment'] = summary['Segment'].astype(str)
+    summary['recommendation'] = summary['Segment'].map(RFM_RECOMMENDATIONS)
+    summary['Pct_of_Customers'] = summary['Customer_Count'] / summary['Customer_Count'].sum() * 100
+    summary['Pct_of_Revenue'] = summary['Total_Revenue'] / summary['Total_Revenue'].sum() * 100
+    return summary.sort_values('Total_Revenue', ascending=False).reset_index(drop=True)
+
+def invoice_summary(rows):
+    """One row per invoice with its date, country, items and total, newest first"""
+    # Factorized ufunc reductions; a groupby costs milliseconds even for a handful of rows
+    codes, invoice_numbers = pd.factorize(rows['InvoiceNo'])
+    first = np.unique(codes, return_index=True)[1]
+    latest = np.full(len(first), np.iinfo('int64').min)
+    np.maximum.at(latest, codes, rows['InvoiceDate'].to_numpy(dtype='datetime64[ns]').view('int64'))
+    items = np.zeros(len(first), dtype='int64')
+    np.add.at(items, codes, rows['Quantity'].to_numpy(dtype='int64'))
+    invoices = pd.DataFrame({
+        'InvoiceNo': invoice_numbers,
+        'InvoiceDate': latest.view('datetime64[ns]'),
+        'Country': rows['Country'].iloc[first].array,
+        'Items': items,
+        'Total': np.bincount(codes, weights=rows['TotalPrice'].to_numpy(dtype='float64'), minlength=len(first))
+    })
+    return invoices.sort_values(['InvoiceDate', 'InvoiceNo'], ascending=[False, True], ignore_index=True)
+
+def customer_id_keys(ids):
+    """Customer ids as a sortable array: float64 for numeric ids, otherwise their text"""
+    if pd.api.types.is_numeric_dtype(ids):
+        return ids.to_numpy(dtype='float64')
+    return ids.astype(str).to_numpy(dtype=object)
+
+def format_customer_id(customer_id):
+    """A customer id for display, with whole numbers shown without decimals"""
+    if isinstance(customer_id, (int, float, np.number)) and float(customer_id).is_integer():
+        return f"{customer_id:.0f}"
+    return str(customer_id)
+
+class CustomerIndex:
+    """Scored customers laid out for paging through a segment and looking up a CustomerID
+
+    Customers are sorted once by segment and then by spend, highest first, so
+    a segment is a contiguous row range and a page is a slice of it. A sorted
+    copy of the ids answers lookups by binary search. Neither touches the
+    transactions.
+    """
+    
+    def __init__(self, customers):
+        segments = pd.Categorical(customers['Segment'])
+        order = np.lexsort((-customers['Monetary'].to_numpy(dtype='float64'), segments.codes))
+        self.customers = customers.iloc[order].reset_index(drop=True)
+        bounds = np.searchsorted(segments.codes[order], np.arange(len(segments.categories) + 1))
+        self.ranges = {
+            segment: (int(bounds[i]), int(bounds[i + 1]))
+            for i, segment in enumerate(segments.categories) if bounds[i] < bounds[i + 1]
+        }
+        ids = customer_id_keys(self.customers['CustomerID'])
+        self.numeric_ids = ids.dtype != object
+        self._id_order = np.argsort(ids, kind='stable')
+        self._sorted_ids = ids[self._id_order]
+    
+    def segment_size(self, segment):
+        """Customers in a segment"""
+        start, stop = self.ranges.get(segment, (0, 0))
+        return stop - start
+    
+    def page(self, segment, page, page_size):
+        """Customers on a zero-based page of a segment, highest spend first"""
+        start, stop = self.ranges.get(segment, (0, 0))
+        first = start + page * page_size
+        return self.customers.iloc[first:min(first + page_size, stop)]
+    
+    def parse(self, text):
+        """The customer id typed as text, as this index holds it, or None if it cannot be one"""
+        if not self.numeric_ids:
+            return text
+        try:
+            return float(text)
+        except ValueError:
+            return None
+    
+    def find(self, customer_id):
+        """(customer row, 1-based spend rank within its segment), or None for an unknown id"""
+        customer_id = customer_id if self.numeric_ids else str(customer_id)
+        position = np.searchsorted(self._sorted_ids, customer_id)
+        if position == len(self._sorted_ids) or self._sorted_ids[position] != customer_id:
+            return None
+        row_number = int(self._id_order[position])
+        customer = self.customers.iloc[row_number]
+        return customer, row_number - self.ranges[customer['Segment']][0] + 1
+
+class InvoiceIndex:
+    """Transaction row ranges per customer, for a customer's invoices without scanning the frame
+
+    Row positions are sorted once by CustomerID and then newest first; a
+    customer's rows are the range found by a binary search over the distinct
+    sorted ids.
+    """
+    
+    def __init__(self, frame):
+        self.frame = frame
+        ids = customer_id_keys(frame['CustomerID'])
+        self.numeric_ids = ids.dtype != object
+        dates = frame['InvoiceDate'].to_numpy(dtype='datetime64[ns]').view('int64')
+        order = np.lexsort((-dates, ids))
+        sorted_ids = ids[order]
+        self.order = order.astype('int32') if len(order) < 2 ** 31 else order
+        starts = np.flatnonzero(np.r_[True, sorted_ids[1:] != sorted_ids[:-1]]) if len(order) else np.array([], dtype='int64')
+        self.ids = sorted_ids[starts]
+        self.starts = np.append(starts, len(order))
+    
+    def rows(self, customer_id):
+        """A customer's transactions, newest first"""
+        customer_id = customer_id if self.numeric_ids else str(customer_id)
+        position = np.searchsorted(self.ids, customer_id)
+        if position == len(self.ids) or self.ids[position] != customer_id:
+            return self.frame.iloc[:0]
+        return self.frame.iloc[self.order[self.starts[position]:self.starts[position + 1]]]
+    
+    def recent(self, customer_id, limit=RECENT_INVOICES):
+        """A customer's latest invoices, shaped like load_customer_invoices results"""
+        return invoice_summary(self.rows(customer_id)).head(limit)
+
+def filter_transactions(df, start_date=None, end_date=None, countries=None):
+    """Restrict transactions to an inclusive date window and a set of countries"""
+    mask = np.ones(len(df), dtype=bool)
+    if start_date is not None:
+        mask &= (df['InvoiceDate'] >= pd.Timestamp(start_date)).to_numpy()
+    if end_date is not None:
+        mask &= (df['InvoiceDate'] < pd.Timestamp(end_date) + pd.Timedelta(days=1)).to_numpy()
+    if countries:
+        mask &= df['Country'].isin(countries).to_numpy()
+    return df if mask.all() else df[mask]
+
 # RFM Visualization Functions (from original code)
 def create_segment_count_chart(df):
     """Create customer count visualization by segment"""
@@ -695,8 +3665,14 @@ def create_segment_performance_table(df):
     
     return table_df
 
-def render_rfm_tab(df_rfm):
-    """Render RFM Segmentation tab content"""
+def render_rfm_tab(df_rfm, version=None, drilldown=None):
+    """Render RFM Segmentation tab content
+
+    version identifies the data behind df_rfm for the figure cache; charts
+    are rebuilt on every run without it. drilldown() returns the
+    (CustomerIndex, recent_invoices) behind the customer drill-down, which is
+    left out without it.
+    """
     st.markdown("""
     <div class="main-header">
         <h1>RFM Customer Segmentation</h1>
@@ -704,23 +3680,32 @@ def render_rfm_tab(df_rfm):
     </div>
     """, unsafe_allow_html=True)
     
-    # Sidebar filters
-    st.sidebar.header("RFM Filters")
-    
+    render_rfm_segments(df_rfm, version, drilldown)
+
+@fragment
+@traced_fragment
+def render_rfm_segments(df_rfm, version=None, drilldown=None):
+    """Render the segment filters and the charts and table they drive
+
+    Runs as a fragment, so a filter change reruns only this function. The
+    filters sit above the charts because fragments cannot write to the sidebar.
+    """
     all_segments = sorted(df_rfm['Segment'].unique().tolist())
     
-    filter_type = st.sidebar.radio(
+    col1, col2 = st.columns([1, 3])
+    filter_type = col1.radio(
         "Filter Type:",
         options=["All Segments", "Custom Selection"],
         index=0,
         key='rfm_filter'
     )
     
+    segment_filter = None
     if filter_type == "All Segments":
         df_filtered = df_rfm.copy()
-        st.sidebar.info(f"Showing all {len(all_segments)} segments")
+        col2.info(f"Showing all {len(all_segments)} segments")
     else:
-        selected_segments = st.sidebar.multiselect(
+        selected_segments = col2.multiselect(
             "Choose one or more segments:",
             options=all_segments,
             default=all_segments[:1] if all_segments else [],
@@ -729,10 +3714,11 @@ def render_rfm_tab(df_rfm):
         
         if len(selected_segments) > 0:
             df_filtered = df_rfm[df_rfm['Segment'].isin(selected_segments)].copy()
-            st.sidebar.success(f"Showing {len(selected_segments)} segment(s)")
+            segment_filter = tuple(selected_segments)
+            col2.success(f"Showing {len(selected_segments)} segment(s)")
         else:
             df_filtered = df_rfm.copy()
-            st.sidebar.warning("No segments selected - showing all data")
+            col2.warning("No segments selected - showing all data")
     
     # Visualizations
     st.markdown('<div class="section-header">Customer Segment Analysis</div>', unsafe_allow_html=True)
@@ -740,33 +3726,158 @@ def render_rfm_tab(df_rfm):
     col1, col2 = st.columns(2)
     
     with col1:
-        fig_count = create_segment_count_chart(df_filtered)
-        st.plotly_chart(fig_count, use_container_width=True, config={'displayModeBar': False})
+        fig_count = cached_figure('segment_count', version, segment_filter, create_segment_count_chart, df_filtered)
+        plot_chart('segment_count', fig_count)
     
     with col2:
-        fig_revenue = create_segment_revenue_chart(df_filtered)
-        st.plotly_chart(fig_revenue, use_container_width=True, config={'displayModeBar': False})
+        fig_revenue = cached_figure('segment_revenue', version, segment_filter, create_segment_revenue_chart, df_filtered)
+        plot_chart('segment_revenue', fig_revenue)
     
     col1, col2 = st.columns(2)
     
     with col1:
-        fig_customer_pie = create_customer_distribution_pie(df_filtered)
-        st.plotly_chart(fig_customer_pie, use_container_width=True, config={'displayModeBar': False})
+        fig_customer_pie = cached_figure('customer_distribution', version, segment_filter, create_customer_distribution_pie, df_filtered)
+        plot_chart('customer_distribution', fig_customer_pie)
     
     with col2:
-        fig_revenue_pie = create_revenue_distribution_pie(df_filtered)
-        st.plotly_chart(fig_revenue_pie, use_container_width=True, config={'displayModeBar': False})
+        fig_revenue_pie = cached_figure('revenue_distribution', version, segment_filter, create_revenue_distribution_pie, df_filtered)
+        plot_chart('revenue_distribution', fig_revenue_pie)
     
     st.markdown('<div class="section-header">RFM Metrics Analysis</div>', unsafe_allow_html=True)
-    fig_heatmap = create_rfm_heatmap(df_filtered)
-    st.plotly_chart(fig_heatmap, use_container_width=True, config={'displayModeBar': False})
+    fig_heatmap = cached_figure('rfm_heatmap', version, segment_filter, create_rfm_heatmap, df_filtered)
+    plot_chart('rfm_heatmap', fig_heatmap)
     
     st.markdown('<div class="section-header">Segment Performance & Recommendations</div>', unsafe_allow_html=True)
-    table_df = create_segment_performance_table(df_filtered)
+    with trace_stage('build', 'create_segment_performance_table'):
+        table_df = create_segment_performance_table(df_filtered)
     st.dataframe(table_df, use_container_width=True, hide_index=True)
+    
+    if drilldown is not None:
+        # The warehouse summary holds only counts; its drill-down scores customers in the app
+        summary_counts = None
+        if version is not None and version[0] == 'segment_summary':
+            summary_counts = dict(zip(df_rfm['Segment'], df_rfm['Customer_Count']))
+        render_segment_drilldown(df_filtered['Segment'].tolist(), drilldown, summary_counts)
+
+def create_customer_table(customers):
+    """Format scored customers for the drill-down tables"""
+    ids = customers['CustomerID']
+    return pd.DataFrame({
+        'Customer ID': ids.astype('int64').to_numpy() if pd.api.types.is_numeric_dtype(ids) else ids.astype(str).to_numpy(),
+        'Segment': customers['Segment'].astype(str).to_numpy(),
+        'Recency (days)': customers['Recency'].to_numpy(),
+        'Frequency': customers['Frequency'].to_numpy(),
+        'Monetary': [f"${x:,.2f}" for x in customers['Monetary']],
+        'RFM Score': [f"{r}{f}{m}" for r, f, m in zip(customers['R'], customers['F'], customers['M'])]
+    })
+
+def render_segment_drilldown(segments, load_drilldown, summary_counts=None):
+    """Page through a segment's customers and show one customer's RFM values and recent invoices
+
+    Runs inside the RFM fragment, so paging reruns only the fragment. The
+    customer index is built on first use and shared, so a page is a slice
+    and a lookup a binary search rather than a scan of the transactions.
+    With ``summary_counts``, the customers per segment of a summary scored
+    elsewhere, the customers are scored in the app from the full history:
+    that load waits for a button press, and each segment shows both counts,
+    since the two scorings can disagree.
+    """
+    st.markdown('<div class="section-header">Customer Drill-down</div>', unsafe_allow_html=True)
+    
+    col1, col2, col3 = st.columns([2, 2, 1])
+    segment = col1.selectbox(
+        "Segment:",
+        options=segments,
+        index=None,
+        placeholder="Choose a segment to list its customers",
+        key='drill_segment'
+    )
+    search = col2.text_input("Find customer ID:", key='drill_customer').strip()
+    page_size = col3.selectbox("Rows per page:", options=[25, 50, 100], key='drill_page_size')
+    if segment is None and not search:
+        return
+    
+    app_scored = summary_counts is not None
+    if app_scored and not st.session_state.get('drill_full_history'):
+        st.caption("The warehouse summary holds no customers. Listing them scores every customer in the app "
+                   "from the full transaction history, which is loaded first and can take a while.")
+        if not st.button("Load customers from transaction history", key='drill_load_history'):
+            return
+        st.session_state['drill_full_history'] = True
+    
+    with st.spinner("Scoring customers from the full transaction history..." if app_scored
+                    else "Loading customers..."):
+        drilldown = load_drilldown()
+    if drilldown is None:
+        st.warning("Customer details could not be loaded for these segments")
+        return
+    index, recent_invoices = drilldown
+    
+    customer_id = None
+    if search:
+        customer_id = index.parse(search)
+        if customer_id is None:
+            st.warning(f"'{search}' is not a customer ID")
+        else:
+            with trace_stage('lookup', 'find_customer'):
+                found = index.find(customer_id)
+            if found is None:
+                st.info(f"Customer {search} is not among the scored customers")
+                customer_id = None
+            else:
+                customer, rank = found
+                scored = " (app-scored)" if app_scored else ""
+                st.caption(f"Customer {search} ranks #{rank:,} by spend of "
+                           f"{index.segment_size(customer['Segment']):,} in {customer['Segment']}{scored}")
+                st.dataframe(create_customer_table(customer.to_frame().T.infer_objects()), use_container_width=True, hide_index=True)
+    
+    if segment is not None:
+        total = index.segment_size(segment)
+        if total == 0:
+            listed = f"; the warehouse summary lists {summary_counts.get(segment, 0):,}" if app_scored else ""
+            st.info(f"No scored customers in {segment}{listed}")
+        else:
+            pages = -(-total // page_size)
+            page = st.number_input(
+                f"Page (of {pages:,}):",
+                min_value=1,
+                max_value=pages,
+                value=1,
+                key=f'drill_page_{segment}_{page_size}'
+            )
+            with trace_stage('lookup', 'segment_page') as span:
+                customers = index.page(segment, page - 1, page_size)
+                span.rows = len(customers)
+            first = (page - 1) * page_size
+            st.caption(f"Customers {first + 1:,}–{first + len(customers):,} of {total:,} in {segment}, "
+                       f"highest spend first")
+            if app_scored:
+                st.caption(f"App-scored from the full transaction history: {total:,} customers in {segment}, "
+                           f"against {summary_counts.get(segment, 0):,} in the warehouse summary")
+            st.dataframe(create_customer_table(customers), use_container_width=True, hide_index=True)
+            if customer_id is None:
+                customer_id = st.selectbox(
+                    "Recent invoices for customer:",
+                    options=customers['CustomerID'].tolist(),
+                    format_func=format_customer_id,
+                    key='drill_invoices_customer'
+                )
+    
+    if customer_id is not None:
+        with trace_stage('lookup', 'recent_invoices') as span:
+            invoices = recent_invoices(customer_id)
+            span.rows = None if invoices is None else len(invoices)
+        if invoices is not None:
+            st.markdown(f"**Recent invoices for customer {format_customer_id(customer_id)}**")
+            st.dataframe(invoices, use_container_width=True, hide_index=True)
+
+def render_insights_tab(aggregates, freshness, cohort_builder=None, version=None):
+    """Render Customer & Revenue Insights tab content
 
-def render_insights_tab(df_trans):
-    """Render Customer & Revenue Insights tab content"""
+    cohort_builder(grain, horizon) returns a retention matrix from the raw
+    transactions; without it the monthly warehouse cohort counts are used.
+    version identifies the data for the figure cache.
+    """
     st.markdown("""
     <div class="main-header">
         <h1>Customer Growth & Revenue Insights</h1>
@@ -775,12 +3886,10 @@ def render_insights_tab(df_trans):
     """, unsafe_allow_html=True)
     
     # Data freshness metrics
-    freshness = get_data_freshness_metrics(df_trans)
-    
     if freshness:
         st.markdown('<div class="section-header">Data Freshness & Quality</div>', unsafe_allow_html=True)
         
-        col1, col2, col3 = st.columns(3)
+        col1, col2, col3, col4 = st.columns(4)
         
         with col1:
             st.markdown(f"""
@@ -806,14 +3915,35 @@ def render_insights_tab(df_trans):
             </div>
             """, unsafe_allow_html=True)
         
+        with col4:
+            st.markdown(f"""
+            <div class="metric-card">
+                <h3>Processing Lag (p50 / p95)</h3>
+                <div class="metric-value">{freshness['lag_p50']} / {freshness['lag_p95']} days</div>
+            </div>
+            """, unsafe_allow_html=True)
+        
+        render_refresh_status()
+        
+        with st.expander("Processing lag by load date"):
+            st.caption(f"Mean lag {freshness['avg_processing_lag']:.2f} days, "
+                       f"p99 {freshness['lag_p99']} days over {freshness['total_records']:,} records")
+            loads = freshness['lag_by_processing_date'].sort_values('processing_date', ascending=False)
+            st.dataframe(loads, use_container_width=True, hide_index=True)
     
     # Customer and revenue metrics
     st.markdown('<div class="section-header">Business Performance Metrics</div>', unsafe_allow_html=True)
     
-    total_customers = df_trans['CustomerID'].nunique()
-    total_revenue = df_trans['TotalPrice'].sum()
-    total_orders = df_trans['InvoiceNo'].nunique()
+    totals = aggregates['totals'].iloc[0]
+    total_customers = int(totals['Customers'])
+    total_revenue = float(totals['Revenue'])
+    total_orders = int(totals['Orders'])
     avg_order_value = total_revenue / total_orders
+    # Sketched counts carry their 95% error bound under the value
+    distinct_error = aggregates.get('distinct_error')
+    estimate_note = "" if distinct_error is None else (
+        f'<div class="metric-note">HyperLogLog estimate, ±{1.96 * distinct_error:.1%} (95%)</div>'
+    )
     
     col1, col2, col3, col4 = st.columns(4)
     
@@ -821,7 +3951,7 @@ def render_insights_tab(df_trans):
         st.markdown(f"""
         <div class="metric-card">
             <h3>Total Customers</h3>
-            <div class="metric-value">{total_customers:,}</div>
+            <div class="metric-value">{total_customers:,}</div>{estimate_note}
         </div>
         """, unsafe_allow_html=True)
     
@@ -837,7 +3967,7 @@ def render_insights_tab(df_trans):
         st.markdown(f"""
         <div class="metric-card">
             <h3>Total Orders</h3>
-            <div class="metric-value">{total_orders:,}</div>
+            <div class="metric-value">{total_orders:,}</div>{estimate_note}
         </div>
         """, unsafe_allow_html=True)
     
@@ -851,49 +3981,729 @@ def render_insights_tab(df_trans):
     
     # Customer growth analysis
     st.markdown('<div class="section-header">Customer Growth Analysis</div>', unsafe_allow_html=True)
-    fig_growth = create_customer_growth_chart(df_trans)
-    st.plotly_chart(fig_growth, use_container_width=True, config={'displayModeBar': False})
+    render_customer_growth(aggregates['first_purchase'], version)
     
     # Revenue trends
     st.markdown('<div class="section-header">Revenue Trends & Growth</div>', unsafe_allow_html=True)
-    fig_revenue = create_revenue_trend_chart(df_trans)
-    st.plotly_chart(fig_revenue, use_container_width=True, config={'displayModeBar': False})
+    fig_revenue = cached_figure('revenue_trend', version, None, create_revenue_trend_chart, aggregates['monthly'])
+    plot_chart('revenue_trend', fig_revenue)
     
     # Active customers and country analysis
     col1, col2 = st.columns(2)
     
     with col1:
         st.markdown('<div class="section-header">Monthly Active Customers</div>', unsafe_allow_html=True)
-        fig_active = create_active_customers_chart(df_trans)
-        st.plotly_chart(fig_active, use_container_width=True, config={'displayModeBar': False})
+        fig_active = cached_figure('active_customers', version, None, create_active_customers_chart, aggregates['monthly'])
+        plot_chart('active_customers', fig_active)
+        if distinct_error is not None:
+            st.caption(f"Active customers are HyperLogLog estimates, ±{1.96 * distinct_error:.1%} at 95% confidence")
     
     with col2:
         st.markdown('<div class="section-header">Top Countries</div>', unsafe_allow_html=True)
-        fig_country = create_country_revenue_chart(df_trans)
-        st.plotly_chart(fig_country, use_container_width=True, config={'displayModeBar': False})
+        fig_country = cached_figure('country_revenue', version, None, create_country_revenue_chart, aggregates['country'])
+        plot_chart('country_revenue', fig_country)
     
     # Cohort analysis
     st.markdown('<div class="section-header">Customer Cohort Retention</div>', unsafe_allow_html=True)
-    fig_cohort = create_customer_cohort_chart(df_trans)
-    st.plotly_chart(fig_cohort, use_container_width=True, config={'displayModeBar': False})
-
-def main():
-    # Create tabs
-    tab1, tab2 = st.tabs(["📊 RFM Segmentation", "📈 Customer & Revenue Insights"])
     
-    with tab1:
-        df_rfm = load_rfm_data()
-        if df_rfm is not None:
-            render_rfm_tab(df_rfm)
+    col1, col2 = st.columns(2)
+    grain = 'M'
+    if cohort_builder is not None:
+        grain = col1.selectbox(
+            "Cohort grain:",
+            options=list(COHORT_GRAINS),
+            index=1,
+            format_func=lambda g: COHORT_GRAINS[g][0],
+            key='cohort_grain'
+        )
+    horizon = col2.slider("Periods since first purchase:", min_value=4, max_value=24, value=12, key='cohort_horizon')
+    
+    def build_cohort_chart():
+        if cohort_builder is not None:
+            retention = cohort_builder(grain, horizon)
         else:
-            st.error("Unable to load RFM segmentation data. Please check your Databricks configuration.")
+            retention = retention_from_counts(aggregates['cohort'], horizon=horizon)
+        return create_customer_cohort_chart(retention, grain)
     
-    with tab2:
-        df_trans = load_transaction_data()
-        if df_trans is not None:
-            render_insights_tab(df_trans)
+    fig_cohort = cached_figure('cohort_retention', version, (grain, horizon, cohort_builder is not None), build_cohort_chart)
+    plot_chart('cohort_retention', fig_cohort)
+
+def format_age(seconds):
+    """Short age for status captions, e.g. 45s, 12m or 3h"""
+    if seconds < 120:
+        return f"{seconds:.0f}s"
+    if seconds < 7200:
+        return f"{seconds / 60:.0f}m"
+    return f"{seconds / 3600:.0f}h"
+
+def render_refresh_status():
+    """Show the background refresh state of the transaction data under the freshness cards"""
+    status = get_refresher().status().get(TRANSACTIONS_TABLE) if BACKGROUND_REFRESH else None
+    if status is None:
+        return
+    if status['refreshing']:
+        st.caption("🔄 Refreshing in the background; the charts switch to the new data once it is loaded")
+    elif status['error']:
+        st.warning(f"⚠️ Background refresh failed {status['failures']} time(s), showing the previous data: "
+                   f"{status['error']}")
+    else:
+        trigger = "on new table versions" if status['versioned'] else f"every {format_age(TRANSACTION_REFRESH_SECONDS)}"
+        checked = "" if status['checked_seconds_ago'] is None else f"checked {format_age(status['checked_seconds_ago'])} ago, "
+        if status['refreshed_seconds_ago'] is None:
+            refreshed = "unchanged since the app started"
         else:
-            st.error("Unable to load transaction data. Please check your Databricks configuration.")
+            refreshed = (f"refreshed {format_age(status['refreshed_seconds_ago'])} ago "
+                         f"in {status['duration_seconds']:.1f}s")
+        st.caption(f"🟢 Up to date: {checked}{refreshed}; refreshes {trigger}")
+
+@fragment
+@traced_fragment
+def render_customer_growth(new_customers, version=None):
+    """Render the customer growth chart with a zoom slider; zooming resamples only the selected window"""
+    if new_customers.empty:
+        st.info("No customers in the selected data")
+        return
+    chart = st.container()
+    first_day, last_day = new_customers['Date'].min().date(), new_customers['Date'].max().date()
+    window = None
+    if first_day < last_day:
+        window = st.slider(
+            "Zoom:",
+            min_value=first_day,
+            max_value=last_day,
+            value=(first_day, last_day),
+            format="YYYY-MM-DD",
+            key='growth_window'
+        )
+        window = None if tuple(window) == (first_day, last_day) else tuple(window)
+    
+    with chart:
+        fig_growth = cached_figure('customer_growth', version, window, create_customer_growth_chart, new_customers, window)
+        plot_chart('customer_growth', fig_growth)
+
+def transaction_insights(handle, approximate=False):
+    """Insights aggregates, freshness metrics and cohort builder memoized on a transaction handle
+
+    With ``approximate`` distinct customers and orders come from a sketched
+    cube, memoized next to the exact one.
+    """
+    # One cube per data version feeds every chart and KPI card
+    if approximate:
+        aggregates = handle.derived(
+            ('insight_aggregates', 'approximate'),
+            lambda frame: aggregates_from_cube(handle.derived(
+                ('aggregate_cube', 'approximate'), lambda frame: build_aggregate_cube(frame, approximate=True)
+            ))
+        )
+    else:
+        aggregates = handle.derived(
+            'insight_aggregates',
+            lambda frame: aggregates_from_cube(handle.derived('aggregate_cube', build_aggregate_cube))
+        )
+    
+    def cohort_builder(grain, horizon):
+        return handle.derived(
+            ('cohort_retention', grain, horizon),
+            lambda frame: cohort_retention(frame, grain=grain, horizon=horizon)
+        )
+    
+    return aggregates, handle.derived('freshness', get_data_freshness_metrics), cohort_builder
+
+def insights_predicate(bounds, dates, countries):
+    """Predicate for the insights filters, leaving bounds that span the whole history open
+
+    Returns None when nothing is filtered out, so the full-history cache serves it.
+    """
+    first_date, last_date, country_options = bounds
+    start_date, end_date = dates if len(dates) == 2 else (dates[0], last_date)
+    start_date = None if start_date <= first_date else start_date
+    end_date = None if end_date >= last_date else end_date
+    countries = tuple(sorted(countries)) if countries and set(countries) != set(country_options) else None
+    if start_date is None and end_date is None and countries is None:
+        return None
+    return start_date, end_date, countries
+
+def selected_insights_predicate(session=None, load_bounds=None):
+    """The predicate last chosen in the insights filters, or the configured default window
+
+    session and load_bounds default to this run's session state and transaction_bounds().
+    """
+    session = st.session_state if session is None else session
+    # Kept outside the widget keys, whose state is dropped while the insights view is hidden
+    if 'insights_predicate' in session:
+        return session['insights_predicate']
+    if INSIGHTS_DEFAULT_MONTHS <= 0:
+        return None
+    bounds = (load_bounds or transaction_bounds)()
+    if bounds is None:
+        return None
+    last_date = bounds[1]
+    start_date = (pd.Timestamp(last_date) - pd.DateOffset(months=INSIGHTS_DEFAULT_MONTHS)).date() + timedelta(days=1)
+    return insights_predicate(bounds, (start_date, last_date), [])
+
+def render_insights_filters():
+    """Render the insights date and country filters in the sidebar and return their predicate"""
+    predicate = selected_insights_predicate()
+    bounds = transaction_bounds()
+    if bounds is None:
+        return predicate
+    first_date, last_date, country_options = bounds
+    start_date, end_date, countries = predicate or (None, None, None)
+    start_date = min(max(start_date or first_date, first_date), last_date)
+    end_date = max(min(end_date or last_date, last_date), start_date)
+    
+    st.sidebar.header("Insights Filters")
+    dates = st.sidebar.date_input(
+        "Invoice dates:",
+        value=(start_date, end_date),
+        min_value=first_date,
+        max_value=last_date,
+        key='insights_dates'
+    )
+    countries = st.sidebar.multiselect(
+        "Countries (all if empty):",
+        options=country_options,
+        default=[country for country in countries or () if country in country_options],
+        key='insights_countries'
+    )
+    
+    predicate = insights_predicate(bounds, dates, countries)
+    st.session_state['insights_predicate'] = predicate
+    if INSIGHTS_AGGREGATION == 'pandas':
+        st.session_state['approximate_distinct'] = st.sidebar.toggle(
+            "Approximate distinct counts",
+            value=approximate_distinct_counts(),
+            help="Estimate customers and orders from HyperLogLog sketches per month and country; "
+                 "switch off to verify against exact counts",
+            key='insights_approximate'
+        )
+        st.sidebar.caption("Sketches apply to the in-app (pandas) aggregation only; "
+                           "warehouse and streamed counts are always exact.")
+    return predicate
+
+def approximate_distinct_counts(session=None):
+    """Whether distinct customers and orders are estimated, as last chosen in the sidebar or configured"""
+    session = st.session_state if session is None else session
+    return session.get('approximate_distinct', DISTINCT_COUNTS == 'approx')
+
+def load_insights(predicate=None):
+    """Load the insights aggregates, freshness metrics, cohort builder and data version for the configured aggregation mode"""
+    if INSIGHTS_AGGREGATION == 'pandas':
+        handle = load_filtered_transactions(predicate)
+        if handle is None:
+            return None, None, None, None
+        approximate = approximate_distinct_counts()
+        aggregates, freshness, cohort_builder = transaction_insights(handle, approximate)
+        return aggregates, freshness, cohort_builder, ('pandas', handle.fingerprint, predicate, approximate)
+    
+    # Distinct customer counts cannot be re-filtered, so each predicate is aggregated separately
+    try:
+        name, load = insights_aggregate_load(predicate)
+        with trace_stage('load', name):
+            aggregates = wait_for_load(get_dataset_loader().submit(name, load), "insight aggregates")
+    except Exception as e:
+        st.error(f"Error loading insight aggregates: {str(e)}")
+        return None, None, None, None
+    if aggregates is None:
+        # The stream folded no rows: report empty totals like the SQL aggregates do
+        return {'totals': pd.DataFrame([{'Customers': 0, 'Revenue': 0.0, 'Orders': 0}])}, None, None, None
+    freshness = freshness_from_summary(aggregates['freshness'])
+    # Record count and latest ingestion identify the aggregated data, like a dataset fingerprint
+    version = None if freshness is None else (
+        INSIGHTS_AGGREGATION, predicate, freshness['total_records'], freshness['latest_ingestion']
+    )
+    return aggregates, freshness, None, version
+
+def render_diagnostics_panel():
+    """Render operational metrics in a collapsible sidebar panel"""
+    with st.sidebar.expander("Diagnostics", expanded=False):
+        pool_metrics = get_connection_pool().metrics()
+        st.markdown("**Connection pool**")
+        col1, col2 = st.columns(2)
+        col1.metric("Hit rate", f"{pool_metrics['hit_rate']:.0%}")
+        col2.metric("Open", f"{pool_metrics['in_use']}/{pool_metrics['size']}")
+        col1.metric("Avg wait", f"{pool_metrics['avg_checkout_wait_seconds'] * 1000:.0f} ms")
+        col2.metric("Max wait", f"{pool_metrics['max_checkout_wait_seconds'] * 1000:.0f} ms")
+        st.caption(
+            f"{pool_metrics['hits']} hits, {pool_metrics['misses']} misses, "
+            f"{pool_metrics['reconnects']} reconnects, {pool_metrics['evictions']} idle evictions"
+        )
+        
+        st.markdown("**Datasets**")
+        in_flight = get_dataset_loader().in_flight()
+        if in_flight:
+            st.caption(f"Loading: {', '.join(in_flight)}")
+        store = get_transaction_store()
+        for cache in (get_rfm_cache(), get_transaction_cache(), *store.caches()):
+            status = cache.status()
+            state = "refreshing" if status['refreshing'] else (status['source'] or "not loaded")
+            if status['loading_rows'] is not None:
+                state = f"fetching ({status['loading_rows']:,} rows so far)"
+            st.caption(f"{cache.name}: {status['rows']:,} rows, v{status['version']}, {state}")
+            if status['memory_before_bytes']:
+                st.caption(
+                    f"Memory: {status['memory_before_bytes'] / 1e6:,.1f} MB loaded → "
+                    f"{status['memory_bytes'] / 1e6:,.1f} MB compacted "
+                    f"({status['memory_before_bytes'] / max(status['memory_bytes'], 1):.1f}x smaller)"
+                )
+            elif status['memory_bytes']:
+                st.caption(f"Memory: {status['memory_bytes'] / 1e6:,.1f} MB")
+            if status['last_error']:
+                st.warning(status['last_error'])
+        if store.reused or store.fetched:
+            st.caption(f"Filtered insights: {store.fetched} predicates fetched, "
+                       f"{store.reused} served from a covering cache")
+        
+        if BACKGROUND_REFRESH:
+            st.markdown("**Background refresh**")
+            refresher = get_refresher()
+            for table, state in refresher.status().items():
+                trigger = f"version {state['version']}" if state['versioned'] else "on schedule"
+                duration = "" if state['duration_seconds'] is None else f", last took {state['duration_seconds']:.2f}s"
+                st.caption(f"{table}: {trigger}, {state['refreshes']} refreshes, "
+                           f"{state['failures']} failures{duration}")
+                if state['version_error']:
+                    st.caption(f"Version check unavailable: {state['version_error']}")
+            if refresher.last_error:
+                st.warning(refresher.last_error)
+        
+        st.markdown("**Cache keys**")
+        for cache in (get_rfm_cache(), get_transaction_cache()):
+            st.caption(f"{cache.name}: fingerprint computed once per load in "
+                       f"{cache.status()['fingerprint_seconds'] * 1000:.2f} ms")
+        memo_rows = [
+            {
+                'Dataset': cache.name,
+                'Result': name,
+                'Calls': calls,
+                'Hit rate': f"{hits / calls:.0%}",
+                'Avg key (µs)': round(key_seconds / calls * 1e6, 1),
+                'Build (s)': round(build_seconds, 3)
+            }
+            for cache in (get_rfm_cache(), get_transaction_cache())
+            for name, (calls, hits, key_seconds, build_seconds) in list(cache.memo_stats.items())
+        ]
+        if memo_rows:
+            st.dataframe(pd.DataFrame(memo_rows), use_container_width=True, hide_index=True)
+        if st.button("Time full-frame hashing", key='diagnostics_hash'):
+            # What keying on the frame itself would cost on every rerun
+            for cache in (get_rfm_cache(), get_transaction_cache()):
+                frame = cache.frame
+                if frame is not None:
+                    start = time.perf_counter()
+                    pd.util.hash_pandas_object(frame, index=False).sum()
+                    st.caption(f"{cache.name}: hashing {len(frame):,} rows takes "
+                               f"{(time.perf_counter() - start) * 1000:,.0f} ms")
+        
+        st.markdown("**Figure cache**")
+        figures = get_figure_cache()
+        entries, used = figures.usage()
+        st.caption(f"{entries} figures, {used / 1e6:,.1f} / {figures.max_bytes / 1e6:,.0f} MB")
+        figure_rows = [
+            {
+                'Chart': chart_id,
+                'Calls': calls,
+                'Hit rate': f"{hits / calls:.0%}",
+                'Avg build (ms)': round(build_seconds / max(calls - hits, 1) * 1000, 1),
+                'Avg restore (ms)': round(restore_seconds / max(hits, 1) * 1000, 1)
+            }
+            for chart_id, (calls, hits, build_seconds, restore_seconds) in list(figures.stats.items())
+        ]
+        if figure_rows:
+            st.dataframe(pd.DataFrame(figure_rows), use_container_width=True, hide_index=True)
+        
+        if NAVIGATION_MODE != 'tabs' and PREFETCH_VIEWS:
+            st.markdown("**Prefetch**")
+            for view, state in get_prefetcher().status().items():
+                if state['running']:
+                    st.caption(f"{view}: warming up ({state['age_seconds']:.0f}s)")
+                elif state['duration_seconds'] is not None:
+                    st.caption(f"{view}: warmed {state['age_seconds']:.0f}s ago in {state['duration_seconds']:.2f}s")
+                if state['error']:
+                    st.warning(f"{view} prefetch failed: {state['error']}")
+        
+        snapshots = get_snapshot_store()
+        if snapshots is not None:
+            usage = snapshots.usage()
+            st.caption(f"Snapshots: {len(usage)} files, {sum(usage.values()) / 1e6:,.1f} MB on disk")
+
+def render_trace_panel():
+    """Render this session's latest run stage by stage and the process-wide stage totals in the sidebar
+
+    The loads and prefetches the run started are listed with it, at their
+    offsets from its start.
+    """
+    tracer = get_tracer()
+    with st.sidebar.expander("Tracing", expanded=False):
+        run = tracer.current_run()
+        if run is not None:
+            rss = f", {run['rss_bytes'] / 1e6:,.0f} MB resident" if run['rss_bytes'] else ""
+            elapsed = f" in {run['seconds']:.2f}s" if run['seconds'] is not None else ""
+            children = tracer.child_runs(run)
+            started = f", {len(children)} background runs" if children else ""
+            st.caption(f"Run {run['run']} ({run['kind']}): {len(run['spans'])} stages{elapsed}{started}{rss}")
+            spans = [(0.0, span) for span in list(run['spans'])] + [
+                ((child['_start'] - run['_start']) * 1000, span) for child in children for span in list(child['spans'])
+            ]
+            span_rows = [
+                {
+                    'Stage': '· ' * span['depth'] + span['stage'],
+                    'Name': span['name'],
+                    'ms': span['ms'],
+                    'Rows': span['rows'],
+                    'MB': None if span['bytes'] is None else round(span['bytes'] / 1e6, 2),
+                    'Cache': span['cache'],
+                    'Thread': span['thread']
+                }
+                for _, span in sorted(spans, key=lambda item: item[0] + item[1]['offset_ms'])
+            ]
+            if span_rows:
+                st.dataframe(pd.DataFrame(span_rows), use_container_width=True, hide_index=True)
+        
+        st.markdown("**Totals since start**")
+        total_rows = [
+            {
+                'Stage': stage,
+                'Name': name,
+                'Calls': calls,
+                'Avg (ms)': round(seconds / calls * 1000, 2),
+                'Max (ms)': round(max_seconds * 1000, 2),
+                'Rows': rows,
+                'MB': round(nbytes / 1e6, 2),
+                'Hit rate': f"{hits / (hits + misses):.0%}" if hits + misses else None
+            }
+            for (stage, name), (calls, seconds, max_seconds, rows, nbytes, hits, misses) in sorted(
+                list(tracer.totals.items()), key=lambda item: -item[1][1]
+            )
+        ]
+        if total_rows:
+            st.dataframe(pd.DataFrame(total_rows), use_container_width=True, hide_index=True)
+        
+        col1, col2 = st.columns(2)
+        col1.download_button("Prometheus", tracer.prometheus(), file_name="metrics.prom",
+                             mime="text/plain", key='trace_prometheus')
+        col2.download_button("JSON lines", tracer.json_lines(), file_name="trace.jsonl",
+                             mime="application/x-ndjson", key='trace_jsonl')
+        if tracer.export_dir:
+            st.caption(f"Exporting each run to {tracer.export_dir}")
+        if tracer.last_error:
+            st.warning(tracer.last_error)
+
+def transaction_filter_options(df):
+    """First and last invoice dates and the sorted countries offered by the RFM recompute filters"""
+    return (
+        df['InvoiceDate'].min().date(),
+        df['InvoiceDate'].max().date(),
+        sorted(df['Country'].unique().tolist())
+    )
+
+@cached_on_version
+def recompute_segments(df, start_date, end_date, countries, reference_date):
+    """Score and summarize RFM segments over a filtered transaction window
+
+    Returns (segment summary or None when nothing matches, scored customers, rows used).
+    """
+    df_window = filter_transactions(df, start_date, end_date, list(countries))
+    if df_window.empty:
+        return None, None, 0
+    customers = compute_customer_rfm(df_window, reference_date)
+    return summarize_segments(customers), customers, len(df_window)
+
+def streamed_segments(predicate, reference_date):
+    """Score and summarize RFM segments from the customer state folded over a streamed transaction window
+
+    Returns (segment summary or None when nothing matches, scored customers, rows folded).
+    """
+    try:
+        result = wait_for_load(get_dataset_loader().submit(*insights_aggregate_load(predicate)), "transactions")
+    except Exception as e:
+        st.error(f"Error streaming transaction data: {str(e)}")
+        return None, None, 0
+    if result is None:
+        return None, None, 0
+    customers = customer_rfm_from_state(result['customers'], reference_date)
+    return summarize_segments(customers), customers, result['stream_stats']['rows']
+
+@st.cache_resource(max_entries=4, ttl=RESULT_CACHE['ttl'])
+def get_customer_index(version, _load_customers):
+    """CustomerIndex over the customers scored for an RFM data version, built once and shared across sessions
+
+    _load_customers() returns the scored customers, or None when they cannot
+    be loaded; the leading underscore keeps it out of the cache key.
+    """
+    customers = _load_customers()
+    if customers is None:
+        # Raising keeps the failure out of the cache, so the next run retries
+        raise LookupError("customers could not be loaded")
+    return CustomerIndex(customers)
+
+def customer_drilldown(version, load_customers, recent_invoices):
+    """(CustomerIndex, recent_invoices(customer_id)) for an RFM data version, or None when its customers cannot be loaded"""
+    try:
+        return get_customer_index(version, load_customers), recent_invoices
+    except LookupError:
+        return None
+
+def handle_invoices(handle):
+    """recent_invoices over a transaction handle, served from its memoized InvoiceIndex"""
+    return lambda customer_id: handle.derived('invoice_index', InvoiceIndex).recent(customer_id)
+
+def warehouse_invoices(customer_id):
+    """recent_invoices queried from the warehouse, for 'stream' mode, which holds no transactions"""
+    customer_id = customer_id if isinstance(customer_id, str) else float(customer_id)
+    return load_customer_invoices(customer_id, RECENT_INVOICES, source_version(TRANSACTIONS_TABLE))
+
+def full_history_drilldown():
+    """Drill-down for the warehouse segment summary: customers scored over the full transaction history
+
+    Loads the transactions (or streams them in 'stream' mode) on first use,
+    since the summary itself holds no customers.
+    """
+    if INSIGHTS_AGGREGATION == 'stream':
+        version = ('full_history', 'stream', source_version(TRANSACTIONS_TABLE))
+        return customer_drilldown(version, lambda: streamed_segments(None, None)[1], warehouse_invoices)
+    handle = load_transaction_data()
+    if handle is None or handle.empty:
+        return None
+    version = ('full_history', handle.fingerprint)
+    return customer_drilldown(version, lambda: handle.derived('customer_rfm', compute_customer_rfm), handle_invoices(handle))
+
+def load_segments():
+    """Load the segment summary, its data version and its drill-down from the warehouse or recompute them from transactions
+
+    The drill-down is a callable returning (CustomerIndex, recent_invoices), or
+    None when customers cannot be loaded; it loads nothing until called. The
+    sidebar settings are kept in session state, since lazy navigation drops
+    the widgets (and their values) while another view is shown.
+    """
+    saved = st.session_state.setdefault('rfm_settings', {})
+    sources = ["Warehouse summary", "Recompute from transactions"]
+    st.sidebar.header("RFM Source")
+    source = st.sidebar.radio(
+        "Segments from:",
+        options=sources,
+        index=sources.index(saved.get('source', sources[0])),
+        key='rfm_source'
+    )
+    saved['source'] = source
+    
+    if source == "Warehouse summary":
+        handle = load_rfm_data()
+        if handle is None:
+            return None, None, None
+        return handle.frame, ('segment_summary', handle.fingerprint), full_history_drilldown
+    
+    if INSIGHTS_AGGREGATION == 'stream':
+        # Transactions are never held in memory; each window is folded as it streams in
+        handle = None
+        bounds = transaction_bounds()
+        if bounds is None:
+            return None, None, None
+        first_date, last_date, country_options = bounds
+    else:
+        handle = load_transaction_data()
+        if handle is None or handle.empty:
+            return None, None, None
+        first_date, last_date, country_options = handle.derived('rfm_filter_options', transaction_filter_options)
+    
+    start_date, end_date = saved.get('window', (first_date, last_date))
+    start_date = min(max(start_date, first_date), last_date)
+    end_date = max(min(end_date, last_date), start_date)
+    window = st.sidebar.date_input(
+        "Transaction window:",
+        value=(start_date, end_date),
+        min_value=first_date,
+        max_value=last_date,
+        key='rfm_window'
+    )
+    start_date, end_date = window if len(window) == 2 else (window[0], last_date)
+    
+    reference_date = st.sidebar.date_input(
+        "Recency reference date:",
+        value=max(saved.get('reference_date') or end_date + timedelta(days=1), start_date),
+        min_value=start_date,
+        key='rfm_reference_date'
+    )
+    
+    countries = st.sidebar.multiselect(
+        "Countries (all if empty):",
+        options=country_options,
+        default=[country for country in saved.get('countries', ()) if country in country_options],
+        key='rfm_countries'
+    )
+    # A reference date left at its default keeps following the window's end
+    default_reference = end_date + timedelta(days=1)
+    saved.update(window=(start_date, end_date), countries=list(countries),
+                 reference_date=None if reference_date == default_reference else reference_date)
+    
+    settings = (start_date, end_date, tuple(countries), reference_date)
+    if handle is None:
+        predicate = insights_predicate(bounds, (start_date, end_date), countries)
+        summary, customers, n_rows = streamed_segments(predicate, reference_date)
+        version = ('recompute', 'stream', n_rows) + settings
+        recent_invoices = warehouse_invoices
+    else:
+        summary, customers, n_rows = recompute_segments(handle, *settings)
+        version = ('recompute', handle.fingerprint) + settings
+        recent_invoices = handle_invoices(handle)
+    if summary is None:
+        st.sidebar.warning("No transactions match these settings")
+        return None, None, None
+    
+    st.sidebar.caption(f"Scored {len(customers):,} customers from {n_rows:,} transactions")
+    return summary, version, lambda: customer_drilldown(version, lambda: customers, recent_invoices)
+
+def render_rfm_view():
+    """Load the segment data and render the RFM view"""
+    df_rfm, rfm_version, drilldown = load_segments()
+    if df_rfm is not None:
+        render_rfm_tab(df_rfm, rfm_version, drilldown)
+    else:
+        st.error("Unable to load RFM segmentation data. Please check your Databricks configuration.")
+
+def render_insights_view():
+    """Load the insights data and render the insights view"""
+    aggregates, freshness, cohort_builder, insights_version = load_insights(render_insights_filters())
+    if aggregates is None:
+        st.error("Unable to load transaction data. Please check your Databricks configuration.")
+    elif not aggregates['totals']['Orders'].iloc[0]:
+        st.info("No transactions match the selected filters")
+    else:
+        render_insights_tab(aggregates, freshness, cohort_builder, insights_version)
+
+def prefetch_rfm(session):
+    """Background warm-up for the RFM view: the warehouse segment summary"""
+    return get_rfm_cache().get
+
+def prefetch_insights(session):
+    """Background warm-up for the insights view: the transactions and their derived results, or the SQL aggregates
+
+    Runs on the prefetch thread with a copy of the session state; the default
+    window's transaction bounds are loaded there and raise on failure.
+    """
+    bounds = functools.partial(result_loader('transaction_bounds', query_transaction_bounds),
+                               source_version(TRANSACTIONS_TABLE))
+    predicate = selected_insights_predicate(session, bounds)
+    if INSIGHTS_AGGREGATION == 'pandas':
+        store = get_transaction_store()
+        approximate = approximate_distinct_counts(session)
+        return lambda: transaction_insights(store.handle(predicate), approximate)
+    return insights_aggregate_load(predicate)[1]
+
+# Navigation views: key -> (label, render function, factory(session state copy) for its background warm-up)
+VIEWS = {
+    'rfm': ("📊 RFM Segmentation", render_rfm_view, prefetch_rfm),
+    'insights': ("📈 Customer & Revenue Insights", render_insights_view, prefetch_insights),
+}
+
+class Prefetcher:
+    """Runs background warm-ups for views that are not shown, one at a time per view"""
+    
+    def __init__(self, min_interval=PREFETCH_INTERVAL_SECONDS):
+        self.min_interval = min_interval
+        self.started = {}           # view -> monotonic start time of its last warm-up
+        self.durations = {}         # view -> seconds the last completed warm-up took
+        self.errors = {}
+        self._running = set()
+        self._lock = threading.Lock()
+    
+    def request(self, view, prefetch, *args):
+        """Run prefetch(*args)() in a background thread unless one ran for this view within the interval
+
+        Building the warm-up happens in that thread too, so a request that is
+        skipped costs the script run nothing; args carry any session state it needs.
+        """
+        with self._lock:
+            if view in self._running or time.monotonic() - self.started.get(view, -self.min_interval) < self.min_interval:
+                return False
+            self._running.add(view)
+            self.started[view] = time.monotonic()
+        # No script context: warm-ups only fill the process-wide caches and render nothing
+        warm = get_tracer().bind(lambda: prefetch(*args)(), 'prefetch')
+        threading.Thread(target=self._run, args=(view, warm), name=f"prefetch-{view}", daemon=True).start()
+        return True
+    
+    def _run(self, view, warm):
+        start = time.monotonic()
+        try:
+            warm()
+            self.errors.pop(view, None)
+        except Exception as e:
+            self.errors[view] = str(e)
+        finally:
+            self.durations[view] = time.monotonic() - start
+            with self._lock:
+                self._running.discard(view)
+    
+    def status(self):
+        """Per-view state of the background warm-ups"""
+        with self._lock:
+            running = set(self._running)
+        return {
+            view: {
+                'running': view in running,
+                'age_seconds': time.monotonic() - started,
+                'duration_seconds': self.durations.get(view),
+                'error': self.errors.get(view)
+            }
+            for view, started in self.started.items()
+        }
+
+@st.cache_resource
+def get_prefetcher():
+    """Process-wide view prefetcher shared across sessions"""
+    return Prefetcher()
+
+def render_app():
+    """Render the sidebar controls and the views"""
+    if BACKGROUND_REFRESH:
+        get_refresher().start()
+    
+    if st.sidebar.button("🔄 Full data reload", help="Discard cached data and reload the full history"):
+        st.cache_data.clear()
+        get_result_cache().clear()
+        get_figure_cache().clear()
+        get_rfm_cache().invalidate()
+        get_transaction_cache().invalidate()
+        get_transaction_store().clear()
+    
+    if NAVIGATION_MODE == 'tabs':
+        # Every view's queries start now; each view below waits only for its own data
+        start_dataset_loads()
+        # st.tabs only hides inactive tabs in the browser, so every view loads and renders
+        for tab, (label, render, _) in zip(st.tabs([view[0] for view in VIEWS.values()]), VIEWS.values()):
+            with tab:
+                render()
+    else:
+        active = st.radio(
+            "View:",
+            options=list(VIEWS),
+            format_func=lambda view: VIEWS[view][0],
+            horizontal=True,
+            label_visibility='collapsed',
+            key='active_view'
+        )
+        VIEWS[active][1]()
+        
+        if PREFETCH_VIEWS:
+            prefetcher = get_prefetcher()
+            session = st.session_state.to_dict()
+            for view, (_, _, prefetch) in VIEWS.items():
+                if view != active:
+                    prefetcher.request(view, prefetch, session)
+
+def main():
+    tracer = get_tracer()
+    # A rerun or st.stop() raises out of the script, so the run is closed in finally
+    run = tracer.start_run()
+    try:
+        render_app()
+    finally:
+        tracer.finish_run(run)
+    if SHOW_DIAGNOSTICS:
+        render_diagnostics_panel()
+    if SHOW_TRACE_PANEL:
+        render_trace_panel()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,66 @@
+"""Shared fixtures: synthetic transactions, a DuckDB stand-in for the warehouse and headless app runs"""
+import os
+import sys
+
+import pytest
+import streamlit as st
+from streamlit.testing.v1 import AppTest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_PATH = os.path.join(ROOT, 'main.py')
+sys.path.insert(0, ROOT)
+
+import main
+from benchmark import DuckDBConnector, generate_segment_summary, generate_transactions
+
+@pytest.fixture(scope='session')
+def transactions():
+    """A small synthetic transaction frame shaped like retail_transactions_silver"""
+    return generate_transactions(20_000, seed=3)
+
+@pytest.fixture
+def warehouse(monkeypatch):
+    """Install a DuckDB connector serving the given tables as the app's SQL client"""
+    pytest.importorskip('duckdb')
+
+    def install(tables, latency=None):
+        connector = DuckDBConnector(tables, latency)
+        monkeypatch.setattr(main, 'sql', connector)
+        if 'transactions' in tables:
+            monkeypatch.setattr(main, 'TRANSACTIONS_TABLE', 'transactions')
+        main.get_connection_pool.clear()
+        return connector
+
+    yield install
+    main.get_connection_pool.clear()
+
+@pytest.fixture
+def segments(transactions):
+    """Rows of the warehouse segment_summary table scored from the synthetic transactions"""
+    return generate_segment_summary(transactions)
+
+@pytest.fixture
+def app(monkeypatch, transactions, segments):
+    """Factory for an AppTest of main.py in a navigation mode, served by a DuckDB warehouse"""
+    pytest.importorskip('duckdb')
+    import databricks.sql
+
+    connector = DuckDBConnector({'transactions': transactions, 'segment_summary': segments})
+    monkeypatch.setattr(databricks.sql, 'connect', connector.connect)
+    for name, value in dict(TRANSACTIONS_TABLE='transactions', DATABASE_NAME='main', TABLE_NAME='segment_summary',
+                            SNAPSHOT_DIR='', PREFETCH_VIEWS='false', BACKGROUND_REFRESH='false').items():
+        monkeypatch.setenv(name, value)
+
+    def create(navigation):
+        monkeypatch.setenv('NAVIGATION_MODE', navigation)
+        at = AppTest.from_file(APP_PATH, default_timeout=120)
+        at.run()
+        assert not at.exception and not at.error
+        return at
+
+    # The app script and the imported main module share cache entries
+    st.cache_data.clear()
+    st.cache_resource.clear()
+    yield create
+    st.cache_data.clear()
+    st.cache_resource.clear()
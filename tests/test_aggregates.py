@@ -0,0 +1,29 @@
+"""Warehouse aggregate queries against the pandas reference implementations"""
+import pandas as pd
+
+import main
+from benchmark import assert_aggregates_equal
+
+def sql_aggregates(predicate=None):
+    condition, parameters = main.transaction_filter(predicate)
+    return main.normalize_insight_aggregates(main.run_queries({
+        name: query.format(table=main.TRANSACTIONS_TABLE, filter=condition)
+        for name, query in main.AGGREGATE_QUERIES.items()
+    }, parameters))
+
+def test_sql_aggregates_match_pandas(transactions, warehouse):
+    warehouse({'transactions': transactions})
+    assert_aggregates_equal(main.compute_insight_aggregates(transactions), sql_aggregates())
+
+def test_freshness_from_sql_histogram_matches_pandas(transactions, warehouse):
+    warehouse({'transactions': transactions})
+    expected = main.freshness_metrics(main.freshness_histogram(transactions))
+    actual = main.freshness_metrics(sql_aggregates()['freshness'])
+    for key, value in expected.items():
+        if isinstance(value, pd.DataFrame):
+            pd.testing.assert_frame_equal(
+                value, actual[key].sort_values('processing_date').reset_index(drop=True),
+                check_dtype=False, check_exact=False, rtol=1e-9
+            )
+        else:
+            assert value == actual[key] or abs(value - actual[key]) < 1e-9, key
@@ -0,0 +1,98 @@
+"""Headless runs of the real app against the DuckDB warehouse, including fragment reruns"""
+import functools
+import time
+
+import pytest
+
+pytest.importorskip('duckdb')
+
+from streamlit.testing.v1 import local_script_runner
+
+def fragment_rerun(at):
+    """Rerun only the app's registered fragments, as a widget change inside one does in the browser
+
+    AppTest.run() always reruns the whole script, so the fragment ids are put
+    on the rerun request it builds.
+    """
+    fragment_ids = list(at._fragment_storage._fragments)
+    rerun_data = local_script_runner.RerunData
+    local_script_runner.RerunData = functools.partial(rerun_data, fragment_id_queue=fragment_ids,
+                                                      is_fragment_scoped_rerun=True)
+    try:
+        return at.run()
+    finally:
+        local_script_runner.RerunData = rerun_data
+
+def drilldown_segments(at):
+    return sorted(at.selectbox(key='drill_segment').options)
+
+@pytest.mark.parametrize('navigation', ['tabs', 'lazy'])
+def test_segment_filters_drive_the_charts_and_drilldown(app, segments, navigation):
+    at = app(navigation)
+    all_segments = sorted(segments['Segment'].unique())
+    assert f"Showing all {len(all_segments)} segments" in [info.value for info in at.info]
+    assert drilldown_segments(at) == all_segments
+
+    at.radio(key='rfm_filter').set_value("Custom Selection").run()
+    at.multiselect(key='rfm_segments').set_value(all_segments[:2]).run()
+    assert not at.exception and not at.error
+    assert "Showing 2 segment(s)" in [success.value for success in at.success]
+    assert drilldown_segments(at) == all_segments[:2]
+
+    at.radio(key='rfm_filter').set_value("All Segments").run()
+    assert drilldown_segments(at) == all_segments
+
+def test_segment_filters_rerun_only_their_fragment(app, segments):
+    at = app('lazy')
+    all_segments = sorted(segments['Segment'].unique())
+
+    at.radio(key='rfm_filter').set_value("Custom Selection")
+    fragment_rerun(at)
+    assert not at.exception and not at.error
+    # Only the fragment ran: the sidebar and the segment loading were skipped
+    assert not at.sidebar.radio
+    assert "Showing 1 segment(s)" in [success.value for success in at.success]
+    assert drilldown_segments(at) == all_segments[:1]
+
+    at.multiselect(key='rfm_segments').set_value(all_segments[1:3])
+    fragment_rerun(at)
+    assert not at.exception and not at.error
+    assert drilldown_segments(at) == all_segments[1:3]
+
+    at.run()
+    assert at.sidebar.radio(key='rfm_source').value == "Warehouse summary"
+    assert drilldown_segments(at) == all_segments[1:3]
+
+def test_summary_drilldown_loads_the_history_on_request(app, segments):
+    at = app('lazy')
+    segment = segments.sort_values('Total_Revenue', ascending=False)['Segment'].iloc[0]
+    at.selectbox(key='drill_segment').set_value(segment).run()
+    assert not at.exception and not at.error
+    # Nothing is scored until asked for, since that loads the full transaction history
+    assert not [caption for caption in at.caption if caption.value.startswith("Customers ")]
+
+    at.button(key='drill_load_history').click().run()
+    assert not at.exception and not at.error
+    warehouse_count = int(segments.set_index('Segment').loc[segment, 'Customer_Count'])
+    counts = [caption.value for caption in at.caption if caption.value.startswith("App-scored")]
+    assert counts and f"against {warehouse_count:,} in the warehouse summary" in counts[0]
+
+    # The history stays loaded for the session
+    at.selectbox(key='drill_segment').set_value(sorted(segments['Segment'])[0]).run()
+    assert [caption for caption in at.caption if caption.value.startswith("App-scored")]
+
+def test_hidden_view_is_prefetched_in_the_background(app, monkeypatch):
+    for name, value in dict(PREFETCH_VIEWS='true', INSIGHTS_DEFAULT_MONTHS='3', SHOW_DIAGNOSTICS='true').items():
+        monkeypatch.setenv(name, value)
+    at = app('lazy')
+    # The diagnostics panel reports the warm-up once it finished
+    for _ in range(100):
+        if any(caption.value.startswith("insights: warmed") for caption in at.caption):
+            break
+        time.sleep(0.1)
+        at.run()
+    else:
+        pytest.fail("the insights view was not prefetched")
+    assert not at.exception and not at.error and not at.warning
+    at.radio(key='active_view').set_value('insights').run()
+    assert not at.exception and not at.error
@@ -0,0 +1,20 @@
+"""Vectorized cohort retention engine against the per-row Period reference"""
+import pandas as pd
+
+import main
+
+def test_monthly_retention_matches_period_reference(transactions):
+    expected = main.retention_from_counts(main.cohort_counts(transactions))
+    actual = main.cohort_retention(transactions, grain='M', horizon=12, max_cohorts=12)
+    # The reference pivot leaves cohorts with no returning customers blank; the
+    # engine reports 0 for those and keeps NaN for periods the data hasn't reached
+    observable = actual.notna()
+    expected = expected.reindex(columns=actual.columns).where(~observable | expected.notna(), 0.0)
+    pd.testing.assert_frame_equal(expected, actual, check_names=False, check_exact=False, rtol=1e-9,
+                                  check_column_type=False)
+
+def test_weekly_and_quarterly_grains_start_at_full_retention(transactions):
+    for grain in ('W', 'Q'):
+        matrix = main.cohort_retention(transactions, grain=grain, horizon=12)
+        assert matrix.shape[1] <= 13
+        assert (matrix.iloc[:, 0] == 100).all()
@@ -0,0 +1,61 @@
+"""Compacted transaction frames keep their values, and merge with uncompacted deltas"""
+import pandas as pd
+
+import main
+
+def test_ids_become_integers_only_when_their_text_survives():
+    df = pd.DataFrame({'value': ['536365', '007', '+12', 'C536365', '536365 ']})
+    assert main.integer_column(df['value'].iloc[:1]).tolist() == [536365]
+    for text in df['value'].iloc[1:]:
+        assert main.integer_column(pd.Series(['536365', text])) is None
+
+def test_compaction_keeps_id_text(transactions):
+    df = transactions.head(1_000).astype({'InvoiceNo': object, 'Country': object})
+    df['CustomerID'] = 'K' + df['CustomerID'].astype('int64').astype(str).str.zfill(8)
+    df.loc[df.index[:5], 'InvoiceNo'] = '0' + df['InvoiceNo'].iloc[:5]
+    compact = main.compact_transactions(df)
+    assert isinstance(compact['InvoiceNo'].dtype, pd.CategoricalDtype)
+    assert isinstance(compact['CustomerID'].dtype, pd.CategoricalDtype)
+    for column in ('InvoiceNo', 'CustomerID'):
+        assert compact[column].astype(str).tolist() == df[column].tolist()
+
+def test_compaction_leaves_aggregates_unchanged(transactions):
+    loaded = transactions.astype({'InvoiceNo': object, 'Country': object})
+    expected = main.aggregates_from_cube(main.build_aggregate_cube(transactions))
+    actual = main.aggregates_from_cube(main.build_aggregate_cube(main.compact_transactions(loaded)))
+    for name, frame in expected.items():
+        pd.testing.assert_frame_equal(frame, actual[name], check_dtype=False, check_categorical=False,
+                                      check_exact=False, rtol=1e-6)
+
+def test_merge_matches_compacted_integer_keys_with_string_deltas(transactions):
+    ingested = transactions.sort_values('ingestion_timestamp', ignore_index=True)
+    cutoff = len(ingested) - 100
+    frame = main.compact_transactions(ingested.iloc[:cutoff])
+    assert pd.api.types.is_integer_dtype(frame['InvoiceNo'])
+    watermark = frame['ingestion_timestamp'].max()
+
+    # The delta re-fetches the rows at the watermark, a reprocessed batch with newer
+    # ingestion timestamps, and a non-numeric invoice
+    reprocessed = ingested.iloc[cutoff - 20:cutoff - 1].assign(
+        ingestion_timestamp=ingested['ingestion_timestamp'].max() + pd.Timedelta(hours=1))
+    delta = pd.concat([reprocessed, ingested[ingested['ingestion_timestamp'] >= watermark]], ignore_index=True)
+    delta.loc[delta.index[-3:], 'InvoiceNo'] = 'C' + delta['InvoiceNo'].iloc[-3:]
+    for fetched in (delta, main.compact_transactions(delta)):
+        merged = main.merge_transactions(frame, fetched, watermark)
+        assert len(merged) == len(ingested)
+        assert not merged.duplicated(main.TRANSACTION_ROW_KEY).any()
+    assert set(delta['InvoiceNo'].iloc[-3:]) <= set(merged['InvoiceNo'].astype(str))
+
+def test_drilldown_indexes_take_text_customer_ids(transactions):
+    df = transactions.head(2_000).assign(
+        CustomerID=lambda frame: 'K' + frame['CustomerID'].astype('int64').astype(str))
+    compact = main.compact_transactions(df)
+    index = main.CustomerIndex(main.compute_customer_rfm(compact))
+    invoices = main.InvoiceIndex(compact)
+    customer_id = df['CustomerID'].iloc[0]
+
+    assert index.parse(customer_id) == customer_id
+    customer, rank = index.find(customer_id)
+    assert customer['CustomerID'] == customer_id and rank >= 1
+    assert len(invoices.rows(customer_id)) == (df['CustomerID'] == customer_id).sum()
+    assert main.create_customer_table(index.page(customer['Segment'], 0, 5))['Customer ID'].str.startswith('K').all()
@@ -0,0 +1,104 @@
+"""Connection pool health checks and retries"""
+import pytest
+
+import main
+
+class DroppableConnection:
+    """Connection whose session the warehouse can end without the client noticing"""
+
+    def __init__(self, connector):
+        self.connector = connector
+        self.open = True
+        self.dropped = False
+
+    def cursor(self):
+        return DroppableCursor(self)
+
+    def close(self):
+        self.open = False
+
+class DroppableCursor:
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.description = [('value', None, None, None, None, None, None)]
+
+    def execute(self, query, parameters=None):
+        self.connection.connector.executed.append(query)
+        if self.connection.dropped:
+            raise ConnectionError("session expired")
+
+    def fetchall(self):
+        return [(1,)]
+
+    def fetchmany(self, size):
+        rows, self._done = ([] if getattr(self, '_done', False) else [(1,)]), True
+        return rows
+
+    def close(self):
+        pass
+
+class DroppableConnector:
+    OperationalError = ConnectionError
+
+    def __init__(self):
+        self.connections = []
+        self.executed = []
+
+    def connect(self, **kwargs):
+        self.connections.append(DroppableConnection(self))
+        return self.connections[-1]
+
+def test_long_idle_connection_is_pinged_and_replaced():
+    connector = DroppableConnector()
+    pool = main.ConnectionPool(connector, max_size=2, validate_after=0)
+    with pool.connection():
+        pass
+    connector.connections[0].dropped = True
+
+    with pool.connection() as connection:
+        assert connection is connector.connections[1]
+    assert connector.executed == ['SELECT 1']
+    assert pool.metrics()['reconnects'] == 1
+
+def test_recently_used_connection_is_not_pinged():
+    connector = DroppableConnector()
+    pool = main.ConnectionPool(connector, validate_after=60)
+    with pool.connection():
+        pass
+    with pool.connection() as connection:
+        assert connection is connector.connections[0]
+    assert connector.executed == []
+
+def test_retry_runs_on_a_new_connection(monkeypatch):
+    connector = DroppableConnector()
+    pool = main.ConnectionPool(connector, max_size=2, validate_after=60)
+    monkeypatch.setattr(main, 'get_connection_pool', lambda: pool)
+    monkeypatch.setattr(main, 'FETCH_MODE', 'rows')
+    # Two idle connections whose sessions both ended while the pool still trusts them
+    with pool.connection(), pool.connection():
+        pass
+    for connection in connector.connections:
+        connection.dropped = True
+
+    result = main.run_query('SELECT 1')
+    assert result['value'].tolist() == [1]
+    assert len(connector.connections) == 3
+    assert pool.metrics()['size'] <= 2
+
+def test_retry_gives_up_when_the_new_connection_fails_too(monkeypatch):
+    connector = DroppableConnector()
+    connect = connector.connect
+
+    def dropped_connect(**kwargs):
+        connection = connect(**kwargs)
+        connection.dropped = True
+        return connection
+
+    connector.connect = dropped_connect
+    pool = main.ConnectionPool(connector, validate_after=60)
+    monkeypatch.setattr(main, 'get_connection_pool', lambda: pool)
+    with pytest.raises(ConnectionError):
+        main.run_query('SELECT 1')
+    assert len(connector.connections) == 2
+    assert pool.metrics()['size'] == 0
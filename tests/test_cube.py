@@ -0,0 +1,41 @@
+"""Insights aggregates rolled up from the aggregate cube"""
+import pandas as pd
+
+import main
+
+def test_cube_rollups_match_direct_aggregates(transactions):
+    expected = main.compute_insight_aggregates(transactions)
+    actual = main.aggregates_from_cube(main.build_aggregate_cube(transactions))
+    for name, frame in expected.items():
+        pd.testing.assert_frame_equal(
+            frame.reset_index(drop=True), actual[name].reset_index(drop=True),
+            check_dtype=False, check_names=False, check_exact=False, rtol=1e-9
+        )
+
+def test_cube_keeps_only_the_monthly_grain(transactions):
+    cube = main.build_aggregate_cube(transactions)
+    assert 'daily' not in cube
+    assert list(cube['monthly'].columns) == ['Month', 'Country', 'Revenue', 'Orders', 'Customers']
+
+def test_sketched_counts_are_within_their_error_bound(transactions):
+    exact = main.aggregates_from_cube(main.build_aggregate_cube(transactions))
+    approx = main.aggregates_from_cube(main.build_aggregate_cube(transactions, approximate=True))
+    # Hashing is deterministic, so every estimate should land within a few standard errors
+    bound = 4 * approx['distinct_error']
+    for name, key, columns in (('totals', None, ['Customers', 'Orders']),
+                               ('monthly', 'Month', ['UniqueCustomers', 'Orders']),
+                               ('country', 'Country', ['Customers', 'Orders']),
+                               ('cohort', ['CohortMonth', 'CohortPeriod'], ['Customers'])):
+        expected, actual = exact[name], approx[name]
+        if key is not None:
+            expected = expected.set_index(key)
+            actual = actual.set_index(key).reindex(expected.index)
+        for column in columns:
+            error = (actual[column] / expected[column] - 1).abs().max()
+            assert error <= bound, (name, column, error)
+
+def test_sketched_cube_keeps_exact_first_purchases(transactions):
+    expected = transactions.groupby('CustomerID')['InvoiceDate'].min()
+    for approximate in (False, True):
+        first_purchase = main.build_aggregate_cube(transactions, approximate)['first_purchase']
+        pd.testing.assert_series_equal(first_purchase.sort_index(), expected, check_index_type=False)
@@ -0,0 +1,47 @@
+"""Background dataset loads shared by concurrent requests"""
+import threading
+
+import pytest
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+import main
+
+def blocking_load(release, calls, result):
+    def load():
+        calls.append(get_script_run_ctx(suppress_warning=True))
+        release.wait(5)
+        return result
+    return load
+
+def test_concurrent_loads_of_a_dataset_share_one_future():
+    loader = main.DatasetLoader()
+    release, calls = threading.Event(), []
+    first = loader.submit('transactions', blocking_load(release, calls, 'incremental'))
+    second = loader.submit('transactions', blocking_load(release, calls, 'other'))
+    assert second is first
+    assert loader.in_flight() == ['transactions']
+    release.set()
+    assert first.result(5) == 'incremental'
+    assert len(calls) == 1
+
+def test_full_reload_does_not_join_an_incremental_load():
+    loader = main.DatasetLoader()
+    release, calls = threading.Event(), []
+    incremental = loader.submit('transactions', blocking_load(release, calls, 'incremental'))
+    full = loader.submit('transactions', blocking_load(release, calls, 'full'), full_reload=True)
+    assert full is not incremental
+    release.set()
+    assert (incremental.result(5), full.result(5)) == ('incremental', 'full')
+
+def test_loads_run_without_a_script_context_and_raise_failures():
+    loader = main.DatasetLoader()
+    release, calls = threading.Event(), []
+    release.set()
+    loader.submit('segment_summary', blocking_load(release, calls, 'summary')).result(5)
+    assert calls == [None]
+
+    def fail():
+        raise ConnectionError("warehouse unavailable")
+
+    with pytest.raises(ConnectionError):
+        loader.submit('segment_summary', fail).result(5)
@@ -0,0 +1,33 @@
+"""Memoized results derived from a cached dataset"""
+import pandas as pd
+
+import main
+
+def dataset_cache():
+    cache = main.DatasetCache('values', lambda on_batch=None: pd.DataFrame({'value': range(10)}),
+                              refresh_seconds=3600)
+    cache.get()
+    return cache
+
+def test_results_are_reused_until_the_data_changes():
+    cache = dataset_cache()
+    builds = []
+    total = lambda frame: builds.append(1) or frame['value'].sum()
+    assert cache.derived('total', total) == cache.derived('total', total) == 45
+    assert len(builds) == 1
+
+def test_least_recently_used_result_is_evicted(monkeypatch):
+    monkeypatch.setattr(main, 'DERIVED_MAX_ENTRIES', 2)
+    cache = dataset_cache()
+    builds = []
+
+    def builder(name):
+        return lambda frame: builds.append(name) or name
+
+    cache.derived('a', builder('a'))
+    cache.derived('b', builder('b'))
+    cache.derived('a', builder('a'))  # a hit makes 'a' the most recently used
+    cache.derived('c', builder('c'))  # evicts 'b', not 'a'
+    cache.derived('a', builder('a'))
+    cache.derived('b', builder('b'))
+    assert builds == ['a', 'b', 'c', 'b']
@@ -0,0 +1,58 @@
+"""Customer drill-down indexes against scans of the transactions"""
+import numpy as np
+import pandas as pd
+import pytest
+
+import main
+
+PAGE_SIZE = 25
+
+@pytest.fixture(scope='module')
+def indexed(transactions):
+    """Compacted transactions, their customer RFM values and both drill-down indexes"""
+    df = main.compact_transactions(transactions)
+    customers = main.compute_customer_rfm(df)
+    return df, customers, main.CustomerIndex(customers), main.InvoiceIndex(df)
+
+def scan_invoices(df, customer_id):
+    return main.invoice_summary(df[df['CustomerID'] == customer_id]).head(main.RECENT_INVOICES).reset_index(drop=True)
+
+def sample_customers(customers, count=20):
+    return customers['CustomerID'].to_numpy()[np.random.default_rng(0).integers(0, len(customers), count)]
+
+def test_segment_pages_match_a_sorted_scan(indexed):
+    _, customers, index, _ = indexed
+    for segment in index.ranges:
+        members = customers[customers['Segment'] == segment]
+        expected = members.sort_values('Monetary', ascending=False, kind='stable')
+        pages = -(-index.segment_size(segment) // PAGE_SIZE)
+        for page in {0, pages // 2, pages - 1}:
+            pd.testing.assert_frame_equal(
+                index.page(segment, page, PAGE_SIZE).reset_index(drop=True),
+                expected.iloc[page * PAGE_SIZE:(page + 1) * PAGE_SIZE].reset_index(drop=True)
+            )
+
+def test_found_customers_sit_on_their_ranked_page(indexed):
+    _, _, index, _ = indexed
+    for customer_id in sample_customers(indexed[1]):
+        customer, rank = index.find(customer_id)
+        assert customer['CustomerID'] == customer_id
+        page = index.page(customer['Segment'], (rank - 1) // PAGE_SIZE, PAGE_SIZE)
+        assert page.iloc[(rank - 1) % PAGE_SIZE]['CustomerID'] == customer_id
+
+def test_recent_invoices_match_a_scan(indexed):
+    df, customers, _, invoices = indexed
+    for customer_id in sample_customers(customers):
+        pd.testing.assert_frame_equal(invoices.recent(customer_id), scan_invoices(df, customer_id))
+
+def test_warehouse_invoice_query_matches_the_index(indexed, transactions, warehouse):
+    warehouse({'transactions': transactions})
+    _, customers, _, invoices = indexed
+    for customer_id in sample_customers(customers, 5):
+        expected = invoices.recent(customer_id)
+        actual = main.load_customer_invoices(float(customer_id))
+        pd.testing.assert_frame_equal(
+            expected.assign(InvoiceNo=expected['InvoiceNo'].astype(str), Country=expected['Country'].astype(str)),
+            actual.assign(InvoiceNo=actual['InvoiceNo'].astype(str)),
+            check_dtype=False, check_exact=False, rtol=1e-6
+        )
@@ -0,0 +1,39 @@
+"""Serialized figure cache keyed on chart, data version and filters"""
+import plotly.io as pio
+import pytest
+
+import main
+from benchmark import chart_inputs
+
+@pytest.fixture(scope='module')
+def charts(transactions):
+    return chart_inputs(transactions)
+
+def fill(cache, charts, version=1):
+    builds = []
+    for chart_id, (builder, data) in charts.items():
+        cache.figure(chart_id, version, None, lambda: builds.append(chart_id) or builder(data))
+    return builds
+
+def test_hits_restore_the_built_figure_without_rebuilding(charts):
+    cache = main.FigureCache()
+    assert fill(cache, charts) == list(charts)
+    assert fill(cache, charts) == []
+    builder, data = charts['rfm_heatmap']
+    restored = cache.figure('rfm_heatmap', 1, None, None)
+    assert restored.to_json() == pio.from_json(builder(data).to_json()).to_json()
+    # A new data version or filter selection is a different entry
+    assert fill(cache, charts, version=2) == list(charts)
+    assert cache.usage()[0] == 2 * len(charts)
+
+def test_evicts_least_recently_used_figures_under_the_byte_cap(charts):
+    full = main.FigureCache()
+    fill(full, charts)
+    _, used = full.usage()
+
+    small = main.FigureCache(max_bytes=used // 2)
+    fill(small, charts)
+    entries, held = small.usage()
+    assert 0 < entries < len(charts) and held <= used // 2
+    # The last charts stored are the ones kept
+    assert fill(small, dict(list(charts.items())[-1:])) == []
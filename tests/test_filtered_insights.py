@@ -0,0 +1,53 @@
+"""Server-side insights predicates and the predicate-filtered transaction caches"""
+import numpy as np
+import pandas as pd
+import pytest
+
+import main
+from benchmark import COUNTRIES, assert_aggregates_equal, transaction_cache
+from test_aggregates import sql_aggregates
+
+@pytest.fixture
+def predicates(transactions, warehouse):
+    """A wide and a narrow (date, countries) predicate over the synthetic transactions"""
+    warehouse({'transactions': transactions})
+    first, last = transactions['InvoiceDate'].min(), transactions['InvoiceDate'].max()
+    wide = ((first + pd.Timedelta(days=100)).date(), (last - pd.Timedelta(days=100)).date(), None)
+    narrow = ((first + pd.Timedelta(days=200)).date(), (last - pd.Timedelta(days=250)).date(),
+              tuple(sorted(COUNTRIES[:3])))
+    return wide, narrow
+
+def test_predicate_fetches_and_aggregates_match_local_filtering(transactions, predicates):
+    wide, narrow = predicates
+    for predicate in (wide, narrow, (None, wide[1], None), (wide[0], None, narrow[2])):
+        expected = main.filter_transactions(transactions, *predicate)
+        fetched = main.query_transactions(predicate=predicate)
+        assert len(fetched) == len(expected), main.predicate_label(predicate)
+        assert np.isclose(fetched['TotalPrice'].astype('float64').sum(), expected['TotalPrice'].sum())
+        assert_aggregates_equal(main.compute_insight_aggregates(expected), sql_aggregates(predicate))
+
+def test_covered_predicates_reuse_a_loaded_cache(transactions, predicates):
+    wide, narrow = predicates
+    store = main.TransactionStore(transaction_cache())
+    store.handle(wide)
+    handle = store.handle(narrow)
+    assert (store.fetched, store.reused) == (1, 1)
+    assert len(handle.frame) == len(main.filter_transactions(transactions, *narrow))
+
+    store.clear()
+    store.handle(narrow)
+    assert store.fetched == 2
+
+@pytest.mark.parametrize('aggregation', ['pandas', 'sql', 'stream'])
+def test_filters_matching_no_transactions_show_a_notice(app, monkeypatch, transactions, aggregation):
+    monkeypatch.setenv('INSIGHTS_AGGREGATION', aggregation)
+    at = app('lazy')
+    # A day on which one country has no invoices
+    daily = transactions.groupby([transactions['InvoiceDate'].dt.date, 'Country']).size().unstack(fill_value=0)
+    day, country = daily.stack()[lambda counts: counts == 0].index[0]
+
+    at.radio(key='active_view').set_value('insights').run()
+    at.date_input(key='insights_dates').set_value((day, day))
+    at.multiselect(key='insights_countries').set_value([country]).run()
+    assert not at.exception and not at.error
+    assert "No transactions match the selected filters" in [info.value for info in at.info]
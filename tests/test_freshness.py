@@ -0,0 +1,21 @@
+"""Data freshness metrics from the one-pass lag histogram"""
+import numpy as np
+
+import main
+
+def test_lag_statistics_match_per_record_lags(transactions):
+    metrics = main.get_data_freshness_metrics(transactions)
+    # Per-record calendar-day lags, expanded, as the reference for every statistic
+    lag = (transactions['ingestion_timestamp'].dt.normalize() - transactions['InvoiceDate'].dt.normalize()).dt.days
+    expected = np.percentile(lag, [50, 95, 99], method='inverted_cdf')
+    assert [metrics['lag_p50'], metrics['lag_p95'], metrics['lag_p99']] == list(expected)
+    assert abs(metrics['avg_processing_lag'] - lag.mean()) < 1e-9
+
+def test_per_load_summaries_match_per_record_lags(transactions):
+    metrics = main.get_data_freshness_metrics(transactions)
+    lag = (transactions['ingestion_timestamp'].dt.normalize() - transactions['InvoiceDate'].dt.normalize()).dt.days
+    loads = lag.groupby(transactions['processing_date'])
+    by_load = metrics['lag_by_processing_date'].set_index('processing_date')
+    np.testing.assert_allclose(by_load['Mean Lag (days)'], loads.mean().loc[by_load.index])
+    p95 = loads.apply(lambda lags: np.percentile(lags, 95, method='inverted_cdf'))
+    np.testing.assert_array_equal(by_load['P95 Lag (days)'].sort_index(), p95.sort_index())
@@ -0,0 +1,22 @@
+"""Customer growth chart downsampled to its point budget"""
+import numpy as np
+import pandas as pd
+
+import main
+
+def test_downsampled_line_keeps_endpoints_on_the_full_curve(transactions):
+    daily = main.daily_growth(main.first_purchase_counts(transactions))
+    keep = main.lttb_indices(daily['Date'].to_numpy().view('int64'), daily['CumulativeCustomers'], 100)
+    assert len(keep) == min(100, len(daily)) and keep[0] == 0 and keep[-1] == len(daily) - 1
+    assert np.all(np.diff(keep) > 0)
+
+def test_chart_stays_within_the_point_budget(transactions):
+    new_customers = main.first_purchase_counts(transactions)
+    daily = main.daily_growth(new_customers)
+    last = new_customers['Date'].max().normalize()
+    for window in (None, (last - pd.Timedelta(days=89), last)):
+        fig = main.create_customer_growth_chart(new_customers, window, point_budget=50)
+        line, bars = fig.data
+        assert len(line.x) <= 50 and len(bars.x) <= 50
+        # Both ranges end on the latest day, where the running total covers every customer
+        assert line.y[-1] == daily['CumulativeCustomers'].iloc[-1]
@@ -0,0 +1,35 @@
+"""Watermark refreshes of the transaction cache"""
+import pandas as pd
+import pytest
+
+import main
+from benchmark import FakeConnector, transaction_cache
+
+@pytest.fixture
+def ingested(monkeypatch, transactions):
+    """Transactions in ingestion order, served by a connector the test can append to"""
+    rows = transactions.sort_values('ingestion_timestamp', ignore_index=True)
+    connector = FakeConnector(rows.iloc[:-500])
+    monkeypatch.setattr(main, 'sql', connector)
+    main.get_connection_pool.clear()
+    yield rows, connector
+    main.get_connection_pool.clear()
+
+def test_refresh_fetches_only_new_rows(ingested):
+    rows, connector = ingested
+    cache = transaction_cache()
+    cache.get()
+    connector.df = rows
+    frame = cache.get()
+    assert cache.last_refresh_rows < len(rows) // 2
+    assert len(frame) == len(cache.get(full_reload=True)) == len(rows)
+
+def test_reprocessed_rows_are_not_duplicated(ingested):
+    rows, connector = ingested
+    cache = transaction_cache()
+    cache.get()
+    # A reprocessed batch comes back with newer ingestion timestamps
+    reprocessed = rows.iloc[-1000:-500].assign(
+        ingestion_timestamp=rows['ingestion_timestamp'].max() + pd.Timedelta(hours=1))
+    connector.df = pd.concat([rows.iloc[:-1000], rows.iloc[-500:], reprocessed])
+    assert len(cache.get()) == len(rows)
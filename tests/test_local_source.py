@@ -0,0 +1,31 @@
+"""The app's queries on the embedded DuckDB engine over Parquet files"""
+import pandas as pd
+import pytest
+
+import main
+from benchmark import assert_aggregates_equal, write_local_dataset
+
+@pytest.fixture
+def local_source(monkeypatch, tmp_path, transactions):
+    """Serve the synthetic transactions and segment summary from Parquet files with DATA_SOURCE=local"""
+    pytest.importorskip('duckdb')
+    write_local_dataset(str(tmp_path), transactions)
+    monkeypatch.setattr(main, 'DATA_SOURCE', 'local')
+    monkeypatch.setattr(main, 'LOCAL_DATA_DIR', str(tmp_path))
+    monkeypatch.setattr(main, 'TRANSACTIONS_TABLE', 'retail_analytics.dlt.retail_transactions_silver')
+    monkeypatch.setenv('DATABASE_NAME', 'retail_analytics')
+    monkeypatch.setenv('TABLE_NAME', 'dlt.segment_summary')
+    main.get_connection_pool.clear()
+    yield
+    main.get_connection_pool.clear()
+
+def test_transactions_and_segments_load_from_parquet(local_source, transactions, segments):
+    assert len(main.query_transactions()) == len(transactions)
+    assert len(main.query_rfm_segments()) == len(segments)
+    recent = ((transactions['InvoiceDate'].max() - pd.Timedelta(days=90)).date(), None, None)
+    assert len(main.query_transactions(predicate=recent)) == len(main.filter_transactions(transactions, *recent))
+
+def test_local_aggregates_match_pandas(local_source, transactions):
+    expected = main.compute_insight_aggregates(transactions)
+    assert_aggregates_equal(expected, main.query_insight_aggregates())
+    assert_aggregates_equal(expected, main.fold_transactions())
@@ -0,0 +1,37 @@
+"""Background warm-ups of the views that are not shown"""
+import threading
+
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+import main
+
+def test_warmups_are_built_and_run_off_the_script_thread():
+    prefetcher = main.Prefetcher(min_interval=60)
+    done, calls = threading.Event(), []
+
+    def prefetch(session):
+        calls.append((session, threading.current_thread().name, get_script_run_ctx(suppress_warning=True)))
+        return done.set
+
+    assert prefetcher.request('insights', prefetch, {'insights_predicate': None})
+    assert done.wait(5)
+    assert calls == [({'insights_predicate': None}, 'prefetch-insights', None)]
+
+    # Within the interval the factory is not even called
+    assert not prefetcher.request('insights', prefetch, {})
+    assert len(calls) == 1
+
+def test_insights_warmup_reads_the_session_copy(monkeypatch):
+    monkeypatch.setattr(main, 'INSIGHTS_AGGREGATION', 'pandas')
+    handles = []
+
+    class Store:
+        def handle(self, predicate):
+            handles.append(predicate)
+
+    monkeypatch.setattr(main, 'get_transaction_store', Store)
+    monkeypatch.setattr(main, 'transaction_insights', lambda handle, approximate: approximate)
+    predicate = (None, None, ('France',))
+    warm = main.prefetch_insights({'insights_predicate': predicate, 'approximate_distinct': True})
+    assert warm() is True
+    assert handles == [predicate]
@@ -0,0 +1,43 @@
+"""Background refreshes publishing staged data together with the new version"""
+import pandas as pd
+import pytest
+
+import main
+
+@pytest.fixture
+def source(monkeypatch):
+    """A one-table source whose version and rows the test moves forward"""
+    state = {'version': 1, 'rows': 3}
+    monkeypatch.setattr(main, 'source_table_version', lambda table: state['version'])
+    cache = main.DatasetCache('values', lambda on_batch=None: pd.DataFrame({'value': range(state['rows'])}),
+                              refresh_on_read=False)
+    cache.get()
+    refresher = main.Refresher(lambda: {'values': [cache]})
+    refresher.check()
+    return state, cache, refresher
+
+def test_staged_data_and_version_switch_together(source):
+    state, cache, refresher = source
+    seen = []
+    refresher.track('values', 'total', lambda version: seen.append((version, len(cache.frame), refresher.version('values'))))
+    state.update(version=2, rows=5)
+    refresher.check()
+    # The warm-up ran against the new version while the old data was still served
+    assert seen == [(2, 3, 1)]
+    assert (len(cache.get()), refresher.version('values')) == (5, 2)
+
+def test_failed_warmup_keeps_serving_the_previous_data(source):
+    state, cache, refresher = source
+
+    def fail(version):
+        raise ConnectionError("warehouse unavailable")
+
+    refresher.track('values', 'total', fail)
+    state.update(version=2, rows=5)
+    refresher.check()
+    assert (len(cache.get()), refresher.version('values')) == (3, 1)
+    assert 'warehouse unavailable' in refresher.status()['values']['error']
+
+    refresher.track('values', 'total', lambda version: None)
+    refresher.check()
+    assert (len(cache.get()), refresher.version('values')) == (5, 2)
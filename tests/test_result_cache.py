@@ -0,0 +1,65 @@
+"""Process-wide warehouse result cache filled from any thread"""
+import threading
+
+import pytest
+
+import main
+
+def test_hits_return_the_stored_result():
+    cache = main.ResultCache()
+    loads = []
+    load = lambda: loads.append(1) or {'rows': [1, 2, 3]}
+    first = cache.get(('aggregates', (), 1), load)
+    assert cache.get(('aggregates', (), 1), load) is first
+    cache.get(('aggregates', (), 2), load)  # a new source version reloads
+    assert len(loads) == 2
+
+def test_concurrent_requests_share_one_load():
+    cache = main.ResultCache()
+    started, release = threading.Event(), threading.Event()
+    loads = []
+
+    def load():
+        loads.append(1)
+        started.set()
+        release.wait(5)
+        return 'result'
+
+    results = []
+    owner = threading.Thread(target=lambda: results.append(cache.get('key', load)))
+    owner.start()
+    started.wait(5)
+    waiter = threading.Thread(target=lambda: results.append(cache.get('key', load)))
+    waiter.start()
+    release.set()
+    owner.join(5)
+    waiter.join(5)
+    assert results == ['result', 'result']
+    assert len(loads) == 1
+
+def test_failed_loads_are_not_stored():
+    cache = main.ResultCache()
+
+    def fail():
+        raise ConnectionError("warehouse unavailable")
+
+    with pytest.raises(ConnectionError):
+        cache.get('key', fail)
+    assert cache.get('key', lambda: 'result') == 'result'
+
+def test_least_recently_used_entry_is_evicted():
+    cache = main.ResultCache(max_entries=2)
+    cache.get('a', lambda: 'a')
+    cache.get('b', lambda: 'b')
+    cache.get('a', lambda: 'reloaded')  # a hit makes 'a' the most recently used
+    cache.get('c', lambda: 'c')         # evicts 'b', not 'a'
+    assert cache.get('a', lambda: 'reloaded') == 'a'
+    assert cache.get('b', lambda: 'reloaded') == 'reloaded'
+
+def test_expired_entries_reload(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(main.time, 'monotonic', lambda: now[0])
+    cache = main.ResultCache(ttl=300)
+    cache.get('key', lambda: 'old')
+    now[0] += 301
+    assert cache.get('key', lambda: 'new') == 'new'
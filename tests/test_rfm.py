@@ -0,0 +1,40 @@
+"""In-app RFM scoring against plain grouped aggregations"""
+import numpy as np
+import pandas as pd
+import pytest
+
+import main
+from benchmark import generate_transactions
+
+@pytest.fixture(scope='module')
+def shared_invoices():
+    """Transactions where some invoices carry lines from two customers"""
+    df = generate_transactions(5_000, seed=5)
+    shared = df['InvoiceNo'].isin(df['InvoiceNo'].unique()[::7])
+    lines = shared & (np.arange(len(df)) % 5 == 4)
+    df.loc[lines, 'CustomerID'] = df['CustomerID'].max() + 1 - df.loc[lines, 'CustomerID'] % 3
+    return df
+
+def test_rfm_values_match_groupby(shared_invoices):
+    df = shared_invoices
+    customers = main.compute_customer_rfm(df).set_index('CustomerID').sort_index()
+    reference_date = df['InvoiceDate'].max().normalize() + pd.Timedelta(days=1)
+    expected = df.groupby('CustomerID').agg(
+        last=('InvoiceDate', 'max'), Frequency=('InvoiceNo', 'nunique'), Monetary=('TotalPrice', 'sum'))
+    expected['Recency'] = (reference_date - expected['last']).dt.days
+    for column in ('Recency', 'Frequency', 'Monetary'):
+        np.testing.assert_allclose(customers[column].to_numpy(), expected[column].to_numpy(), rtol=1e-9)
+
+def test_streamed_state_scores_like_the_frame(shared_invoices):
+    aggregates = main.RunningAggregates()
+    for start in range(0, len(shared_invoices), 1_000):
+        aggregates.add(shared_invoices.iloc[start:start + 1_000])
+    streamed = main.customer_rfm_from_state(aggregates.result()['customers'])
+    pd.testing.assert_frame_equal(main.compute_customer_rfm(shared_invoices), streamed, check_dtype=False)
+
+def test_tied_values_share_a_score():
+    scores = main.quintile_scores(np.array([1, 1, 1, 1, 1, 1, 2, 3, 4, 5]))
+    assert scores[:6].tolist() == [1] * 6
+    assert scores[6:].tolist() == [4, 4, 5, 5]
+    recency = main.quintile_scores(np.array([10, 10, 10, 10, 20]), higher_is_better=False)
+    assert recency.tolist() == [5, 5, 5, 5, 1]
@@ -0,0 +1,29 @@
+"""Sessions share the cached frame without their edits reaching it"""
+import numpy as np
+
+import main
+from benchmark import FakeConnector, transaction_cache
+
+def test_session_edits_stay_local(transactions, monkeypatch):
+    monkeypatch.setattr(main, 'sql', FakeConnector(transactions))
+    main.get_connection_pool.clear()
+    cache = transaction_cache()
+    cache.refresh_seconds = 3600
+    expected = cache.get()['TotalPrice'].sum()
+
+    # A careless chart function that rewrites columns in place
+    for view in (cache.get(), cache.handle().frame):
+        view['TotalPrice'] = view['TotalPrice'] * 0
+        view.loc[view.index[0], 'Quantity'] = -1
+        view.drop(columns=['Country'], inplace=True)
+    fresh = cache.get()
+    assert fresh['TotalPrice'].sum() == expected
+    assert fresh['Quantity'].iloc[0] != -1 and 'Country' in fresh
+
+def test_views_share_column_data_under_copy_on_write(transactions, monkeypatch):
+    monkeypatch.setattr(main, 'sql', FakeConnector(transactions))
+    main.get_connection_pool.clear()
+    cache = transaction_cache()
+    cache.refresh_seconds = 3600
+    first, second = cache.get(), cache.get()
+    assert np.shares_memory(first['TotalPrice'].to_numpy(), second['TotalPrice'].to_numpy()) == main.copy_on_write()
@@ -0,0 +1,66 @@
+"""On-disk snapshot versions, eviction and cold starts"""
+import time
+
+import pandas as pd
+
+import main
+from benchmark import FakeConnector, transaction_cache
+
+def frame(rows):
+    return pd.DataFrame({'value': range(rows)})
+
+def wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+def test_keep_versions_zero_keeps_only_the_newest(tmp_path):
+    store = main.SnapshotStore(str(tmp_path), keep_versions=0)
+    store.save('orders', frame(10))
+    newest = store.save('orders', frame(20))
+    assert list(store.usage()) == [newest.rsplit('/', 1)[1]]
+    assert len(store.load('orders')[0]) == 20
+
+def test_size_cap_never_evicts_the_snapshot_just_written(tmp_path):
+    store = main.SnapshotStore(str(tmp_path), max_bytes=1, keep_versions=3)
+    store.save('orders', frame(10))
+    saved = store.save('customers', frame(1000))
+    assert list(store.usage()) == [saved.rsplit('/', 1)[1]]
+
+def test_size_cap_evicts_older_versions_before_other_datasets(tmp_path):
+    store = main.SnapshotStore(str(tmp_path), keep_versions=3)
+    store.save('orders', frame(1000))
+    store.save('customers', frame(1000))
+    store.save('orders', frame(1000))
+    store.max_bytes = sum(store.usage().values())
+    store.save('orders', frame(1000))
+    names = [name.rsplit('-', 1)[0] for name in store.usage()]
+    assert sorted(names) == ['customers', 'orders', 'orders']
+
+def test_refreshes_within_the_interval_do_not_rewrite_the_snapshot(tmp_path, transactions, monkeypatch):
+    ingested = transactions.sort_values('ingestion_timestamp', ignore_index=True)
+    connector = FakeConnector(ingested.iloc[:-1000])
+    monkeypatch.setattr(main, 'sql', connector)
+    main.get_connection_pool.clear()
+    store = main.SnapshotStore(str(tmp_path), min_interval=3600)
+    cache = transaction_cache(snapshots=store)
+    cache.get()
+    wait_for(store.usage)
+    connector.df = ingested
+    assert len(cache.get()) == len(ingested)
+    time.sleep(0.1)
+    assert len(store.usage()) == 1
+
+def test_cold_start_serves_the_snapshot(tmp_path, transactions, monkeypatch):
+    monkeypatch.setattr(main, 'sql', FakeConnector(transactions))
+    main.get_connection_pool.clear()
+    store = main.SnapshotStore(str(tmp_path))
+    loaded = transaction_cache(snapshots=store).get()
+    wait_for(store.usage)
+
+    cache = transaction_cache(snapshots=store)
+    restored = cache.get()
+    assert cache.source == 'snapshot'
+    pd.testing.assert_frame_equal(restored, loaded)
+    wait_for(lambda: not cache.status()['refreshing'])
@@ -0,0 +1,55 @@
+"""Streamed aggregation against the pandas reference, within its memory budget"""
+import os
+import subprocess
+import sys
+
+import pandas as pd
+import pytest
+
+import main
+import benchmark
+from benchmark import assert_aggregates_equal
+
+def test_streamed_aggregates_match_pandas(transactions, warehouse):
+    warehouse({'transactions': transactions})
+    result = main.fold_transactions(memory_budget=4 * 1024 * 1024)
+    assert result['stream_stats']['batches'] > 1
+    assert_aggregates_equal(main.compute_insight_aggregates(transactions), result)
+
+    expected = main.freshness_metrics(main.freshness_histogram(transactions))
+    actual = main.freshness_metrics(result['freshness'])
+    for key, value in expected.items():
+        if isinstance(value, pd.DataFrame):
+            pd.testing.assert_frame_equal(value, actual[key].sort_values('processing_date').reset_index(drop=True),
+                                          check_dtype=False)
+        else:
+            assert value == actual[key], key
+
+@pytest.mark.parametrize('text_ids', [False, True])
+def test_streamed_customer_state_scores_like_pandas(transactions, warehouse, text_ids):
+    if text_ids:
+        transactions = transactions.assign(CustomerID='C' + transactions['CustomerID'].astype('int64').astype(str))
+    warehouse({'transactions': transactions})
+    result = main.fold_transactions(memory_budget=4 * 1024 * 1024)
+    # Text ids are scored in first-seen order by pandas, so rows are compared by id
+    expected, actual = (frame.sort_values('CustomerID', ignore_index=True) for frame in (
+        main.compute_customer_rfm(transactions), main.customer_rfm_from_state(result['customers'])
+    ))
+    pd.testing.assert_frame_equal(expected, actual, check_dtype=False)
+
+def test_state_over_budget_fails_instead_of_growing(transactions):
+    aggregates = main.RunningAggregates(memory_budget=64 * 1024)
+    with pytest.raises(MemoryError, match="STREAM_MEMORY_BUDGET_BYTES"):
+        for start in range(0, len(transactions), 1_000):
+            aggregates.add(transactions.iloc[start:start + 1_000])
+        aggregates.result()
+
+@pytest.mark.skipif(not os.path.exists('/proc/self/status'), reason="peak RSS is read from /proc (Linux only)")
+def test_streamed_load_peak_rss_stays_under_the_budget():
+    budget = 32 * 1024 * 1024
+    # A fresh process, so the peak is the streamed load's and not this test run's
+    output = subprocess.run(
+        [sys.executable, benchmark.__file__, '--streaming-rss', '500000', '--budget', str(budget)],
+        capture_output=True, text=True, check=True
+    ).stdout
+    assert int(output.split()[-1]) < budget
@@ -0,0 +1,63 @@
+"""Stage tracing per run, including fragment reruns and background threads"""
+import json
+import threading
+
+import main
+
+def traced(name):
+    with main.trace_stage('build', name):
+        pass
+
+def test_worker_threads_trace_as_child_runs(monkeypatch, tmp_path):
+    tracer = main.Tracer(enabled=True, export_dir=str(tmp_path))
+    monkeypatch.setattr(main, 'get_tracer', lambda: tracer)
+    with tracer.run() as script:
+        traced('in script')
+        workers = [threading.Thread(target=tracer.bind(lambda: traced('in thread'), 'load')),
+                   threading.Thread(target=tracer.bind(lambda: None, 'prefetch'))]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+    assert [span['name'] for span in script['spans']] == ['in script']
+    children = tracer.child_runs(script)
+    # The prefetch traced nothing, so its run was dropped
+    assert [(child['kind'], [span['name'] for span in child['spans']]) for child in children] == [
+        ('load', ['in thread'])
+    ]
+    exported = [json.loads(line) for line in (tmp_path / 'trace.jsonl').read_text().splitlines()]
+    assert {(line['kind'], line['parent'], line['name']) for line in exported} == {
+        ('script', None, 'in script'), ('load', script['run'], 'in thread')
+    }
+
+def test_fragment_reruns_open_their_own_run(monkeypatch):
+    tracer = main.Tracer(enabled=True)
+    monkeypatch.setattr(main, 'get_tracer', lambda: tracer)
+    render = main.traced_fragment(lambda: traced('fragment body'))
+
+    with tracer.run() as script:
+        render()  # a full rerun traces the fragment as part of the script run
+    render()      # a fragment rerun runs the body alone
+    assert [span['name'] for span in script['spans']] == ['fragment body']
+    fragment = tracer.current_run()
+    assert fragment['kind'] == 'fragment' and fragment['seconds'] is not None
+    assert [span['name'] for span in fragment['spans']] == ['fragment body']
+
+def test_spans_outside_runs_only_count_toward_totals():
+    tracer = main.Tracer(enabled=True)
+    with tracer.stage('fetch', 'arrow') as span:
+        span.rows = 10
+    assert not tracer.runs
+    assert tracer.totals[('fetch', 'arrow')][:1] == [1]
+    assert tracer.totals[('fetch', 'arrow')][3] == 10
+
+def test_nested_run_restores_the_enclosing_run():
+    tracer = main.Tracer(enabled=True)
+    with tracer.run() as script:
+        with tracer.run('refresh'):
+            with tracer.stage('refresh'):
+                pass
+        with tracer.stage('render'):
+            pass
+    assert [span['stage'] for span in script['spans']] == ['render']